@@ -0,0 +1,2 @@
+from .blocks import BLOCKS, MEMORY_SIZES, DIMS, run_benchmarks, compare
+from .memory import profile_config, format_table
@@ -0,0 +1,159 @@
+import os
+import sys
+import time
+import platform
+import torch
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from config.configure import load_config
+from config import compile_config
+from model.TokenLearner import TokenLearnerModule, TokenLearnerModuleV11, TokenLearnerModuleV12
+import model.TTM as TTM
+import model.LMTTM as LMTTM
+
+# Forward and forward+backward times of the building blocks on the cpu, over the
+# memory_tokens_size x dim grid of the exp_memory_* sweeps. A block is a function
+# (memory_tokens_size, dim, batch) -> (module or None, fn, inputs), fn(*inputs) is timed.
+
+MEMORY_SIZES = [64, 160, 256, 352, 448]
+DIMS = [64, 160, 256, 352, 448]
+
+def make_spec(memory_tokens_size, dim, batch, **model):
+    overlay = {"batch_size": batch, "model": dict(model, memory_tokens_size=memory_tokens_size, dim=dim, drop_r=0.0)}
+    return compile_config(load_config("base.json", overlay))
+
+def _tokens(spec, tokens):
+    return torch.rand(spec.batch_size, tokens, spec.model.dim)
+
+def token_learner(mem, dim, batch):
+    spec = make_spec(mem, dim, batch, model="ttm")
+    module = TokenLearnerModule(dim, spec.model.summerize_num_tokens, 1, 0.0)
+    return module, module, [_tokens(spec, mem + spec.model.input_tokens)]
+
+def token_learner_v11(mem, dim, batch):
+    spec = make_spec(mem, dim, batch, model="ttm")
+    module = TokenLearnerModuleV11(dim, spec.model.summerize_num_tokens, 1, 0.0)
+    return module, module, [_tokens(spec, mem + spec.model.input_tokens)]
+
+def token_learner_v12(mem, dim, batch):
+    spec = make_spec(mem, dim, batch, model="ttm")
+    tokens = mem + spec.model.input_tokens
+    module = TokenLearnerModuleV12(tokens, spec.model.summerize_num_tokens, 1, 0.0, dim)
+    return module, module, [_tokens(spec, tokens)]
+
+def memory_driven_read(mem, dim, batch):
+    spec = make_spec(mem, dim, batch, model="ttm", memory_mode="TL-V12")
+    module = TTM.TokenTuringMachineUnit(spec)
+    return module, module.summerize, [_tokens(spec, mem + spec.model.input_tokens)]
+
+def add_erase_write(mem, dim, batch):
+    spec = make_spec(mem, dim, batch, model="ttm", memory_mode="TL-AddErase")
+    module = TTM.TokenAddEraseWrite(spec)
+    return module, module, [_tokens(spec, spec.model.add_erase_input), _tokens(spec, spec.model.summerize_num_tokens)]
+
+def linked_memory(mem, dim, batch):
+    spec = make_spec(mem, dim, batch, model="lmttm")
+    module = LMTTM.LinkedMemoryTTM(spec)
+    def read_write(memory_tokens):
+        current_memory_block, prev_memory_block, next_memory_block = module.ReadFromDNC(memory_tokens)
+        return module.WriteToDNC(current_memory_block + prev_memory_block + next_memory_block)
+    return None, read_write, [_tokens(spec, mem)]
+
+def process_unit(name, model="ttm"):
+    def block(mem, dim, batch):
+        spec = make_spec(mem, dim, batch, model=model, process_unit=name)
+        module = (TTM if model == "ttm" else LMTTM).TokenTuringMachineUnit(spec)
+        # lmttm processes the summaries of the current, previous and next memory blocks together
+        tokens = spec.model.summerize_num_tokens * (3 if model == "lmttm" else 1)
+        return module, module.process, [_tokens(spec, tokens)]
+    return block
+
+def encoder(name):
+    def block(mem, dim, batch):
+        spec = make_spec(mem, dim, batch, model=name.lower())
+        module = getattr(TTM if name == "TTM" else LMTTM, "TokenTuringMachineEncoder")(spec)
+        input = torch.rand(batch, spec.model.in_channels, spec.model.step, spec.train.input_H, spec.train.input_W)
+        return module, lambda input: module(input, None)[0], [input]
+    return block
+
+BLOCKS = {
+    "token_learner": token_learner,
+    "token_learner_v11": token_learner_v11,
+    "token_learner_v12": token_learner_v12,
+    "memory_driven_read": memory_driven_read,
+    "add_erase_write": add_erase_write,
+    "linked_memory": linked_memory,
+    "process_transformer": process_unit("transformer"),
+    "process_mixer": process_unit("mixer"),
+    "process_mlp": process_unit("mlp"),
+    "process_transformer_lmttm": process_unit("transformer", "lmttm"),
+    "process_mlp_lmttm": process_unit("mlp", "lmttm"),
+    "encoder_ttm": encoder("TTM"),
+    "encoder_lmttm": encoder("LMTTM"),
+}
+
+def _median_ms(fn, repeats, warmup):
+    for _ in range(warmup):
+        fn()
+    times = []
+    for _ in range(repeats):
+        time1 = time.perf_counter()
+        fn()
+        times.append((time.perf_counter() - time1) * 1000)
+    return sorted(times)[len(times) // 2]
+
+def time_block(block, mem, dim, batch=2, repeats=5, warmup=2):
+    '''
+    return: (forward ms, forward+backward ms), the medians of repeats runs
+    '''
+    torch.manual_seed(3407)
+    module, fn, inputs = block(mem, dim, batch)
+    if module is not None:
+        module.train()
+    def forward():
+        with torch.no_grad():
+            fn(*inputs)
+    grad_inputs = [x.clone().requires_grad_(True) for x in inputs]
+    def forward_backward():
+        fn(*grad_inputs).sum().backward()
+    return _median_ms(forward, repeats, warmup), _median_ms(forward_backward, repeats, warmup)
+
+def run_benchmarks(blocks=None, memory_sizes=MEMORY_SIZES, dims=DIMS, batch=2, repeats=5, warmup=2, threads=1, log=print):
+    '''
+    return: {"meta": {...}, "results": [{"block", "memory_tokens_size", "dim", "forward_ms", "forward_backward_ms"}]}
+    '''
+    torch.set_num_threads(threads)
+    results = []
+    for name in blocks or list(BLOCKS.keys()):
+        for mem in memory_sizes:
+            for dim in dims:
+                forward_ms, forward_backward_ms = time_block(BLOCKS[name], mem, dim, batch, repeats, warmup)
+                results.append({"block": name, "memory_tokens_size": mem, "dim": dim,
+                                "forward_ms": round(forward_ms, 4), "forward_backward_ms": round(forward_backward_ms, 4)})
+                if log is not None:
+                    log(f"{name:<26}mem {mem:>4} dim {dim:>4}  fwd {forward_ms:>9.2f}ms  fwd+bwd {forward_backward_ms:>9.2f}ms")
+    meta = {"torch": torch.__version__, "python": platform.python_version(), "machine": platform.machine(),
+            "processor": platform.processor(), "threads": threads, "batch": batch, "repeats": repeats}
+    return {"meta": meta, "results": results}
+
+def compare(baseline, current, threshold=0.10):
+    '''
+    baseline, current: outputs of run_benchmarks
+    threshold: the relative slow down flagged as a regression
+    return: (lines of the comparison table, the regressions as (block, mem, dim, metric, ratio))
+    '''
+    base = {(r["block"], r["memory_tokens_size"], r["dim"]): r for r in baseline["results"]}
+    lines = [f"{'block':<26}{'mem':>5}{'dim':>5}{'fwd':>9}{'fwd+bwd':>9}"]
+    regressions = []
+    for r in current["results"]:
+        key = (r["block"], r["memory_tokens_size"], r["dim"])
+        if key not in base:
+            continue
+        ratios = []
+        for metric in ["forward_ms", "forward_backward_ms"]:
+            ratio = r[metric] / max(base[key][metric], 1e-9)
+            ratios.append(ratio)
+            if ratio > 1 + threshold:
+                regressions.append(key + (metric, ratio))
+        flag = "  <- regression" if max(ratios) > 1 + threshold else ""
+        lines.append(f"{key[0]:<26}{key[1]:>5}{key[2]:>5}{ratios[0]:>8.2f}x{ratios[1]:>8.2f}x{flag}")
+    return lines, regressions
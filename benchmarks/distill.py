@@ -0,0 +1,63 @@
+import os
+import sys
+import json
+import torch
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from config import compile_config
+from config.configure import config_arg_parser, get_config
+from utils.checkpoint import checkpoint_path
+from utils.distill import teacher_config
+from utils.flops import estimate, format_count
+from benchmarks.temporal_sampling import throughput, accuracy
+
+# The student of a distillation run (train.py with train.distill_teacher) against its teacher:
+# parameters (those the configure runs), FLOPs per sample, eval forward and training step throughput on random inputs, and
+# the test accuracy of both checkpoints.
+# python benchmarks/distill.py base.json --overlay '{"train": {"name": "student0", "distill_teacher": "check_point/exp24_mem448_dim448/exp24_mem448_dim448_epoch_10.pth", "distill_teacher_model": {"model": {"dim": 448, "memory_tokens_size": 448}}}}'
+
+def distill_report(config, student_checkpoint, device="cpu", repeats=5):
+    '''
+    return: {"teacher": row, "student": row, "speedup", "train_speedup", "acc_change"}
+    '''
+    rows = {}
+    for name, run_config, checkpoint in [("teacher", teacher_config(config), config["train"]["distill_teacher"]),
+                                         ("student", config, student_checkpoint)]:
+        spec = compile_config(run_config)
+        costs = estimate(spec)
+        forward, train_step = throughput(spec, device, repeats)
+        rows[name] = {"dim": spec.model.dim, "memory_tokens_size": spec.model.memory_tokens_size, "num_blocks": spec.model.num_blocks,
+                      "params": costs["total_params"] - costs["params"]["unused"], "flops": costs["total_flops"], "forward_samples_s": round(forward, 2),
+                      "train_samples_s": round(train_step, 2), "acc": round(accuracy(spec, run_config, checkpoint, device), 2)}
+    teacher, student = rows["teacher"], rows["student"]
+    return {"teacher": teacher, "student": student,
+            "speedup": round(student["forward_samples_s"] / teacher["forward_samples_s"], 2),
+            "train_speedup": round(student["train_samples_s"] / teacher["train_samples_s"], 2),
+            "acc_change": round(student["acc"] - teacher["acc"], 2)}
+
+
+if __name__ == "__main__":
+    parser = config_arg_parser("speedup and accuracy of a distilled student against its teacher")
+    parser.add_argument("--checkpoint", default=None, help="the student checkpoint, the last one of train.name by default")
+    parser.add_argument("--device", default="cuda" if torch.cuda.is_available() else "cpu")
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--threads", type=int, default=None)
+    parser.add_argument("--out", default=None, help="write the report to this json file")
+    args = parser.parse_args()
+    if args.threads:
+        torch.set_num_threads(args.threads)
+    config = get_config(args)
+    spec = compile_config(config)
+    if not spec.train.distill_teacher:
+        parser.error("the configure has no train.distill_teacher")
+
+    report = distill_report(config, args.checkpoint or checkpoint_path(spec.train.name, 10), args.device, args.repeats)
+    print(f"{'':<9}{'dim':>5}{'mem':>5}{'blocks':>7}{'params':>10}{'FLOPs':>10}{'fwd smp/s':>11}{'train smp/s':>12}{'acc':>9}")
+    for name in ["teacher", "student"]:
+        r = report[name]
+        print(f"{name:<9}{r['dim']:>5}{r['memory_tokens_size']:>5}{r['num_blocks']:>7}{format_count(r['params']):>10}"
+              f"{format_count(r['flops']):>10}{r['forward_samples_s']:>11.1f}{r['train_samples_s']:>12.1f}{r['acc']:>8.2f}%")
+    print(f"the student is {report['speedup']:.2f}x faster at inference, {report['train_speedup']:.2f}x in training, "
+          f"{report['acc_change']:+.2f} points of accuracy")
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(report, f, indent=4)
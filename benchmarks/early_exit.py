@@ -0,0 +1,98 @@
+import os
+import sys
+import json
+import time
+import torch
+import torch.utils.data as data
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from config import compile_config
+from config.configure import config_arg_parser, get_config
+from datasets import get_dataset
+from utils.checkpoint import build_encoder, checkpoint_path, load_checkpoint
+from utils.micro_batch import batch_rows, memory_flags
+from utils.early_exit import EarlyExit, calibrate
+
+# The accuracy / steps / latency trade-off of the early exit (utils/early_exit.py) for one
+# checkpoint. The temperature is fitted on the val split, then the test split is run once with
+# every step and once per threshold; every pass sees the same batches, starts from the memory of
+# the checkpoint and the first linked memory block, and seeds the random positional embeddings
+# the same. Put the fitted temperature and the chosen threshold in model.early_exit_*.
+# python benchmarks/early_exit.py base.json --overlay '{"train": {"name": "exp0"}}' --thresholds 0.8 0.9 0.95 0.99 --k 2
+
+def run_pass(model, loader, memory_tokens, early_exit, device):
+    '''
+    return: (predictions [N], targets [N], steps [N] or None without early_exit, seconds)
+    '''
+    torch.manual_seed(3407)
+    for module in memory_flags(model)[0]:
+        module.current_flag = 0
+    predictions, targets, steps = [], [], []
+    seconds = 0.0
+    with torch.no_grad():
+        for x, y in loader:
+            x = x.to(device, dtype=torch.float32)
+            time1 = time.perf_counter()
+            with batch_rows(model, 0, x.size(0)):
+                if early_exit is None:
+                    out, memory_tokens = model(x, memory_tokens)
+                else:
+                    out, memory_tokens = model.forward_early_exit(x, memory_tokens, early_exit)
+            if device == "cuda":
+                torch.cuda.synchronize()
+            seconds += time.perf_counter() - time1
+            predictions.append(out.argmax(1).cpu())
+            targets.append(y.reshape(-1))
+            if early_exit is not None:
+                steps.append(early_exit.steps.cpu())
+    return torch.cat(predictions), torch.cat(targets), torch.cat(steps) if steps else None, seconds
+
+def early_exit_report(config, checkpoint, thresholds, k=2, temperature=None, device="cpu"):
+    '''
+    temperature: fitted on the val split when None
+    return: (temperature, one dict per threshold, the first for the full forward)
+    '''
+    spec = compile_config(config)
+    model = build_encoder(spec, device).eval()
+    memory_tokens = load_checkpoint(checkpoint, model, device)
+    if not spec.train.load_memory_tokens:
+        memory_tokens = None
+    def loader(split):
+        return data.DataLoader(get_dataset(split, config=config), batch_size=spec.batch_size, shuffle=False, drop_last=True)
+    if temperature is None:
+        temperature = calibrate(model, loader("val"), memory_tokens, device)
+    test = loader("test")
+    predictions, targets, _, full_seconds = run_pass(model, test, memory_tokens, None, device)
+    full = predictions
+    rows = [{"threshold": None, "acc": round(float((predictions == targets).float().mean()) * 100, 2), "agreement": 100.0,
+             "avg_steps": spec.model.sampled_steps, "seconds": round(full_seconds, 4), "latency_saved": 0.0}]
+    for threshold in thresholds:
+        predictions, targets, steps, seconds = run_pass(model, test, memory_tokens, EarlyExit(threshold, k, temperature), device)
+        rows.append({"threshold": threshold, "acc": round(float((predictions == targets).float().mean()) * 100, 2),
+                     "agreement": round(float((predictions == full).float().mean()) * 100, 2),
+                     "avg_steps": round(float(steps.float().mean()), 2), "seconds": round(seconds, 4),
+                     "latency_saved": round(1 - seconds / full_seconds, 4)})
+    return temperature, rows
+
+
+if __name__ == "__main__":
+    parser = config_arg_parser("accuracy, steps and latency of the early exit per confidence threshold")
+    parser.add_argument("--checkpoint", default=None, help="the last checkpoint of train.name by default")
+    parser.add_argument("--thresholds", nargs="+", type=float, default=[0.8, 0.9, 0.95, 0.99])
+    parser.add_argument("--k", type=int, default=2, help="confident steps in a row before a sample exits")
+    parser.add_argument("--temperature", type=float, default=None, help="skip the calibration on the val split")
+    parser.add_argument("--device", default="cuda" if torch.cuda.is_available() else "cpu")
+    parser.add_argument("--out", default=None, help="write the temperature and the rows to this json file")
+    args = parser.parse_args()
+    config = get_config(args)
+    spec = compile_config(config)
+
+    temperature, rows = early_exit_report(config, args.checkpoint or checkpoint_path(spec.train.name, 10), args.thresholds,
+                                          args.k, args.temperature, args.device)
+    print(f"temperature {temperature:.3f}, k {args.k}, {spec.model.sampled_steps} steps")
+    print(f"{'threshold':>10}{'acc':>8}{'agree':>8}{'steps':>8}{'seconds':>10}{'saved':>8}")
+    for r in rows:
+        threshold = "full" if r["threshold"] is None else f"{r['threshold']:.3f}"
+        print(f"{threshold:>10}{r['acc']:>7.2f}%{r['agreement']:>7.2f}%{r['avg_steps']:>8.2f}{r['seconds']:>10.3f}{r['latency_saved']:>7.1%}")
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump({"temperature": temperature, "k": args.k, "rows": rows}, f, indent=4)
@@ -0,0 +1,103 @@
+import os
+import sys
+import copy
+import json
+import time
+import tempfile
+import torch
+import torch.utils.data as data
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from config.configure import load_config, config_arg_parser
+from config import compile_config
+from datasets import get_dataset
+from datasets.feature_cache import build_feature_cache, FeatureDataset
+from utils.micro_batch import batch_rows
+from utils.checkpoint import build_encoder
+
+# Epoch time of preprocess_mode resnet18 (the backbone runs on every clip of every epoch) against
+# resnet18-cached (the backbone runs once, datasets/feature_cache.py, then only pre_dim and the
+# memory unit), with the break-even number of epochs of the one-off cache build.
+# python benchmarks/feature_cache.py base.json --overlay '{"dataset_name": "hmdb_dataset0"}' --epochs 2
+# python benchmarks/feature_cache.py base.json --overlay '{"dataset_name": "hmdb_dataset0"}' --synthetic 64 --out feature_cache.json   (random clips, no download)
+
+class SyntheticClips(data.Dataset):
+    def __init__(self, size, step, H, W, num_classes, seed=3407) -> None:
+        super().__init__()
+        generator = torch.Generator().manual_seed(seed)
+        self.clips = torch.rand(size, 3, step, H, W, generator=generator)
+        self.labels = torch.randint(num_classes, (size, 1), generator=generator)
+
+    def __getitem__(self, index):
+        return self.clips[index], self.labels[index]
+
+    def __len__(self):
+        return self.clips.shape[0]
+
+def train_epoch(spec, dataset, batch_size, device):
+    '''
+    return: seconds of one training epoch over dataset, as train.py runs it
+    '''
+    torch.manual_seed(3407)
+    model = build_encoder(spec, device).train()
+    optimizer = torch.optim.Adam(model.parameters(), lr=1e-4)
+    loader = data.DataLoader(dataset, batch_size=batch_size, shuffle=True, drop_last=True, num_workers=0)
+    citizer = torch.nn.CrossEntropyLoss()
+    memory_tokens = None
+    time1 = time.time()
+    for input, target in loader:
+        input = input.to(device, dtype=torch.float32)
+        target = target.to(device, dtype=torch.long).squeeze(1)
+        with batch_rows(model, 0, input.size(0)):
+            out, memory_tokens = model(input, memory_tokens)
+        memory_tokens = memory_tokens.detach()
+        loss = citizer(out, target)
+        optimizer.zero_grad()
+        loss.backward()
+        optimizer.step()
+    if device == "cuda":
+        torch.cuda.synchronize()
+    return time.time() - time1
+
+def _with_mode(json_path, overlay, preprocess_mode):
+    overlay = copy.deepcopy(overlay or {})
+    overlay.setdefault("model", {})["preprocess_mode"] = preprocess_mode
+    return load_config(json_path, overlay)
+
+def run(json_path, overlay=None, epochs=1, synthetic=0, device="cpu"):
+    spec = compile_config(_with_mode(json_path, overlay, "resnet18"))
+    cached = _with_mode(json_path, overlay, "resnet18-cached")
+    if synthetic:
+        cached["feature_cache_dir"] = tempfile.mkdtemp(prefix="feature_cache_")# never mix random clips into the real cache
+        clips = SyntheticClips(synthetic, spec.model.step, spec.train.input_H, spec.train.input_W, spec.model.out_class_num)
+    else:
+        clips = get_dataset("train", download=True, config=cached, raw=True)
+    time1 = time.time()
+    features = FeatureDataset(*build_feature_cache(cached, "train", dataset=clips, device=device))
+    build = time.time() - time1
+    resnet18 = min(train_epoch(spec, clips, spec.batch_size, device) for _ in range(epochs))
+    resnet18_cached = min(train_epoch(compile_config(cached), features, spec.batch_size, device) for _ in range(epochs))
+    saved = resnet18 - resnet18_cached
+    return {"dataset": "synthetic" if synthetic else spec.dataset_name, "clips": len(clips), "model": spec.model.model.value,
+            "resnet18_epoch_s": round(resnet18, 3), "resnet18_cached_epoch_s": round(resnet18_cached, 3),
+            "cache_build_s": round(build, 3), "speedup": round(resnet18 / resnet18_cached, 2),
+            "break_even_epochs": round(build / saved, 2) if saved > 0 else None}
+
+
+if __name__ == "__main__":
+    parser = config_arg_parser("epoch time of the resnet18 preprocess with and without the feature cache")
+    parser.add_argument("--epochs", type=int, default=1, help="the best of this many epochs per mode")
+    parser.add_argument("--synthetic", type=int, default=0, help="time on this many random clips instead of the train split")
+    parser.add_argument("--device", default="cuda" if torch.cuda.is_available() else "cpu")
+    parser.add_argument("--threads", type=int, default=None)
+    parser.add_argument("--out", default=None, help="write the row to this json file")
+    args = parser.parse_args()
+    if args.threads:
+        torch.set_num_threads(args.threads)
+
+    row = run(args.json_path, json.loads(args.overlay) if args.overlay else None, args.epochs, args.synthetic, args.device)
+    print(f"{row['dataset']} ({row['clips']} clips, {row['model']}): resnet18 {row['resnet18_epoch_s']:.2f}s/epoch, "
+          f"resnet18-cached {row['resnet18_cached_epoch_s']:.2f}s/epoch ({row['speedup']:.1f}x), "
+          f"cache built once in {row['cache_build_s']:.2f}s, paid back after {row['break_even_epochs']} epochs")
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(row, f, indent=4)
@@ -0,0 +1,154 @@
+import os
+import sys
+import json
+import argparse
+import itertools
+import torch
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from benchmarks.blocks import make_spec
+from utils.profiling import StageTimer
+from utils.micro_batch import batch_rows, SavedBytes
+from utils.checkpoint import build_encoder
+
+# How the training memory of the encoder scales with step, memory_tokens_size, dim,
+# summerize_num_tokens and memory_mode. One training step is run at batch 1 and 2: the tensors
+# saved for backward are attributed to the stage (utils/profiling.stage) they are saved in, the
+# per sample and fixed memory come from the difference of the two, which gives the peak at any
+# batch and the largest batch that fits a budget. On cuda the allocator peak is measured as well;
+# on the cpu the peak is the estimate weights + grads + optimizer states + saved activations.
+# The fixed part also holds the activations that do not grow with the batch.
+
+OPTIMIZER_STATES = {"Adam": 2, "RMSprop": 1}# tensors of the size of the weights kept by the optimizer
+
+class StageMemory(StageTimer):
+    '''
+    Records the tensors saved for backward per stage, use as the pack hook of saved_tensors_hooks.
+    Args:
+    - top (int): the largest tensors kept per stage.
+    '''
+    def __init__(self, model, top=3) -> None:
+        super().__init__(sync=False)
+        self.top = top
+        self.counter = SavedBytes(model)
+        self.saved = {}# stage -> bytes
+        self.largest = {}# stage -> [(bytes, shape)]
+
+    def begin(self, name):
+        path = self.stack[-1] + "/" + name if self.stack else name
+        self.stack.append(path)
+
+    def end(self):
+        self.stack.pop()
+
+    def pack(self, tensor):
+        nums = self.counter.count(tensor)
+        if nums == 0:
+            return tensor
+        path = self.stack[-1] if self.stack else "other"
+        self.saved[path] = self.saved.get(path, 0) + nums
+        largest = self.largest.setdefault(path, [])
+        largest.append((nums, list(tensor.shape)))
+        largest.sort(key=lambda item: -item[0])
+        del largest[self.top:]
+        return tensor
+
+def measure_step(spec, batch, device="cpu", top=3):
+    '''
+    One forward + backward at batch.
+    return: {"activations": bytes saved for backward, "stages": {stage: bytes}, "largest": {stage: [(bytes, shape)]},
+    "trained_bytes": bytes of the parameters that got a gradient, "cuda_peak": allocator peak in bytes or None}
+    '''
+    torch.manual_seed(3407)
+    model = build_encoder(spec, device)
+    model.train()
+    input = torch.rand(batch, spec.model.in_channels, spec.model.step, spec.train.input_H, spec.train.input_W, device=device)
+    if device == "cuda":
+        torch.cuda.synchronize()
+        torch.cuda.reset_peak_memory_stats()
+    recorder = StageMemory(model, top)
+    with recorder, torch.autograd.graph.saved_tensors_hooks(recorder.pack, lambda tensor: tensor), batch_rows(model, 0, batch):
+        out, _ = model(input, None)
+    out.sum().backward()
+    trained_bytes = sum(p.numel() * p.element_size() for p in model.parameters() if p.grad is not None)
+    cuda_peak = None
+    if device == "cuda":
+        torch.cuda.synchronize()
+        cuda_peak = torch.cuda.max_memory_allocated()
+    return {"activations": sum(recorder.saved.values()), "stages": recorder.saved, "largest": recorder.largest,
+            "trained_bytes": trained_bytes, "cuda_peak": cuda_peak}
+
+def profile_config(spec, batch, budget_mb=None, device="cpu", top=3):
+    '''
+    return: a row of the table, sizes in MB
+    '''
+    model = build_encoder(spec, "cpu")
+    param_bytes = sum(p.numel() * p.element_size() for p in model.parameters())
+    one = measure_step(spec, 1, device, top)
+    two = measure_step(spec, 2, device, top)
+    per_sample = two["activations"] - one["activations"]
+    # the grads and optimizer states only exist for the parameters in use (not e.g. the unused resnet18 front-end)
+    fixed = param_bytes + one["trained_bytes"] * (1 + OPTIMIZER_STATES.get(spec.train.optimizer, 2)) + one["activations"] - per_sample
+    row = {"model": spec.model.model.value, "memory_mode": spec.model.memory_mode.value, "step": spec.model.step,
+           "memory_tokens_size": spec.model.memory_tokens_size, "dim": spec.model.dim,
+           "summerize_num_tokens": spec.model.summerize_num_tokens,
+           "params_mb": param_bytes / 2**20, "per_sample_mb": per_sample / 2**20, "fixed_mb": fixed / 2**20,
+           "batch": batch, "peak_mb": (fixed + per_sample * batch) / 2**20,
+           "stages_mb": {path: (two["stages"][path] - one["stages"].get(path, 0)) / 2**20 for path in two["stages"]},
+           "largest": {path: [(nums / 2**20, shape) for nums, shape in items] for path, items in two["largest"].items()}}
+    if one["cuda_peak"] is not None:
+        cuda_per_sample = two["cuda_peak"] - one["cuda_peak"]
+        row["cuda_peak_mb"] = (one["cuda_peak"] + cuda_per_sample * (batch - 1)) / 2**20
+    if budget_mb is not None:
+        row["max_batch"] = max(0, int((budget_mb * 2**20 - fixed) // max(per_sample, 1)))
+    return row
+
+def format_table(rows, stages=False):
+    head = f"{'model':<7}{'mode':<13}{'step':>5}{'mem':>5}{'dim':>5}{'summ':>5}{'params':>9}{'MB/sample':>11}{'fixed':>9}{'peak@b':>10}"
+    if rows and "max_batch" in rows[0]:
+        head += f"{'max batch':>11}"
+    lines = [head]
+    for row in rows:
+        line = (f"{row['model']:<7}{row['memory_mode']:<13}{row['step']:>5}{row['memory_tokens_size']:>5}{row['dim']:>5}"
+                f"{row['summerize_num_tokens']:>5}{row['params_mb']:>9.1f}{row['per_sample_mb']:>11.1f}{row['fixed_mb']:>9.1f}"
+                f"{row['peak_mb']:>10.1f}")
+        if "max_batch" in row:
+            line += f"{row['max_batch']:>11}"
+        lines.append(line)
+        if stages:
+            for path in sorted(row["stages_mb"], key=row["stages_mb"].get, reverse=True):
+                largest = ", ".join(f"{shape} {nums:.2f}MB" for nums, shape in row["largest"][path])
+                lines.append(f"    {path:<32}{row['stages_mb'][path]:>9.2f} MB/sample   largest: {largest}")
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="peak training memory of the encoder over a configure grid")
+    parser.add_argument("--models", nargs="+", default=["lmttm", "ttm"])
+    parser.add_argument("--memory-modes", nargs="+", default=["TL"])
+    parser.add_argument("--steps", nargs="+", type=int, default=[28])
+    parser.add_argument("--memory-sizes", nargs="+", type=int, default=[64, 256, 448])
+    parser.add_argument("--dims", nargs="+", type=int, default=[64, 256, 448])
+    parser.add_argument("--summerize", nargs="+", type=int, default=[8])
+    parser.add_argument("--batch", type=int, default=32, help="the batch of the peak column")
+    parser.add_argument("--budget-mb", type=float, default=None, help="predict the largest batch that fits in this memory")
+    parser.add_argument("--device", default="cpu")
+    parser.add_argument("--top", type=int, default=3, help="largest tensors listed per stage")
+    parser.add_argument("--stages", action="store_true", help="print the per stage breakdown")
+    parser.add_argument("--out", default=None, help="write the rows to this json file")
+    args = parser.parse_args()
+
+    rows = []
+    for model, mode, step, mem, dim, summ in itertools.product(args.models, args.memory_modes, args.steps,
+                                                                args.memory_sizes, args.dims, args.summerize):
+        try:
+            spec = make_spec(mem, dim, args.batch, model=model, memory_mode=mode, step=step, summerize_num_tokens=summ)
+        except ValueError as e:
+            print(f"skipping {model} {mode} step {step} mem {mem} dim {dim} summ {summ}: {e}")
+            continue
+        rows.append(profile_config(spec, args.batch, args.budget_mb, args.device, args.top))
+        print(format_table(rows[-1:], args.stages).split("\n", 1)[1])
+    print()
+    print(format_table(rows, args.stages))
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(rows, f, indent=4)
@@ -0,0 +1,82 @@
+import os
+import sys
+import json
+import torch
+import torch.utils.data as data
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from config import compile_config
+from config.configure import config_arg_parser, get_config
+from utils.checkpoint import build_encoder, checkpoint_path, load_checkpoint
+from utils.micro_batch import memory_flags
+from datasets import get_dataset
+from utils.memory_codec import CODECS, encode_rows, decode_rows, codec_errors, row_bytes
+
+# What the memory codecs of utils/memory_codec.py cost in bytes and in accuracy for one checkpoint.
+# Every codec runs the same pass over a split: the memory starts from the checkpoint and goes
+# through the codec before every batch, like a stream whose memory is kept in a MemoryStore between
+# its requests, so the error of the codec adds up over the pass. The random positional embeddings
+# are seeded the same for every pass, the predictions are compared with the fp32 pass.
+# python benchmarks/memory_codec.py base.json --overlay '{"train": {"name": "exp0"}}' --split test
+
+def run_pass(model, loader, memory_tokens, codec, device):
+    '''
+    return: (logits [N, out_class_num], targets [N]) of the pass
+    '''
+    torch.manual_seed(3407)
+    for module in memory_flags(model)[0]:
+        module.current_flag = 0# every pass from the first block of the linked memory (lmttm)
+    logits, targets = [], []
+    with torch.no_grad():
+        for x, y in loader:
+            if memory_tokens is not None:
+                memory_tokens = decode_rows(*encode_rows(memory_tokens, codec), codec, memory_tokens.shape[1:])
+            out, memory_tokens = model(x.to(device, dtype=torch.float32), memory_tokens)
+            logits.append(out.cpu())
+            targets.append(y.reshape(-1))
+    return torch.cat(logits), torch.cat(targets)
+
+def codec_report(config, checkpoint, split="test", codecs=CODECS, device="cpu"):
+    '''
+    return: one dict per codec, bytes per stream and per checkpoint, the error of the checkpoint memory
+    and the accuracy, agreement and logit change of the pass
+    '''
+    spec = compile_config(config)
+    model = build_encoder(spec, device).eval()
+    memory_tokens = load_checkpoint(checkpoint, model, device)
+    if memory_tokens is None:
+        raise ValueError(f"{checkpoint} has no memory_tokens")
+    # the same batches, in the same order, for every pass
+    loader = data.DataLoader(get_dataset(split, config=config), batch_size=spec.batch_size, shuffle=False, drop_last=True)
+    errors = codec_errors(memory_tokens, codecs)
+    reference, targets = run_pass(model, loader, memory_tokens, "fp32", device)
+    rows = []
+    for codec in codecs:
+        logits, _ = run_pass(model, loader, memory_tokens, codec, device) if codec != "fp32" else (reference, targets)
+        rows.append({"codec": codec, "bytes_per_stream": errors[codec]["bytes_per_stream"],
+                     "checkpoint_bytes": memory_tokens.size(0) * row_bytes(memory_tokens.shape[1:], codec),
+                     "ratio": errors[codec]["ratio"], "rel_error": errors[codec]["rel_error"],
+                     "acc": round(float((logits.argmax(1) == targets).float().mean()) * 100, 2),
+                     "agreement": round(float((logits.argmax(1) == reference.argmax(1)).float().mean()) * 100, 2),
+                     "max_logit_change": float((logits - reference).abs().max())})
+    return rows
+
+
+if __name__ == "__main__":
+    parser = config_arg_parser("bytes and accuracy of the memory codecs for one checkpoint")
+    parser.add_argument("--checkpoint", default=None, help="the last checkpoint of train.name by default")
+    parser.add_argument("--split", default="test")
+    parser.add_argument("--codecs", nargs="+", default=CODECS)
+    parser.add_argument("--device", default="cuda" if torch.cuda.is_available() else "cpu")
+    parser.add_argument("--out", default=None, help="write the rows to this json file")
+    args = parser.parse_args()
+    config = get_config(args)
+    spec = compile_config(config)
+
+    rows = codec_report(config, args.checkpoint or checkpoint_path(spec.train.name, 10), args.split, args.codecs, args.device)
+    print(f"{'codec':<7}{'B/stream':>10}{'ckpt B':>11}{'ratio':>7}{'rel err':>10}{'acc':>8}{'agree':>8}{'max dlogit':>12}")
+    for r in rows:
+        print(f"{r['codec']:<7}{r['bytes_per_stream']:>10}{r['checkpoint_bytes']:>11}{r['ratio']:>6.2f}x{r['rel_error']:>10.2e}"
+              f"{r['acc']:>7.2f}%{r['agreement']:>7.2f}%{r['max_logit_change']:>12.2e}")
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(rows, f, indent=4)
@@ -0,0 +1,56 @@
+import os
+import sys
+import json
+import argparse
+import itertools
+import torch
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from benchmarks.blocks import make_spec, _median_ms
+import model.TTM as TTM
+
+# PreProcess3D with the Conv3d (patch_embed conv3d) and the patches x weight matmul (patch_embed
+# matmul) on the cpu, both with the same weights, over the volume sizes and dims.
+# python benchmarks/patch_embed.py --sizes 28 64 --dims 64 256 448 --out patch_embed.json
+
+def time_patch_embed(size, dim, batch=2, patch_size=3, in_channels=1, repeats=5, warmup=2):
+    '''
+    return: {mode: (forward ms, forward+backward ms)}, the backward is the one of the weights
+    '''
+    spec = make_spec(64, dim, batch, model="ttm", patch_size=patch_size, in_channels=in_channels)
+    torch.manual_seed(3407)
+    module = TTM.PreProcess3D(spec)
+    input = torch.rand(batch, in_channels, size, size, size)
+    times = {}
+    for mode, fn in [("conv3d", module.forward_conv), ("matmul", module.forward_matmul)]:
+        def forward():
+            with torch.no_grad():
+                fn(input)
+        def forward_backward():
+            fn(input).sum().backward()
+        times[mode] = (_median_ms(forward, repeats, warmup), _median_ms(forward_backward, repeats, warmup))
+    return times
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="cpu times of the conv3d and matmul patch embedding of PreProcess3D")
+    parser.add_argument("--sizes", nargs="+", type=int, default=[28, 64], help="the step = H = W of the volume")
+    parser.add_argument("--dims", nargs="+", type=int, default=[64, 256, 448])
+    parser.add_argument("--batch", type=int, default=8)
+    parser.add_argument("--patch-size", type=int, default=3)
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--warmup", type=int, default=2)
+    parser.add_argument("--threads", type=int, default=1)
+    parser.add_argument("--out", default=None, help="write the rows to this json file")
+    args = parser.parse_args()
+    torch.set_num_threads(args.threads)
+
+    rows = []
+    print(f"{'size':>5}{'dim':>5}{'conv3d fwd':>12}{'matmul fwd':>12}{'speedup':>9}{'conv3d f+b':>12}{'matmul f+b':>12}{'speedup':>9}")
+    for size, dim in itertools.product(args.sizes, args.dims):
+        times = time_patch_embed(size, dim, args.batch, args.patch_size, repeats=args.repeats, warmup=args.warmup)
+        (conv_f, conv_fb), (matmul_f, matmul_fb) = times["conv3d"], times["matmul"]
+        rows.append({"size": size, "dim": dim, "batch": args.batch, "conv3d_ms": [conv_f, conv_fb], "matmul_ms": [matmul_f, matmul_fb]})
+        print(f"{size:>5}{dim:>5}{conv_f:>12.2f}{matmul_f:>12.2f}{conv_f / matmul_f:>8.2f}x{conv_fb:>12.2f}{matmul_fb:>12.2f}{conv_fb / matmul_fb:>8.2f}x")
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(rows, f, indent=4)
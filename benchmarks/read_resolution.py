@@ -0,0 +1,82 @@
+import os
+import sys
+import json
+import argparse
+import itertools
+import torch
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from config.configure import load_config
+from config import compile_config
+from benchmarks.blocks import time_block
+from utils.flops import read_flops, format_count
+import model.TTM as TTM
+import model.LMTTM as LMTTM
+
+# The read of the memory unit with the TokenLearner (TL) and the memory-driven TokenLearnerModuleV12
+# (TL-V12) as the input resolution grows: the input tokens per step go up with input_H x input_W,
+# the memory stays the same. One read per step for ttm, three (current, prev, next block) for lmttm.
+# python benchmarks/read_resolution.py --resolutions 28 64 128 224 --out read.json
+
+def make_spec(model, memory_mode, resolution, memory_tokens_size, dim, batch):
+    overlay = {"batch_size": batch, "train": {"input_H": resolution, "input_W": resolution},
+               "model": {"model": model, "memory_mode": memory_mode, "memory_tokens_size": memory_tokens_size,
+                         "dim": dim, "drop_r": 0.0}}
+    return compile_config(load_config("base.json", overlay))
+
+def read_block(model, memory_mode, resolution):
+    def block(mem, dim, batch):
+        spec = make_spec(model, memory_mode, resolution, mem, dim, batch)
+        unit = (TTM if model == "ttm" else LMTTM).TokenTuringMachineUnit(spec)
+        memory = mem if model == "ttm" else spec.model.memory_block_size
+        reads = 1 if model == "ttm" else 3
+        def read(all_tokens):
+            return torch.cat([unit.summerize(all_tokens) for _ in range(reads)], dim=1)
+        return unit, read, [torch.rand(batch, memory + spec.model.input_tokens, dim)]
+    return block
+
+def run(models, memory_modes, resolutions, memory_tokens_size, dim, batch=2, repeats=5, warmup=2, threads=1, log=print):
+    torch.set_num_threads(threads)
+    rows = []
+    for model, resolution, memory_mode in itertools.product(models, resolutions, memory_modes):
+        spec = make_spec(model, memory_mode, resolution, memory_tokens_size, dim, batch)
+        memory = memory_tokens_size if model == "ttm" else spec.model.memory_block_size
+        reads = 1 if model == "ttm" else 3
+        forward_ms, forward_backward_ms = time_block(read_block(model, memory_mode, resolution), memory_tokens_size, dim,
+                                                     batch, repeats, warmup)
+        row = {"model": model, "memory_mode": memory_mode, "resolution": resolution, "input_tokens": spec.model.input_tokens,
+               "read_flops": reads * read_flops(spec, memory, spec.model.input_tokens),
+               "forward_ms": round(forward_ms, 4), "forward_backward_ms": round(forward_backward_ms, 4)}
+        rows.append(row)
+        if log is not None:
+            log(f"{model:<7}{memory_mode:<8}{resolution:>6}{row['input_tokens']:>8}{format_count(row['read_flops']):>12}"
+                f"{forward_ms:>10.2f}{forward_backward_ms:>12.2f}")
+    return rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="TL vs TL-V12 reads as the input resolution grows")
+    parser.add_argument("--models", nargs="+", default=["ttm", "lmttm"])
+    parser.add_argument("--memory-modes", nargs="+", default=["TL", "TL-V12"])
+    parser.add_argument("--resolutions", nargs="+", type=int, default=[28, 64, 128, 224])
+    parser.add_argument("--memory-size", type=int, default=128)
+    parser.add_argument("--dim", type=int, default=256)
+    parser.add_argument("--batch", type=int, default=2)
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--warmup", type=int, default=2)
+    parser.add_argument("--threads", type=int, default=1)
+    parser.add_argument("--out", default=None, help="write the rows to this json file")
+    args = parser.parse_args()
+
+    print(f"{'model':<7}{'mode':<8}{'res':>6}{'tokens':>8}{'FLOPs/read':>12}{'fwd ms':>10}{'fwd+bwd ms':>12}")
+    rows = run(args.models, args.memory_modes, args.resolutions, args.memory_size, args.dim, args.batch, args.repeats,
+               args.warmup, args.threads)
+    base = {(r["model"], r["resolution"]): r for r in rows if r["memory_mode"] == "TL"}
+    print()
+    for r in rows:
+        if r["memory_mode"] != "TL" and (r["model"], r["resolution"]) in base:
+            tl = base[(r["model"], r["resolution"])]
+            print(f"{r['model']:<7}{r['memory_mode']:<8}{r['resolution']:>6}  {tl['read_flops'] / r['read_flops']:>6.1f}x fewer FLOPs, "
+                  f"{tl['forward_ms'] / r['forward_ms']:>5.1f}x fwd, {tl['forward_backward_ms'] / r['forward_backward_ms']:>5.1f}x fwd+bwd")
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(rows, f, indent=4)
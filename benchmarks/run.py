@@ -0,0 +1,41 @@
+import os
+import sys
+import json
+import argparse
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from benchmarks.blocks import BLOCKS, MEMORY_SIZES, DIMS, run_benchmarks, compare
+
+# python benchmarks/run.py --out benchmarks/results.json
+# python benchmarks/run.py --out new.json --baseline benchmarks/results.json   (exit code 1 on regressions)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="cpu microbenchmarks of the model building blocks")
+    parser.add_argument("--blocks", nargs="+", default=None, choices=list(BLOCKS.keys()), help="all the blocks by default")
+    parser.add_argument("--memory-sizes", nargs="+", type=int, default=MEMORY_SIZES)
+    parser.add_argument("--dims", nargs="+", type=int, default=DIMS)
+    parser.add_argument("--batch", type=int, default=2)
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--warmup", type=int, default=2)
+    parser.add_argument("--threads", type=int, default=1)
+    parser.add_argument("--out", default=None, help="write the results to this json file")
+    parser.add_argument("--baseline", default=None, help="a json file of an earlier run to compare with")
+    parser.add_argument("--threshold", type=float, default=0.10, help="relative slow down flagged as a regression")
+    args = parser.parse_args()
+
+    current = run_benchmarks(args.blocks, args.memory_sizes, args.dims, batch=args.batch, repeats=args.repeats,
+                             warmup=args.warmup, threads=args.threads)
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(current, f, indent=4)
+        print(f"results written to {args.out}")
+    if args.baseline:
+        with open(args.baseline, "r") as f:
+            baseline = json.load(f)
+        if baseline["meta"]["threads"] != current["meta"]["threads"] or baseline["meta"]["batch"] != current["meta"]["batch"]:
+            print("warning: the baseline was run with other threads / batch, the ratios are not comparable")
+        lines, regressions = compare(baseline, current, args.threshold)
+        print("\n".join(lines))
+        if regressions:
+            print(f"{len(regressions)} regressions above {args.threshold:.0%}")
+            sys.exit(1)
+        print("no regressions")
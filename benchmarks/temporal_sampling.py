@@ -0,0 +1,122 @@
+import os
+import sys
+import copy
+import json
+import time
+import itertools
+import torch
+import torch.utils.data as data
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from config import compile_config
+from config.configure import config_arg_parser, get_config
+from datasets import get_dataset
+from utils.checkpoint import build_encoder, checkpoint_path, load_checkpoint
+from utils.micro_batch import batch_rows
+
+# Accuracy and throughput of the temporal sampling (model/TemporalSampler.py) per mode and rate.
+# Throughput: samples/s of the eval forward and of a training step (forward, backward, Adam) on
+# random inputs of the configured shape and batch. Accuracy: the test split with the weights and
+# memory of a checkpoint, the same batches in the same order for every row; a checkpoint trained
+# on every step measures what the sampling costs at inference, train with the overlay
+# {"model": {"temporal_sampling": ..., "sampling_rate": ...}} for a model trained with it.
+# python benchmarks/temporal_sampling.py base.json --overlay '{"train": {"name": "exp0"}}' --rates 1 0.5 0.25
+
+def sampled_config(config, mode, rate):
+    sampled = copy.deepcopy(config)
+    sampled["model"]["temporal_sampling"] = mode
+    sampled["model"]["sampling_rate"] = rate
+    return sampled
+
+def build(spec, device):
+    torch.manual_seed(3407)
+    return build_encoder(spec, device)
+
+def throughput(spec, device, repeats=5):
+    '''
+    return: (eval forward samples/s, training step samples/s)
+    '''
+    model = build(spec, device)
+    optimizer = torch.optim.Adam(model.parameters(), lr=1e-4)
+    b = spec.batch_size
+    if spec.model.preprocess_mode.value == "resnet18-cached":
+        input = torch.rand(b, spec.model.step, spec.model.input_tokens, 128, device=device)
+    else:
+        input = torch.rand(b, spec.model.in_channels, spec.model.step, spec.train.input_H, spec.train.input_W, device=device)
+    target = torch.randint(spec.model.out_class_num, (b,), device=device)
+    def forward():
+        model.eval()
+        with torch.no_grad(), batch_rows(model, 0, b):
+            model(input, None)
+    def train_step():
+        model.train()
+        with batch_rows(model, 0, b):
+            out, _ = model(input, None)
+        torch.nn.functional.cross_entropy(out, target).backward()
+        optimizer.step()
+        optimizer.zero_grad()
+    rates = []
+    for fn in [forward, train_step]:
+        fn()# warmup
+        if device == "cuda":
+            torch.cuda.synchronize()
+        time1 = time.perf_counter()
+        for _ in range(repeats):
+            fn()
+        if device == "cuda":
+            torch.cuda.synchronize()
+        rates.append(repeats * b / (time.perf_counter() - time1))
+    return rates
+
+def accuracy(spec, config, checkpoint, device, split="test"):
+    model = build(spec, device).eval()
+    memory_tokens = load_checkpoint(checkpoint, model, device)
+    if not spec.train.load_memory_tokens:
+        memory_tokens = None
+    loader = data.DataLoader(get_dataset(split, config=config), batch_size=spec.batch_size, shuffle=False, drop_last=True)
+    torch.manual_seed(3407)
+    correct, total = 0, 0
+    with torch.no_grad():
+        for x, y in loader:
+            with batch_rows(model, 0, x.size(0)):
+                out, memory_tokens = model(x.to(device, dtype=torch.float32), memory_tokens)
+            correct += (out.argmax(1).cpu() == y.reshape(-1)).sum().item()
+            total += y.size(0)
+    return 100 * correct / max(total, 1)
+
+def run(config, modes, rates, checkpoint=None, device="cpu", repeats=5, log=print):
+    rows = []
+    for mode, rate in itertools.product(modes, rates):
+        if mode == "all" and rate != rates[0]:
+            continue
+        sampled = sampled_config(config, mode, 1.0 if mode == "all" else rate)
+        spec = compile_config(sampled)
+        forward, train_step = throughput(spec, device, repeats)
+        row = {"mode": mode, "rate": 1.0 if mode == "all" else rate, "steps": spec.model.sampled_steps,
+               "forward_samples_s": round(forward, 2), "train_samples_s": round(train_step, 2),
+               "acc": None if checkpoint is None else round(accuracy(spec, sampled, checkpoint, device), 2)}
+        rows.append(row)
+        if log is not None:
+            acc = "-" if row["acc"] is None else f"{row['acc']:.2f}%"
+            log(f"{mode:<10}{row['rate']:>6.2f}{row['steps']:>7}{forward:>12.1f}{train_step:>12.1f}{acc:>9}")
+    return rows
+
+
+if __name__ == "__main__":
+    parser = config_arg_parser("accuracy and throughput of the temporal sampling per mode and rate")
+    parser.add_argument("--modes", nargs="+", default=["all", "uniform", "random", "keyframe"])
+    parser.add_argument("--rates", nargs="+", type=float, default=[1.0, 0.5, 0.25])
+    parser.add_argument("--checkpoint", default=None, help="the test accuracy of this checkpoint, none is measured without it")
+    parser.add_argument("--device", default="cuda" if torch.cuda.is_available() else "cpu")
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--threads", type=int, default=None)
+    parser.add_argument("--out", default=None, help="write the rows to this json file")
+    args = parser.parse_args()
+    if args.threads:
+        torch.set_num_threads(args.threads)
+    config = get_config(args)
+
+    print(f"{'mode':<10}{'rate':>6}{'steps':>7}{'fwd smp/s':>12}{'train smp/s':>12}{'acc':>9}")
+    rows = run(config, args.modes, args.rates, args.checkpoint, args.device, args.repeats)
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(rows, f, indent=4)
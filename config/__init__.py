@@ -1,5 +1,6 @@
 import os
 from .configure import Config
+from .spec import compile_config, RuntimeSpec
 
 
 config_file = "base.json"
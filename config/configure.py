@@ -1,5 +1,6 @@
 import json
 import os
+import argparse
 
 class DictToObject:
     def __init__(self, dictionary):
@@ -75,6 +76,44 @@ class Config:
         return str(self.__config)
 
 
+def update_config(config, config_file):
+    # same merge as Config.__update, for plain dicts
+    for key in config_file:
+        if key in config and isinstance(config[key], dict):
+            update_config(config[key], config_file[key])
+        else:
+            config[key] = config_file[key]
+
+def load_config(config_file="base.json", overlay=None):
+    '''
+    Load base.json, the configure file and an in-memory overlay dict merged in that order.
+    Unlike Config.getInstance the result is a new object, the singleton is not touched,
+    so several configures (e.g. the runs of a sweep) can live side by side.
+    '''
+    with open(os.path.join(os.path.dirname(__file__), "base.json"), "r") as f:
+        config = json.load(f)
+    if config_file != "base.json":
+        with open(os.path.join(os.path.dirname(__file__), config_file), "r") as f:
+            update_config(config, json.load(f))
+    if overlay is not None:
+        update_config(config, overlay)
+    return dict_to_object_recursive(config)
+
+def config_arg_parser(description=None):
+    '''
+    The command line shared by the train / predict / evaluate scripts: the configure file and an optional overlay.
+    '''
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument("json_path", help="the configure file in config/, like base.json")
+    parser.add_argument("--overlay", default=None,
+                        help="a json dict merged over the configure file in memory, like '{\"train\": {\"name\": \"exp0\"}}'")
+    return parser
+
+def get_config(args):
+    if args.overlay is None:
+        return Config.getInstance(args.json_path)
+    return load_config(args.json_path, json.loads(args.overlay))
+
 
 if __name__=="__main__":
     config_file = "base.json"
@@ -0,0 +1,308 @@
+import os
+from dataclasses import dataclass
+from enum import Enum
+
+# The json configure is compiled once at startup into a frozen spec: the string options are
+# resolved to enums, the derived shapes are precomputed and every check is done before any
+# data is loaded, so the modules can pick their code paths in __init__ instead of forward.
+
+class ModelName(str, Enum):
+    TTM = "ttm"
+    LMTTM = "lmttm"
+
+class PreprocessMode(str, Enum):
+    CONV3D = "3d"
+    CONV3D_BN = "3dBN"
+    RESNET18 = "resnet18"
+    RESNET18_CACHED = "resnet18-cached"# frozen resnet18, its features read from datasets/feature_cache.py
+
+class PatchEmbed(str, Enum):
+    MATMUL = "matmul"# non-overlapping patches times the conv weight
+    CONV3D = "conv3d"
+
+class TemporalSampling(str, Enum):
+    ALL = "all"
+    UNIFORM = "uniform"
+    RANDOM = "random"# uniform in eval mode
+    KEYFRAME = "keyframe"
+
+class ProcessUnit(str, Enum):
+    TRANSFORMER = "transformer"
+    MIXER = "mixer"
+    MLP = "mlp"
+
+class MemoryMode(str, Enum):
+    TL = "TL"
+    TL_MHA = "TL-MHA"
+    TL_ADD_ERASE = "TL-AddErase"
+    TL_V12 = "TL-V12"# memory-driven read (TokenLearnerModuleV12), TokenLearner write
+
+class NoiseMode(str, Enum):
+    NONE = "None"
+    UNIFORM = "uniform"
+    LAPLACE = "laplace"
+    NORMAL = "normal"
+    EXP = "exp"
+    GAMMA = "gamma"
+    POISSON = "poisson"
+
+DATASET_NAMES = ["organmnist3d", "nodulemnist3d", "fracturemnist3d", "adrenalmnist3d", "vesselmnist3d", "synapsemnist3d",
+                 "hmdb_dataset0", "hmdb_dataset1", "hmdb_dataset2"]
+OPTIMIZERS = ["Adam", "RMSprop"]
+VAL_MODES = ["full", "subset", "async"]
+MEMORY_KEYS = ["batch", "sample"]
+MEMORY_CODECS = ["fp32", "fp16", "bf16", "int8"]# utils/memory_codec.py
+NUM_HEADS = 8
+RESNET18_STRIDE = 8# conv1 through layer2
+RESNET18_CHANNELS = 128# of layer2
+RESNET18_MODES = (PreprocessMode.RESNET18, PreprocessMode.RESNET18_CACHED)
+
+
+@dataclass(frozen=True)
+class ModelSpec:
+    model: ModelName
+    preprocess_mode: PreprocessMode
+    patch_embed: PatchEmbed# how preprocess_mode 3d runs its conv, same weights
+    resnet18_weights: str# the frozen backbone of resnet18-cached, "" for the seeded torchvision init
+    process_unit: ProcessUnit
+    transformer_batch_first: bool# the transformer block attends over the tokens of a sample, not over the batch as before
+    memory_mode: MemoryMode
+    noise_mode: NoiseMode# NONE when load_memory_add_noise is off
+    drop_r: float
+    in_channels: int
+    dim: int
+    memory_tokens_size: int
+    num_blocks: int
+    summerize_num_tokens: int
+    step: int
+    out_class_num: int
+    patch_size: int
+    read_use_positional_embedding: bool
+    write_use_positional_embedding: bool
+    early_exit_threshold: float# predict / serve with forward_early_exit when > 0, see utils/early_exit.py
+    early_exit_k: int# confident steps in a row before a sample exits
+    early_exit_temperature: float# fitted by benchmarks/early_exit.py
+    temporal_sampling: TemporalSampling# the steps kept between preprocessing and the memory recurrence
+    sampling_rate: float# the share of the steps kept, unless temporal_sampling is all
+    # derived
+    time_steps: int# steps after preprocessing
+    sampled_steps: int# steps of the memory recurrence after the temporal sampling (model/TemporalSampler.py)
+    input_tokens: int# tokens per step after preprocessing
+    memory_block_size: int# tokens of one linked memory block (lmttm)
+    add_erase_input: int# tokens summarised by the AddErase write
+
+@dataclass(frozen=True)
+class TrainSpec:
+    name: str
+    gpu: str
+    epoch: int
+    optimizer: str
+    lr: float
+    weight_decay: float
+    load_memory_tokens: bool
+    input_H: int
+    input_W: int
+    val_gap: int
+    val_mode: str
+    val_subset: float
+    log_every: int
+    micro_batch: int# 0 for the whole batch
+    memory_budget_mb: int# sizes the micro-batch when micro_batch is 0, 0 for no budget
+    resume_every: int# epochs between two resume checkpoints
+    memory_key: str# batch: one memory carried from batch to batch, sample: one per sample in utils/memory_store.py
+    memory_store_mb: int# the RAM of the per sample memory, the rest is spilled to memory_spill_dir
+    memory_spill_dir: str
+    memory_codec: str# how the memory is kept in the epoch checkpoints and the memory stores
+    distill_teacher: str# the teacher checkpoint, "" trains without distillation (utils/distill.py)
+    distill_alpha: float# the weight of the soft targets, 1 - alpha for the labels
+    distill_temperature: float
+    distill_memory_weight: float# of the memory alignment, 0 for none
+    distill_cache_dir: str# where the teacher outputs are stored
+
+@dataclass(frozen=True)
+class RuntimeSpec:
+    batch_size: int
+    dataset_name: str
+    root: str
+    log_dir: str
+    model: ModelSpec
+    train: TrainSpec
+
+
+def _choice(enum, value, key, errors):
+    try:
+        return enum(value)
+    except ValueError:
+        errors.append(f"{key}={value!r} is not one of {[e.value for e in enum]}")
+        return list(enum)[0]
+
+def compile_config(config):
+    '''
+    config: the Config / DictToObject loaded from the json file
+    return: the RuntimeSpec, raises ValueError listing every invalid field
+    '''
+    if isinstance(config, RuntimeSpec):
+        return config
+    errors = []
+    m = config["model"]
+    t = config["train"]
+
+    model = _choice(ModelName, m["model"], "model.model", errors)
+    preprocess_mode = _choice(PreprocessMode, m["preprocess_mode"], "model.preprocess_mode", errors)
+    patch_embed = _choice(PatchEmbed, m["patch_embed"], "model.patch_embed", errors)
+    process_unit = _choice(ProcessUnit, m["process_unit"], "model.process_unit", errors)
+    memory_mode = _choice(MemoryMode, m["memory_mode"], "model.memory_mode", errors)
+    if m["load_memory_add_noise"]:
+        noise_mode = _choice(NoiseMode, m["load_memory_add_noise_mode"], "model.load_memory_add_noise_mode", errors)
+    else:
+        noise_mode = NoiseMode.NONE
+
+    for key in ["in_channels", "dim", "memory_tokens_size", "num_blocks", "summerize_num_tokens", "step", "out_class_num", "patch_size"]:
+        if not isinstance(m[key], int) or m[key] <= 0:
+            errors.append(f"model.{key}={m[key]!r} must be a positive int")
+    for key in ["epoch", "input_H", "input_W", "val_gap", "log_every", "resume_every"]:
+        if not isinstance(t[key], int) or t[key] <= 0:
+            errors.append(f"train.{key}={t[key]!r} must be a positive int")
+    if not isinstance(config["batch_size"], int) or config["batch_size"] <= 0:
+        errors.append(f"batch_size={config['batch_size']!r} must be a positive int")
+    if config["dataset_name"] not in DATASET_NAMES:
+        errors.append(f"dataset_name={config['dataset_name']!r} is not one of {DATASET_NAMES}")
+    if t["optimizer"] not in OPTIMIZERS:
+        errors.append(f"train.optimizer={t['optimizer']!r} is not one of {OPTIMIZERS}")
+    for key in ["micro_batch", "memory_budget_mb", "memory_store_mb"]:
+        if not isinstance(t[key], int) or t[key] < 0:
+            errors.append(f"train.{key}={t[key]!r} must be a non-negative int")
+    if isinstance(t["micro_batch"], int) and isinstance(config["batch_size"], int) and t["micro_batch"] > config["batch_size"]:
+        errors.append(f"train.micro_batch={t['micro_batch']} is larger than batch_size={config['batch_size']}")
+    if (t["micro_batch"] or t["memory_budget_mb"]) and m["process_unit"] == "transformer" and not m["transformer_batch_first"]:
+        errors.append("train.micro_batch and train.memory_budget_mb need model.transformer_batch_first, the transformer block "
+                      "of the old layout attends over the batch so the rows of a batch are not independent")
+    if t["memory_key"] not in MEMORY_KEYS:
+        errors.append(f"train.memory_key={t['memory_key']!r} is not one of {MEMORY_KEYS}")
+    if t["memory_codec"] not in MEMORY_CODECS:
+        errors.append(f"train.memory_codec={t['memory_codec']!r} is not one of {MEMORY_CODECS}")
+    if t["distill_teacher"]:
+        if not os.path.exists(t["distill_teacher"]):
+            errors.append(f"train.distill_teacher={t['distill_teacher']!r} does not exist")
+        if t["micro_batch"] or t["memory_budget_mb"]:
+            errors.append("train.distill_teacher needs the whole batch at once, set train.micro_batch and train.memory_budget_mb to 0")
+    if not 0 <= t["distill_alpha"] <= 1:
+        errors.append(f"train.distill_alpha={t['distill_alpha']!r} must be in [0, 1]")
+    if not t["distill_temperature"] > 0:
+        errors.append(f"train.distill_temperature={t['distill_temperature']!r} must be positive")
+    if not t["distill_memory_weight"] >= 0:
+        errors.append(f"train.distill_memory_weight={t['distill_memory_weight']!r} must be non-negative")
+    if t["val_mode"] not in VAL_MODES:
+        errors.append(f"train.val_mode={t['val_mode']!r} is not one of {VAL_MODES}")
+    if not 0 < t["val_subset"] <= 1:
+        errors.append(f"train.val_subset={t['val_subset']!r} must be in (0, 1]")
+    if not 0 <= m["early_exit_threshold"] <= 1:
+        errors.append(f"model.early_exit_threshold={m['early_exit_threshold']!r} must be in [0, 1]")
+    if not isinstance(m["early_exit_k"], int) or m["early_exit_k"] <= 0:
+        errors.append(f"model.early_exit_k={m['early_exit_k']!r} must be a positive int")
+    if not m["early_exit_temperature"] > 0:
+        errors.append(f"model.early_exit_temperature={m['early_exit_temperature']!r} must be positive")
+    temporal_sampling = _choice(TemporalSampling, m["temporal_sampling"], "model.temporal_sampling", errors)
+    if not 0 < m["sampling_rate"] <= 1:
+        errors.append(f"model.sampling_rate={m['sampling_rate']!r} must be in (0, 1]")
+    if not 0 <= m["drop_r"] < 1:
+        errors.append(f"model.drop_r={m['drop_r']!r} must be in [0, 1)")
+    if errors:
+        raise ValueError("invalid configure:\n  " + "\n  ".join(errors))
+
+    if m["dim"] % NUM_HEADS != 0:
+        errors.append(f"model.dim={m['dim']} must be divisible by the {NUM_HEADS} attention heads")
+    if model == ModelName.LMTTM and m["memory_tokens_size"] % m["num_blocks"] != 0:
+        errors.append(f"model.memory_tokens_size={m['memory_tokens_size']} must be divisible by model.num_blocks={m['num_blocks']}")
+    if model == ModelName.LMTTM and memory_mode == MemoryMode.TL_ADD_ERASE:
+        errors.append("model.memory_mode='TL-AddErase' is only implemented for the ttm model")
+    if model == ModelName.LMTTM and process_unit == ProcessUnit.MIXER:
+        errors.append("model.process_unit='mixer' is only implemented for the ttm model")
+    if model == ModelName.TTM and preprocess_mode == PreprocessMode.CONV3D_BN:
+        errors.append("model.preprocess_mode='3dBN' is only implemented for the lmttm model")
+    if preprocess_mode in RESNET18_MODES and m["in_channels"] != 3:
+        errors.append(f"model.preprocess_mode={preprocess_mode.value!r} needs model.in_channels=3, got {m['in_channels']}")
+    if preprocess_mode == PreprocessMode.RESNET18_CACHED and m["resnet18_weights"] not in ["", "imagenet"] and not os.path.exists(m["resnet18_weights"]):
+        errors.append(f"model.resnet18_weights={m['resnet18_weights']!r} is not '', 'imagenet' nor an existing file")
+
+    p = m["patch_size"]
+    if preprocess_mode in RESNET18_MODES:
+        time_steps = m["step"]
+        input_tokens = -(-t["input_H"] // RESNET18_STRIDE) * -(-t["input_W"] // RESNET18_STRIDE)
+    else:
+        time_steps = m["step"] // p
+        input_tokens = (t["input_H"] // p) * (t["input_W"] // p)
+        if min(time_steps, input_tokens) <= 0:
+            errors.append(f"model.patch_size={p} is larger than the input ({m['step']}, {t['input_H']}, {t['input_W']})")
+    if errors:
+        raise ValueError("invalid configure:\n  " + "\n  ".join(errors))
+    sampled_steps = time_steps
+    if temporal_sampling != TemporalSampling.ALL:
+        sampled_steps = max(1, min(time_steps, round(m["sampling_rate"] * time_steps)))
+
+    model_spec = ModelSpec(
+        model=model,
+        preprocess_mode=preprocess_mode,
+        patch_embed=patch_embed,
+        resnet18_weights=m["resnet18_weights"],
+        process_unit=process_unit,
+        transformer_batch_first=bool(m["transformer_batch_first"]),
+        memory_mode=memory_mode,
+        noise_mode=noise_mode,
+        drop_r=float(m["drop_r"]),
+        in_channels=m["in_channels"],
+        dim=m["dim"],
+        memory_tokens_size=m["memory_tokens_size"],
+        num_blocks=m["num_blocks"],
+        summerize_num_tokens=m["summerize_num_tokens"],
+        step=m["step"],
+        out_class_num=m["out_class_num"],
+        patch_size=p,
+        read_use_positional_embedding=bool(m["Read_use_positional_embedding"]),
+        write_use_positional_embedding=bool(m["Write_use_positional_embedding"]),
+        early_exit_threshold=float(m["early_exit_threshold"]),
+        early_exit_k=m["early_exit_k"],
+        early_exit_temperature=float(m["early_exit_temperature"]),
+        temporal_sampling=temporal_sampling,
+        sampling_rate=float(m["sampling_rate"]),
+        time_steps=time_steps,
+        sampled_steps=sampled_steps,
+        input_tokens=input_tokens,
+        memory_block_size=m["memory_tokens_size"] // m["num_blocks"],
+        add_erase_input=m["memory_tokens_size"] + m["summerize_num_tokens"] + input_tokens,
+    )
+    train_spec = TrainSpec(
+        name=t["name"],
+        gpu=str(t["gpu"]),
+        epoch=t["epoch"],
+        optimizer=t["optimizer"],
+        lr=float(t["lr"]),
+        weight_decay=float(t["weight_decay"]),
+        load_memory_tokens=bool(t["load_memory_tokens"]),
+        input_H=t["input_H"],
+        input_W=t["input_W"],
+        val_gap=t["val_gap"],
+        val_mode=t["val_mode"],
+        val_subset=float(t["val_subset"]),
+        log_every=t["log_every"],
+        micro_batch=t["micro_batch"],
+        memory_budget_mb=t["memory_budget_mb"],
+        resume_every=t["resume_every"],
+        memory_key=t["memory_key"],
+        memory_store_mb=t["memory_store_mb"],
+        memory_spill_dir=t["memory_spill_dir"],
+        memory_codec=t["memory_codec"],
+        distill_teacher=t["distill_teacher"],
+        distill_alpha=float(t["distill_alpha"]),
+        distill_temperature=float(t["distill_temperature"]),
+        distill_memory_weight=float(t["distill_memory_weight"]),
+        distill_cache_dir=t["distill_cache_dir"],
+    )
+    return RuntimeSpec(
+        batch_size=config["batch_size"],
+        dataset_name=config["dataset_name"],
+        root=config["root"],
+        log_dir=config["log_dir"],
+        model=model_spec,
+        train=train_spec,
+    )
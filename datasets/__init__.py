@@ -1,60 +1,65 @@
 from config import Config
 import os
 
-def get_dataset(split, download=False, transform=None,config=Config.getInstance("base.json")):
+def get_dataset(split, download=False, transform=None,config=Config.getInstance("base.json"), raw=False):
 
     config = config
 
+    if not raw and config["model"]["preprocess_mode"] == "resnet18-cached":
+        # the frozen resnet18 features of the split, computed on first use (datasets/feature_cache.py)
+        from .feature_cache import FeatureDataset, build_feature_cache
+        return FeatureDataset(*build_feature_cache(config, split, download=download, transform=transform))
+
+    if config["shared_data_dir"] and "mnist" in config["dataset_name"]:
+        # the split exported once by the sweep, mapped instead of loaded by every run
+        from .shared_data import SharedMedMNISTDataset
+        return SharedMedMNISTDataset(config["shared_data_dir"], config["dataset_name"], split, transform=transform)
+
     if config["dataset_name"] == "organmnist3d":
         from .medmnist_data import MedMNISTDataset
         # if cannot find the root directory, then create it.
-        if not os.path.exists(Config.getInstance()["root"]):
-            os.makedirs(Config.getInstance()["root"])
-        return MedMNISTDataset(split=split, download=download, transform=transform)
+        if not os.path.exists(config["root"]):
+            os.makedirs(config["root"])
+        return MedMNISTDataset(dataset_name=config["dataset_name"], batch_size=config["batch_size"], split=split, download=download, transform=transform, root=config["root"])
     
     elif config["dataset_name"] == "nodulemnist3d":
         from .medmnist_data import MedMNISTDataset
         # if cannot find the root directory, then create it.
-        if not os.path.exists(Config.getInstance()["root"]):
-            os.makedirs(Config.getInstance()["root"])
-        return MedMNISTDataset(split=split, download=download, transform=transform)
+        if not os.path.exists(config["root"]):
+            os.makedirs(config["root"])
+        return MedMNISTDataset(dataset_name=config["dataset_name"], batch_size=config["batch_size"], split=split, download=download, transform=transform, root=config["root"])
 
     elif config["dataset_name"] == "fracturemnist3d":
         from .medmnist_data import MedMNISTDataset
         # if cannot find the root directory, then create it.
-        if not os.path.exists(Config.getInstance()["root"]):
-            os.makedirs(Config.getInstance()["root"])
-        return MedMNISTDataset(split=split, download=download, transform=transform)
+        if not os.path.exists(config["root"]):
+            os.makedirs(config["root"])
+        return MedMNISTDataset(dataset_name=config["dataset_name"], batch_size=config["batch_size"], split=split, download=download, transform=transform, root=config["root"])
     
     elif config["dataset_name"] == "adrenalmnist3d":
         from .medmnist_data import MedMNISTDataset
         # if cannot find the root directory, then create it.
-        if not os.path.exists(Config.getInstance()["root"]):
-            os.makedirs(Config.getInstance()["root"])
-        return MedMNISTDataset(split=split, download=download, transform=transform)
+        if not os.path.exists(config["root"]):
+            os.makedirs(config["root"])
+        return MedMNISTDataset(dataset_name=config["dataset_name"], batch_size=config["batch_size"], split=split, download=download, transform=transform, root=config["root"])
 
     elif config["dataset_name"] == "vesselmnist3d":
         from .medmnist_data import MedMNISTDataset
         # if cannot find the root directory, then create it.
-        if not os.path.exists(Config.getInstance()["root"]):
-            os.makedirs(Config.getInstance()["root"])
-        return MedMNISTDataset(split=split, download=download, transform=transform)
+        if not os.path.exists(config["root"]):
+            os.makedirs(config["root"])
+        return MedMNISTDataset(dataset_name=config["dataset_name"], batch_size=config["batch_size"], split=split, download=download, transform=transform, root=config["root"])
 
     elif config["dataset_name"] == "synapsemnist3d":
         from .medmnist_data import MedMNISTDataset
         # if cannot find the root directory, then create it.
-        if not os.path.exists(Config.getInstance()["root"]):
-            os.makedirs(Config.getInstance()["root"])
-        return MedMNISTDataset(split=split, download=download, transform=transform)
+        if not os.path.exists(config["root"]):
+            os.makedirs(config["root"])
+        return MedMNISTDataset(dataset_name=config["dataset_name"], batch_size=config["batch_size"], split=split, download=download, transform=transform, root=config["root"])
 
     elif config["dataset_name"] == "hmdb_dataset0" or config["dataset_name"] == "hmdb_dataset1" or config["dataset_name"] == "hmdb_dataset2":
         from .hmdb_data import HMDBDataset, HMDBDataset_download
-        if not os.path.exists(Config.getInstance()["root"]):
-            os.makedirs(Config.getInstance()["root"])
-        # HMDBDataset_download(split=split, download=download, transform=transform)
-        if split == "train":
-            return HMDBDataset(config["root"] + "/" + config["dataset_name"] + "_train.h5")
-        if split == "val":
-            return HMDBDataset(config["root"] + "/" + config["dataset_name"] + "_val.h5")
-        if split == "test":
-            return HMDBDataset(config["root"] + "/" + config["dataset_name"] + "_test.h5")
\ No newline at end of file
+        if not os.path.exists(config["root"]):
+            os.makedirs(config["root"])
+        h5_path = HMDBDataset_download(split=split, download=download, transform=transform, config=config)
+        return HMDBDataset(h5_path, transform=transform, cache_mb=config["h5_cache_mb"])
\ No newline at end of file
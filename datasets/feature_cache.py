@@ -0,0 +1,116 @@
+import os
+import sys
+import time
+import hashlib
+import numpy as np
+import torch
+import torch.utils.data as data
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# preprocess_mode resnet18-cached: the resnet18 front-end (conv1 .. layer2) is frozen, so the
+# features of every clip are computed once per split and stored in a memory-mapped .npy of
+# [N, T, tokens, 128] next to the labels. Training and evaluation read the features and only run
+# pre_dim and the memory unit. The features are kept in float16 (post-relu activations, half the
+# disk and page cache) and the files are named by a key of the backbone weights, the transform
+# and the input size, so another backbone or preprocessing never reads stale features. Transforms
+# are applied once, before the backbone.
+
+def load_backbone(weights="", device="cpu"):
+    '''
+    weights: "" for the torchvision initialisation under seed 3407, "imagenet" for the torchvision
+    ImageNet weights, or the path of a resnet18 state_dict
+    return: the frozen PreProcessResnet18, in eval mode
+    '''
+    from model.TTM import PreProcessResnet18
+    rng = torch.random.get_rng_state()
+    torch.manual_seed(3407)
+    backbone = PreProcessResnet18()
+    torch.random.set_rng_state(rng)
+    if weights:
+        if weights == "imagenet":
+            import torchvision.models as models
+            state = models.resnet18(weights="IMAGENET1K_V1").state_dict()
+        else:
+            state = torch.load(weights, map_location="cpu", weights_only=True)
+        backbone.resnet.load_state_dict({key: value for key, value in state.items() if not key.startswith("fc.")})
+    backbone.requires_grad_(False)
+    return backbone.eval().to(device)
+
+def fingerprint(backbone):
+    sha = hashlib.sha1()
+    for key, value in backbone.state_dict().items():
+        sha.update(key.encode("utf-8"))
+        sha.update(value.detach().cpu().contiguous().numpy().tobytes())
+    return sha.hexdigest()[:12]
+
+def cache_key(backbone, config, transform=None):
+    '''
+    return: the key of the features, from the backbone weights, repr(transform) and train.input_H / input_W
+    '''
+    # a transform without a repr of its own (a lambda, ...) gets a new key per run, never a stale one
+    sha = hashlib.sha1(fingerprint(backbone).encode("utf-8"))
+    sha.update(repr(transform).encode("utf-8"))
+    sha.update(f"{config['train']['input_H']}x{config['train']['input_W']}".encode("utf-8"))
+    return sha.hexdigest()[:12]
+
+def feature_paths(cache_dir:str, dataset_name:str, split:str, key:str):
+    return (os.path.join(cache_dir, f"{dataset_name}_{split}_resnet18_{key}_features.npy"),
+            os.path.join(cache_dir, f"{dataset_name}_{split}_resnet18_{key}_labels.npy"))
+
+def build_feature_cache(config, split:str, download=False, transform=None, dataset=None, device=None, batch_size=8):
+    '''
+    Run the frozen backbone once over a split and store its features, unless they are stored already.
+    dataset: the clips, get_dataset(split, raw=True) of the configure by default
+    return: (features path, labels path)
+    '''
+    device = device or ("cuda" if torch.cuda.is_available() else "cpu")
+    backbone = load_backbone(config["model"]["resnet18_weights"], device)
+    features_path, labels_path = feature_paths(config["feature_cache_dir"], config["dataset_name"], split,
+                                               cache_key(backbone, config, transform))
+    if os.path.exists(features_path) and os.path.exists(labels_path):
+        return features_path, labels_path
+    if not os.path.exists(config["feature_cache_dir"]):
+        os.makedirs(config["feature_cache_dir"], exist_ok=True)
+    if dataset is None:
+        from . import get_dataset
+        dataset = get_dataset(split, download=download, transform=transform, config=config, raw=True)
+    loader = data.DataLoader(dataset, batch_size=batch_size, shuffle=False, num_workers=0)
+    time1 = time.time()
+    features = None
+    labels = np.empty((len(dataset), 1), dtype=np.int64)
+    tmp_path = f"{features_path}.{os.getpid()}.tmp"
+    start = 0
+    with torch.no_grad():
+        for x, y in loader:
+            out = backbone(x.to(device, dtype=torch.float32)).cpu().numpy().astype(np.float16)
+            if features is None:
+                features = np.lib.format.open_memmap(tmp_path, mode="w+", dtype=np.float16, shape=(len(dataset),) + out.shape[1:])
+            features[start:start + out.shape[0]] = out
+            labels[start:start + out.shape[0]] = np.asarray(y).reshape(-1, 1)
+            start += out.shape[0]
+    features.flush()
+    del features
+    # write then rename, a run never maps half written features
+    with open(f"{labels_path}.{os.getpid()}.tmp", "wb") as f:
+        np.save(f, labels)
+    os.replace(f"{labels_path}.{os.getpid()}.tmp", labels_path)
+    os.replace(tmp_path, features_path)
+    print(f"cached the resnet18 features of {start} {split} clips in {time.time() - time1:.1f}s, "
+          f"{os.path.getsize(features_path) / 2**20:.1f}MB in {features_path}")
+    return features_path, labels_path
+
+class FeatureDataset(data.Dataset):
+    '''
+    The resnet18 features of a split, mapped from the files written by build_feature_cache.
+    Items are ([T, tokens, 128] float32, label), the input of pre_dim.
+    '''
+    def __init__(self, features_path:str, labels_path:str) -> None:
+        super().__init__()
+        self.features = np.load(features_path, mmap_mode="r")
+        self.labels = np.load(labels_path)
+
+    def __getitem__(self, index):
+        return torch.from_numpy(self.features[index].astype(np.float32)), self.labels[index]
+
+    def __len__(self):
+        return self.features.shape[0]
@@ -0,0 +1,136 @@
+import os
+import sys
+import time
+import h5py
+import numpy as np
+import torch
+import torch.utils.data as data
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import Config
+from utils.general_videoimgs_dataset import ManifestImgsDataset
+
+# The clips are stored as one uint8 array [N, C, T, H, W] chunked one clip per chunk,
+# so reading a clip touches exactly one chunk and comes back as a single contiguous array.
+
+def convert_to_h5(manifest_path:str, h5_path:str, split:str, compression=None, compression_opts=None, root=None):
+    '''
+    Write the clips of one split of a manifest (see utils/spilt.spilt_manifest) into a chunked HDF5 file.
+    manifest_path: the split manifest
+    h5_path: the output file, like {root}/hmdb_dataset0_train.h5
+    split: train, val or test
+    compression: None, "gzip" or "lzf"
+    compression_opts: the gzip level (0-9)
+    raise: ValueError naming the clip when a clip has another shape than the first one (a dir with more or
+    fewer frames), no partial file is left behind
+    '''
+    clips = ManifestImgsDataset(manifest_path, split, root=root)
+    first, _ = clips[0]
+    clip_shape = tuple(first.shape)# C, T, H, W
+    tmp_path = h5_path + ".tmp"
+    try:
+        with h5py.File(tmp_path, "w") as f:
+            dset = f.create_dataset("clips", shape=(len(clips),) + clip_shape, dtype=np.uint8,
+                                    chunks=(1,) + clip_shape, compression=compression, compression_opts=compression_opts)
+            labels = f.create_dataset("labels", shape=(len(clips), 1), dtype=np.int64)
+            for i in range(len(clips)):
+                clip, label = clips[i]
+                if tuple(clip.shape) != clip_shape:
+                    raise ValueError(f"{clips.imgs_path[i]} is a clip of shape {list(clip.shape)} (C, T, H, W), the clips of "
+                                     f"{split} are {list(clip_shape)} like {clips.imgs_path[0]}, every clip needs the same frame count")
+                dset[i] = (clip * 255).round().clamp_(0, 255).to(torch.uint8).numpy()
+                labels[i] = label
+            f.attrs["classes"] = clips.labels
+            f.attrs["split"] = split
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    os.replace(tmp_path, h5_path)
+    return h5_path
+
+class HMDBDataset(data.Dataset):
+    '''
+    A PyTorch dataset over an HDF5 file written by convert_to_h5.
+    Args:
+    - h5_path (str): The HDF5 file.
+    - transform (transformer): The transformer to apply to the clip.
+    - cache_mb (int): The HDF5 chunk cache per open handle, in MB.
+    - cache_slots (int): The number of hash slots of the chunk cache, best a prime about 100x the cached chunks.
+
+    The file is opened lazily on first access, so every DataLoader worker gets its own handle.
+    '''
+    def __init__(self, h5_path:str, transform=None, cache_mb=32, cache_slots=10007) -> None:
+        super().__init__()
+        self.h5_path = h5_path
+        self.transform = transform
+        self.cache_mb = cache_mb
+        self.cache_slots = cache_slots
+        with h5py.File(self.h5_path, "r") as f:
+            self.length = f["clips"].shape[0]
+            self.labels = f["labels"][:]
+        self.file = None
+        self.clips = None
+
+    def open(self):
+        self.file = h5py.File(self.h5_path, "r", rdcc_nbytes=self.cache_mb * 1024 * 1024,
+                              rdcc_nslots=self.cache_slots, rdcc_w0=1.0)
+        self.clips = self.file["clips"]
+
+    def __getstate__(self):
+        # h5py handles can't be pickled into worker processes, each worker reopens the file
+        state = self.__dict__.copy()
+        state["file"] = None
+        state["clips"] = None
+        return state
+
+    def __getitem__(self, index):
+        if self.file is None:
+            self.open()
+        clip = torch.from_numpy(self.clips[index]).float().div_(255)# C, T, H, W
+        if self.transform is not None:
+            clip = self.transform(clip)
+        return clip, self.labels[index]
+
+    def __len__(self):
+        return self.length
+
+def HMDBDataset_download(split, download=False, transform=None, config=Config.getInstance("base.json")):
+    '''
+    HMDB can't be fetched automatically, so "download" builds {root}/{dataset_name}_{split}.h5
+    from the split manifest {root}/{dataset_name}_manifest.npz when the HDF5 file is missing.
+    '''
+    h5_path = config["root"] + "/" + config["dataset_name"] + "_" + split + ".h5"
+    if os.path.exists(h5_path):
+        return h5_path
+    manifest_path = config["root"] + "/" + config["dataset_name"] + "_manifest.npz"
+    if not download or not os.path.exists(manifest_path):
+        raise FileNotFoundError(f"{h5_path} does not exist, convert the clips with datasets/hmdb_data.py first")
+    return convert_to_h5(manifest_path, h5_path, split)
+
+def measure_throughput(dataset, num_clips=64, num_workers=0, batch_size=8):
+    '''
+    return: clips per second over the first num_clips clips of the dataset
+    '''
+    loader = data.DataLoader(data.Subset(dataset, range(min(num_clips, len(dataset)))),
+                             batch_size=batch_size, num_workers=num_workers, shuffle=False)
+    nums = 0
+    time1 = time.time()
+    for x, _ in loader:
+        nums += x.size(0)
+    return nums / (time.time() - time1)
+
+if __name__ == "__main__":
+    # python datasets/hmdb_data.py <manifest.npz> <out_dir> <dataset_name> [gzip|lzf]
+    manifest_path, out_dir, name = sys.argv[1], sys.argv[2], sys.argv[3]
+    compression = sys.argv[4] if len(sys.argv) > 4 else None
+    if not os.path.exists(out_dir):
+        os.makedirs(out_dir)
+    for split in ["train", "val", "test"]:
+        h5_path = os.path.join(out_dir, f"{name}_{split}.h5")
+        time1 = time.time()
+        convert_to_h5(manifest_path, h5_path, split, compression=compression)
+        print(f"{split}: converted in {time.time() - time1:.1f}s, {os.path.getsize(h5_path) / 1024 ** 2:.1f}MB")
+    jpeg_speed = measure_throughput(ManifestImgsDataset(manifest_path, "train"))
+    h5_speed = measure_throughput(HMDBDataset(os.path.join(out_dir, f"{name}_train.h5")))
+    print(f"jpeg dirs: {jpeg_speed:.1f} clips/s, hdf5: {h5_speed:.1f} clips/s, speedup x{h5_speed / jpeg_speed:.2f}")
@@ -0,0 +1,81 @@
+import os
+import numpy as np
+import torch.utils.data as data
+
+# One copy of a split for every process of a sweep: the images are exported once to a .npy file
+# (in /dev/shm when it exists) and every run maps it read-only, so the pages live once in the
+# page cache / shared memory and a worker only adds the sample it is currently reading.
+
+def default_shared_dir():
+    if os.path.isdir("/dev/shm"):
+        return "/dev/shm/lmttm_datasets"
+    return "./datasets_data/shared"
+
+def shared_paths(shared_dir:str, dataset_name:str, split:str):
+    return (os.path.join(shared_dir, f"{dataset_name}_{split}_imgs.npy"),
+            os.path.join(shared_dir, f"{dataset_name}_{split}_labels.npy"))
+
+def export_split(config, split:str, shared_dir:str):
+    '''
+    Export one MedMNIST split of the configure to shared_dir, once.
+    return: (images path, labels path)
+    '''
+    imgs_path, labels_path = shared_paths(shared_dir, config["dataset_name"], split)
+    if os.path.exists(imgs_path) and os.path.exists(labels_path):
+        return imgs_path, labels_path
+    if not os.path.exists(shared_dir):
+        os.makedirs(shared_dir, exist_ok=True)
+    from .medmnist_data import MedMNISTDataset
+    if not os.path.exists(config["root"]):
+        os.makedirs(config["root"])
+    medmnist_data = MedMNISTDataset(dataset_name=config["dataset_name"], split=split, download=True, root=config["root"]).dataset
+    # write then rename, so concurrent sweeps never map a half written file
+    for path, array in [(labels_path, medmnist_data.labels), (imgs_path, medmnist_data.imgs)]:
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            np.save(f, np.ascontiguousarray(array))
+        os.replace(tmp_path, path)
+    return imgs_path, labels_path
+
+class SharedMedMNISTDataset(data.Dataset):
+    '''
+    A MedMNIST split mapped from the files written by export_split, same items as MedMNISTDataset.
+    Args:
+    - shared_dir (str): The dir given to export_split.
+    - dataset_name (str): Like organmnist3d.
+    - split (str): train, val or test.
+    '''
+    def __init__(self, shared_dir:str, dataset_name:str, split:str, transform=None, target_transform=None) -> None:
+        super().__init__()
+        imgs_path, labels_path = shared_paths(shared_dir, dataset_name, split)
+        self.imgs = np.load(imgs_path, mmap_mode="r")
+        self.labels = np.load(labels_path, mmap_mode="r")
+        self.transform = transform
+        self.target_transform = target_transform
+
+    def __getitem__(self, index):
+        # same as medmnist.MedMNIST3D: 1x28x28x28 in [0,1] and an array of the label
+        img = self.imgs[index][None] / 255.0
+        target = self.labels[index].astype(int)
+        if self.transform is not None:
+            img = self.transform(img)
+        if self.target_transform is not None:
+            target = self.target_transform(target)
+        return img, target
+
+    def __len__(self):
+        return self.imgs.shape[0]
+
+def memory_usage():
+    '''
+    return: the resident memory of this process in MB, split into private (anon) and shared (file / shmem) pages
+    '''
+    usage = {}
+    if not os.path.exists("/proc/self/status"):
+        return usage
+    with open("/proc/self/status", "r") as f:
+        for line in f:
+            key, _, value = line.partition(":")
+            if key in ["VmRSS", "RssAnon", "RssFile", "RssShmem"]:
+                usage[key] = int(value.split()[0]) / 1024
+    return usage
@@ -10,7 +10,9 @@ sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from utils.get_data_iter import get_dataloader
 import time
 from utils.log import logger
-from config import Config
+from config import Config, compile_config
+from config.configure import config_arg_parser, get_config
+from utils.checkpoint import checkpoint_path, load_checkpoint
 import tqdm
 import torchvision.transforms as transforms
 import torch.nn as nn 
@@ -18,9 +20,9 @@ import os
 from utils.video_transforms import *
 from torch.utils.data import Dataset,DataLoader
 
-json_path = sys.argv[1]
-# json_path = "base.json"
-config = Config.getInstance(json_path)
+args = config_arg_parser("evaluate the last checkpoints of a run").parse_args()
+config = get_config(args)
+spec = compile_config(config)# validate the configure before any data is loaded
 os.environ["CUDA_VISIBLE_DEVICES"] = config["train"]["gpu"]
 
 if config["model"]["model"] == "ttm":
@@ -72,17 +74,19 @@ if __name__ == "__main__":
     avg_auc = 0
     avg_acc = 0
 
-    pth = f".\\check_point\\{config['train']['name']}\\"
-    pth_files = [f"{pth}{config['train']['name']}_epoch_{i}.pth" for i in range(1, 21)] 
+    pth_files = [checkpoint_path(config['train']['name'], i) for i in range(1, 21)]
+    time_start = time.time()
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+    model = TokenTuringMachineEncoder(spec).to(device)# built once, every checkpoint is loaded into it
+    criterion = nn.CrossEntropyLoss()
+    load_time = 0
     for i in tqdm.tqdm(range(len(pth_files)),leave=True):
-        checkpoint = torch.load(pth_files[i])
-        load_state = checkpoint["model"]
-        load_memory_tokens = checkpoint["memory_tokens"]
-        memory_tokens = load_memory_tokens
-        model = TokenTuringMachineEncoder(config).cuda()
-        model.load_state_dict(load_state)
-        criterion = nn.CrossEntropyLoss()
-        evaluate_loss, evaluate_auc, evaluate_acc = test(model, test_evaluator, test_loader, criterion, "cuda", "run", save_folder = None, memory_tokens = memory_tokens)
+        time1 = time.time()
+        memory_tokens = load_checkpoint(pth_files[i], model, device)
+        load_time += time.time() - time1
+        if i == 0:
+            print(f"startup took {time.time() - time_start:.2f}s")
+        evaluate_loss, evaluate_auc, evaluate_acc = test(model, test_evaluator, test_loader, criterion, device, "run", save_folder = None, memory_tokens = memory_tokens)
         
         avg_auc += evaluate_auc
         avg_acc += evaluate_acc
@@ -98,7 +102,7 @@ if __name__ == "__main__":
             pass
         else:
             os.mkdir("./experiment")
-        experiment_path = f".\\experiment\\" + config["dataset_name"] + "_exp.txt"
+        experiment_path = os.path.join("./experiment", config["dataset_name"] + "_exp.txt")
         with open(experiment_path, "a") as file:
             # Redirecting data from print to file
             print(f"{config['train']['name']} pth{i} evaluate_auc: {evaluate_auc}", file=file)
@@ -118,6 +122,7 @@ if __name__ == "__main__":
         print(f"{config['train']['name']} avg_acc: {avg_acc}", file=file)
     print(f"{config['train']['name']} avg_acc: {avg_acc}")
 
+    print(f"loading a checkpoint took {load_time/len(pth_files)*1000:.1f}ms on average")
     with open(experiment_path, "a") as file:
         print(" ", file=file)
 
@@ -1,12 +1,7 @@
-import os
-import json
+from sweep import sweep_arg_parser, run_sweep_from_args
 
 exp_json = "exp_memory_lmttm.json" 
 
-def run_exp(exp_json): 
-    os.system("python exp\\train.py " + exp_json)
-    os.system("python exp\\evaluate.py " + exp_json)
-
 train_config = {
 
     "name":["exp0_mem64_dim64", "exp1_mem64_dim160", "exp2_mem64_dim256", "exp3_mem64_dim352", "exp4_mem64_dim448",
@@ -29,16 +24,6 @@ train_config = {
 }
 
 if __name__ == "__main__":
-    for i in range(len(train_config["name"])):
-       
-            with open(f'./config/{exp_json}', 'r') as file:
-                data = json.load(file)
-
-            data['train']['name'] = train_config["name"][i]
-            data['model']['memory_tokens_size'] = train_config["memory_tokens_size"][i]
-            data['model']['dim'] = train_config["dim"][i]
-
-            with open(f'./config/{exp_json}', 'w') as file:
-                json.dump(data, file, indent=4)
-            
-            run_exp(exp_json)
\ No newline at end of file
+    # every run gets its configure as an in-memory overlay, config/exp_memory_lmttm.json is not rewritten
+    args = sweep_arg_parser("run the exp_memory_lmttm sweep").parse_args()
+    run_sweep_from_args(exp_json, train_config, args)
@@ -1,12 +1,7 @@
-import os
-import json
+from sweep import sweep_arg_parser, run_sweep_from_args
 
 exp_json = "exp_preprocess_noise.json" 
 
-def run_exp(exp_json): 
-    os.system("python exp\\train.py " + exp_json)
-    os.system("python exp\\evaluate.py " + exp_json)
-
 train_config = {
     "name":["exp0_3d_None", "exp1_3d_uniform", "exp2_3d_laplace", "exp3_3d_normal", "exp4_3d_exp", "exp5_3d_gamma", "exp6_3d_poisson",
             "exp7_3dBN_None", "exp8_3dBN_uniform", "exp9_3dBN_laplace", "exp10_3dBN_normal", "exp11_3dBN_exp", "exp12_3dBN_gamma", "exp13_3dBN_poisson"],    
@@ -22,17 +17,6 @@ train_config = {
 }
 
 if __name__ == "__main__":
-    for i in range(len(train_config["name"])):
-       
-            with open(f'./config/{exp_json}', 'r') as file:
-                data = json.load(file)
-
-            data['train']['name'] = train_config["name"][i]
-            data['model']['preprocess_mode'] = train_config["preprocess_mode"][i]
-            data['model']['load_memory_add_noise'] = train_config["load_memory_add_noise"][i]
-            data['model']['load_memory_add_noise_mode'] = train_config["load_memory_add_noise_mode"][i]
-
-            with open(f'./config/{exp_json}', 'w') as file:
-                json.dump(data, file, indent=4)
-            
-            run_exp(exp_json)
\ No newline at end of file
+    # every run gets its configure as an in-memory overlay, config/exp_preprocess_noise.json is not rewritten
+    args = sweep_arg_parser("run the exp_preprocess_noise sweep").parse_args()
+    run_sweep_from_args(exp_json, train_config, args)
@@ -1,25 +1,12 @@
-import os
-import json
+from sweep import sweep_arg_parser, run_sweep_from_args
 
 exp_json = "base.json" 
 
-def run_exp(exp_json):
-    os.system("python exp\\train.py " + exp_json)
-    os.system("python exp\\evaluate.py " + exp_json)
-
 train_config = {
     "name": ["test001"]
 }
 
-if __name__ == "__main__": 
-    for i in range(len(train_config["name"])):
-            
-            with open(f'./config/{exp_json}', 'r') as file:
-                data = json.load(file)
-
-            data["train"]["name"] = train_config["name"][i]
-
-            with open(f'./config/{exp_json}', 'w') as file:
-                json.dump(data, file, indent=4)
-            
-            run_exp(exp_json)
+if __name__ == "__main__":
+    # every run gets its configure as an in-memory overlay, config/base.json is not rewritten
+    args = sweep_arg_parser("run the base sweep").parse_args()
+    run_sweep_from_args(exp_json, train_config, args)
@@ -5,7 +5,8 @@ sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from utils.get_data_iter import get_dataloader
 import time
 from utils.log import logger
-from config import Config
+from config import Config, compile_config
+from utils.checkpoint import checkpoint_path, load_checkpoint
 import torch
 import tqdm
 import torchvision.transforms as transforms
@@ -18,6 +19,7 @@ import sys
 json_path = sys.argv[1]
 # json_path = "base.json"
 config = Config.getInstance(json_path)
+spec = compile_config(config)# validate the configure before any data is loaded
 os.environ["CUDA_VISIBLE_DEVICES"] = config["train"]["gpu"]
 
 if config["model"]["model"] == "ttm":
@@ -30,25 +32,27 @@ transform_test = Compose([
 
 log_writer = logger(config["train"]["name"] + "_test")()
 test_loader = get_dataloader("test", config=config, download=False, transform=None)
-pth = f".\\check_point\\{config['train']['name']}\\"
-pth_files = [f"{pth}{config['train']['name']}_epoch_{i}.pth" for i in range(1, 21)] 
+pth_files = [checkpoint_path(config['train']['name'], i) for i in range(1, 21)]
 
 
 def predict():
     avg_acc = 0
+    time_start = time.time()
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+    model = TokenTuringMachineEncoder(spec).to(device)# built once, every checkpoint is loaded into it
+    model.eval()
+    load_time = 0
     for i in tqdm.tqdm(range(len(pth_files)),leave=True):
-        checkpoint = torch.load(pth_files[i])
-        load_state = checkpoint["model"]
-        load_memory_tokens = checkpoint["memory_tokens"]
-        memory_tokens = load_memory_tokens
-        model = TokenTuringMachineEncoder(config).cuda()
-        model.eval()
-        model.load_state_dict(load_state)
+        time1 = time.time()
+        memory_tokens = load_checkpoint(pth_files[i], model, device)
+        load_time += time.time() - time1
+        if i == 0:
+            print(f"startup took {time.time() - time_start:.2f}s")
         all_y = 0
         all_real = 0
         for x,y in tqdm.tqdm(test_loader,leave=False):
-            x = x.to("cuda", dtype = torch.float32)
-            y = y.to("cuda", dtype = torch.long)
+            x = x.to(device, dtype = torch.float32)
+            y = y.to(device, dtype = torch.long)
             if config["train"]["load_memory_tokens"]:
                 out, memory_tokens = model(x, memory_tokens)
             else:
@@ -81,7 +85,7 @@ def predict():
             pass
         else:
             os.mkdir("./experiment")
-        experiment_path = f".\\experiment\\" + config["dataset_name"] + "_exp.txt"
+        experiment_path = os.path.join("./experiment", config["dataset_name"] + "_exp.txt")
         with open(experiment_path, "a") as file:
             # Redirecting data from print to file
             print(f"{config['train']['name']} pth{i} test_acc: {test_acc}%", file=file)
@@ -91,6 +95,7 @@ def predict():
     with open(experiment_path, "a") as file:
             # Redirecting data from print to file
             print(f"{config['train']['name']} avg_acc: {avg_acc}%", file=file)
+    print(f"loading a checkpoint took {load_time/len(pth_files)*1000:.1f}ms on average")
     with open(experiment_path, "a") as file:
         print(" ", file=file)
     log_writer.close()
@@ -0,0 +1,156 @@
+import os
+import sys
+import json
+import time
+import argparse
+import itertools
+import subprocess
+from concurrent.futures import ThreadPoolExecutor, as_completed
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+from config.configure import load_config
+from datasets.shared_data import default_shared_dir, export_split
+from utils.flops import estimate, format_count
+
+# Runs the configurations of an experiment in parallel. Every run gets its configure as an
+# in-memory overlay on the command line (config/ is never rewritten), runs in its own process
+# with a thread budget, and leaves a .done.json marker when train and evaluate both finished,
+# so re-running a sweep skips finished runs and resumes after a crash. The MedMNIST splits are
+# exported once to shared memory and every run maps them (datasets/shared_data.py).
+
+def expand_grid(name, **axes):
+    '''
+    name: a format string for the run names, like "exp{i}_mem{memory_tokens_size}_dim{dim}"
+    axes: the values of each configure key, like memory_tokens_size=[64, 160], dim=[64, 160]
+    return: the train_config dict of lists used by the exp scripts, one entry per point of the grid
+    '''
+    keys = list(axes.keys())
+    train_config = {"name": []}
+    for key in keys:
+        train_config[key] = []
+    for i, values in enumerate(itertools.product(*[axes[key] for key in keys])):
+        point = dict(zip(keys, values))
+        train_config["name"].append(name.format(i=i, **point))
+        for key in keys:
+            train_config[key].append(point[key])
+    return train_config
+
+def make_overlays(exp_json, train_config):
+    '''
+    train_config: {"name": [...], "<key>": [...]} as in the exp scripts, the keys are looked up in
+    the model, train and top-level sections of the configure
+    return: [(run name, overlay dict)]
+    '''
+    config = load_config(exp_json)
+    runs = []
+    for i, name in enumerate(train_config["name"]):
+        overlay = {"train": {"name": name}}
+        for key, values in train_config.items():
+            if key == "name":
+                continue
+            if hasattr(config["model"], key):
+                overlay.setdefault("model", {})[key] = values[i]
+            elif hasattr(config["train"], key):
+                overlay["train"][key] = values[i]
+            else:
+                overlay[key] = values[i]
+        runs.append((name, overlay))
+    return runs
+
+def run_one(exp_json, name, overlay, run_dir, threads, scripts):
+    env = os.environ.copy()
+    env["OMP_NUM_THREADS"] = str(threads)
+    env["MKL_NUM_THREADS"] = str(threads)
+    time1 = time.time()
+    with open(os.path.join(run_dir, name + ".log"), "a") as log:
+        for script in scripts:
+            # a run killed half way continues from its last epoch instead of starting over
+            resume = ["--resume"] if os.path.basename(script) == "train.py" else []
+            code = subprocess.call([sys.executable, os.path.join(ROOT, script), exp_json, "--overlay", json.dumps(overlay)] + resume,
+                                   stdout=log, stderr=subprocess.STDOUT, env=env)
+            if code != 0:
+                return name, code, time.time() - time1
+    with open(os.path.join(run_dir, name + ".done.json"), "w") as f:
+        json.dump({"overlay": overlay, "seconds": time.time() - time1}, f, indent=4)
+    return name, 0, time.time() - time1
+
+def share_datasets(exp_json, runs, shared_dir):
+    '''
+    Export the splits of every MedMNIST dataset used by the runs once and point the runs at them.
+    '''
+    for name, overlay in runs:
+        config = load_config(exp_json, overlay)
+        if "mnist" not in config["dataset_name"]:
+            continue
+        for split in ["train", "val", "test"]:
+            export_split(config, split, shared_dir)
+        overlay["shared_data_dir"] = shared_dir
+
+def print_costs(exp_json, runs):
+    '''
+    Print the parameters and forward FLOPs per sample of every run (utils/flops.py) before launching.
+    '''
+    print(f"{'run':<32}{'params':>10}{'FLOPs/sample':>15}")
+    for name, overlay in runs:
+        try:
+            result = estimate(load_config(exp_json, overlay))
+        except ValueError:
+            print(f"{name:<32}{'invalid configure':>25}")
+            continue
+        print(f"{name:<32}{format_count(result['total_params']):>10}{format_count(result['total_flops']):>15}")
+
+def run_sweep(exp_json, train_config, sweep_name=None, cpus=None, threads=1, gpus=None,
+              scripts=("exp/train.py", "exp/evaluate.py"), sweep_dir="./sweeps", shared_dir=None):
+    '''
+    exp_json: the configure file in config/ the overlays are merged over
+    train_config: {"name": [...], "<key>": [...]}, see make_overlays / expand_grid
+    sweep_name: the dir of the run logs and markers under sweep_dir, the exp_json name by default
+    cpus: the cpu budget of the whole sweep, all cores by default
+    threads: the torch threads of each run, cpus // threads runs go in parallel
+    gpus: the gpus to hand out round-robin through train.gpu, like ["0", "1"]
+    shared_dir: where the datasets are exported for all the runs, default_shared_dir() by default, "" loads them in every run
+    return: the names of the failed runs
+    '''
+    sweep_name = sweep_name or os.path.splitext(exp_json)[0]
+    run_dir = os.path.join(sweep_dir, sweep_name)
+    if not os.path.exists(run_dir):
+        os.makedirs(run_dir)
+    cpus = cpus or os.cpu_count()
+    workers = max(1, cpus // threads)
+
+    runs = make_overlays(exp_json, train_config)
+    if gpus:
+        for i, (name, overlay) in enumerate(runs):
+            overlay["train"]["gpu"] = gpus[i % len(gpus)]
+    print_costs(exp_json, runs)
+    todo = [(name, overlay) for name, overlay in runs if not os.path.exists(os.path.join(run_dir, name + ".done.json"))]
+    shared_dir = default_shared_dir() if shared_dir is None else shared_dir
+    if shared_dir and todo:
+        share_datasets(exp_json, todo, shared_dir)
+    print(f"{sweep_name}: {len(runs) - len(todo)} of {len(runs)} runs already finished, {len(todo)} to go on {workers} workers x {threads} threads")
+
+    failed = []
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(run_one, exp_json, name, overlay, run_dir, threads, scripts) for name, overlay in todo]
+        for future in as_completed(futures):
+            name, code, seconds = future.result()
+            if code != 0:
+                failed.append(name)
+            print(f"{name}: {'done' if code == 0 else f'failed with exit code {code}'} in {seconds:.0f}s")
+    if failed:
+        print(f"{sweep_name}: failed runs {failed}, see {run_dir}/<name>.log and re-run to retry them")
+    return failed
+
+def sweep_arg_parser(description=None):
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument("--cpus", type=int, default=None, help="cpu budget of the whole sweep, all cores by default")
+    parser.add_argument("--threads", type=int, default=1, help="torch threads per run")
+    parser.add_argument("--gpus", default=None, help="comma separated gpus handed out round-robin, like 0,1")
+    parser.add_argument("--sweep-dir", default="./sweeps")
+    parser.add_argument("--shared-dir", default=None, help="dir the datasets are shared through, /dev/shm by default, '' to load them in every run")
+    return parser
+
+def run_sweep_from_args(exp_json, train_config, args):
+    gpus = args.gpus.split(",") if args.gpus else None
+    return run_sweep(exp_json, train_config, cpus=args.cpus, threads=args.threads, gpus=gpus, sweep_dir=args.sweep_dir,
+                     shared_dir=args.shared_dir)
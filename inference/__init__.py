@@ -0,0 +1,4 @@
+from .engine import InferenceEngine
+from .batcher import DynamicBatcher
+from .stats import ServingStats
+from .server import make_server, InProcessClient, HTTPClient
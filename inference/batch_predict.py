@@ -0,0 +1,209 @@
+import os
+import sys
+import json
+import time
+import queue
+import threading
+import multiprocessing as mp
+import numpy as np
+import torch
+import tqdm
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from config import compile_config
+from config.configure import config_arg_parser, get_config
+from utils.checkpoint import checkpoint_path
+from inference.engine import InferenceEngine
+from inference.batcher import Request
+
+# Predictions for a directory or a manifest of .npy / .npz volumes with one checkpoint.
+# A reader thread loads the volumes into a bounded queue (--prefetch) while the batches run, the
+# results are appended to a .jsonl file, one line per volume, flushed after every batch. A volume
+# whose line is in the file is skipped on the next run, so an interrupted run resumes where it
+# stopped. With --workers N the volumes are split over N processes, each with its own model,
+# and the parent alone writes the file.
+# Every volume starts from the memory of the checkpoint (see inference/engine.py), so its result
+# does not depend on the batch it lands in.
+
+EXTENSIONS = (".npy", ".npz")
+
+def list_inputs(inputs=None, manifest=None):
+    '''
+    inputs: a directory searched recursively for .npy / .npz files
+    manifest: a text file with one path per line, relative to the manifest
+    return: the sorted paths
+    '''
+    if manifest is not None:
+        root = os.path.dirname(os.path.abspath(manifest))
+        with open(manifest, "r") as f:
+            paths = [line.strip() for line in f if line.strip() and not line.startswith("#")]
+        return [path if os.path.isabs(path) else os.path.join(root, path) for path in paths]
+    paths = []
+    for dirpath, _, filenames in os.walk(inputs):
+        paths.extend(os.path.join(dirpath, name) for name in filenames if name.endswith(EXTENSIONS))
+    return sorted(paths)
+
+def load_volume(path, npz_key=None):
+    '''
+    return: float32 [C, T, H, W], uint8 volumes are scaled to [0, 1] like the datasets
+    '''
+    if path.endswith(".npz"):
+        with np.load(path, allow_pickle=False) as arrays:
+            volume = arrays[npz_key or arrays.files[0]]
+    else:
+        volume = np.load(path, allow_pickle=False)
+    if volume.dtype == np.uint8:
+        volume = volume / 255.0
+    if volume.ndim == 3:
+        volume = volume[None]# [T, H, W] -> one channel
+    if volume.ndim != 4:
+        raise ValueError(f"expected [T, H, W] or [C, T, H, W], got shape {list(volume.shape)}")
+    return volume.astype(np.float32)
+
+def finished(output):
+    '''
+    return: the paths with a result in output; a line cut by an interruption is removed
+    '''
+    done = set()
+    if not os.path.exists(output):
+        return done
+    with open(output, "rb+") as f:
+        data = f.read()
+        end = data.rfind(b"\n") + 1
+        if end != len(data):
+            f.truncate(end)
+    for line in data[:end].decode("utf-8").splitlines():
+        try:
+            result = json.loads(line)
+        except json.JSONDecodeError:
+            continue
+        if "error" not in result:# failed volumes are tried again
+            done.add(result["path"])
+    return done
+
+def _reader(paths, prefetch, npz_key):
+    volumes = queue.Queue(maxsize=prefetch)
+    def read():
+        for path in paths:
+            try:
+                volumes.put((path, load_volume(path, npz_key), None))
+            except Exception as e:
+                volumes.put((path, None, repr(e)))
+        volumes.put(None)
+    threading.Thread(target=read, daemon=True).start()
+    return volumes
+
+def predict_paths(engine, paths, emit, batch_size=16, prefetch=64, npz_key=None):
+    '''
+    Runs the volumes of paths in batches and calls emit(result) for each, result is a dict
+    {"path", "class", "logits"} or {"path", "error"}.
+    '''
+    batch_size = min(batch_size, engine.max_batch or batch_size)
+    volumes = _reader(paths, prefetch, npz_key)
+    end = False
+    while not end:
+        batch = []
+        while len(batch) < batch_size:
+            item = volumes.get()
+            if item is None:
+                end = True
+                break
+            path, volume, error = item
+            if error is not None:
+                emit({"path": path, "error": error})
+            else:
+                batch.append((path, Request(torch.from_numpy(volume), None)))
+        if not batch:
+            continue
+        try:
+            logits = engine.run([request for _, request in batch])
+        except Exception as e:
+            for path, _ in batch:
+                emit({"path": path, "error": repr(e)})
+            continue
+        for (path, _), out in zip(batch, logits):
+            emit({"path": path, "class": int(torch.argmax(out)), "logits": [round(x, 6) for x in out.tolist()]})
+
+def _worker(spec, checkpoint, paths, results, batch_size, prefetch, npz_key, threads, device):
+    torch.set_num_threads(threads)
+    engine = InferenceEngine(spec, checkpoint, device)
+    try:
+        predict_paths(engine, paths, results.put, batch_size, prefetch, npz_key)
+    finally:
+        results.put(None)
+
+def batch_predict(config, checkpoint, paths, output, batch_size=16, prefetch=64, workers=1, threads=None, npz_key=None, device=None):
+    '''
+    Appends the results of the paths not yet in output to it.
+    config: the Config or RuntimeSpec of the checkpoint
+    return: (volumes predicted, volumes failed)
+    '''
+    spec = compile_config(config)
+    done = finished(output)
+    todo = [path for path in paths if path not in done]
+    print(f"{len(paths) - len(todo)} of {len(paths)} volumes already in {output}, {len(todo)} to go on {workers} workers")
+    if not todo:
+        return 0, 0
+    counts = {"ok": 0, "error": 0}
+    bar = tqdm.tqdm(total=len(todo))
+    with open(output, "a") as f:
+        def emit(result):
+            f.write(json.dumps(result) + "\n")
+            counts["error" if "error" in result else "ok"] += 1
+            bar.update(1)
+            if bar.n % batch_size == 0:
+                f.flush()
+        if workers <= 1:
+            if threads:
+                torch.set_num_threads(threads)
+            predict_paths(InferenceEngine(spec, checkpoint, device), todo, emit, batch_size, prefetch, npz_key)
+        else:
+            context = mp.get_context("spawn")
+            results = context.Queue(maxsize=prefetch)
+            threads = threads or max(1, (os.cpu_count() or 1) // workers)
+            processes = [context.Process(target=_worker, args=(spec, checkpoint, todo[rank::workers], results, batch_size,
+                                                               prefetch, npz_key, threads, device), daemon=True)
+                         for rank in range(workers)]
+            for process in processes:
+                process.start()
+            running = workers
+            while running:
+                try:
+                    result = results.get(timeout=5)
+                except queue.Empty:
+                    if not any(process.is_alive() for process in processes):
+                        break# a worker died without its end marker
+                    continue
+                if result is None:
+                    running -= 1
+                    continue
+                emit(result)
+            for process in processes:
+                process.join()
+    bar.close()
+    return counts["ok"], counts["error"]
+
+
+if __name__ == "__main__":
+    # python inference/batch_predict.py base.json --inputs /data/volumes --checkpoint check_point/exp0/exp0_epoch_10.pth --output preds.jsonl
+    parser = config_arg_parser("predict a directory or a manifest of .npy / .npz volumes with one checkpoint")
+    parser.add_argument("--inputs", default=None, help="a directory searched recursively for .npy / .npz volumes")
+    parser.add_argument("--manifest", default=None, help="a text file with one volume path per line")
+    parser.add_argument("--output", required=True, help="the .jsonl file the results are appended to, re-run to resume")
+    parser.add_argument("--checkpoint", default=None, help="the last checkpoint of train.name by default")
+    parser.add_argument("--batch-size", type=int, default=16)
+    parser.add_argument("--prefetch", type=int, default=64, help="volumes loaded ahead of the model")
+    parser.add_argument("--workers", type=int, default=1, help="processes, each with its own model")
+    parser.add_argument("--threads", type=int, default=None, help="torch threads per worker")
+    parser.add_argument("--npz-key", default=None, help="the array of the .npz files, the first one by default")
+    parser.add_argument("--device", default=None)
+    args = parser.parse_args()
+    if (args.inputs is None) == (args.manifest is None):
+        parser.error("give one of --inputs and --manifest")
+    config = get_config(args)
+    spec = compile_config(config)
+    paths = list_inputs(args.inputs, args.manifest)
+    time1 = time.time()
+    ok, failed = batch_predict(spec, args.checkpoint or checkpoint_path(spec.train.name, 10), paths, args.output,
+                               args.batch_size, args.prefetch, args.workers, args.threads, args.npz_key, args.device)
+    seconds = time.time() - time1
+    print(f"{ok} volumes predicted, {failed} failed in {seconds:.1f}s ({ok / max(seconds, 1e-9):.1f} volumes/s)")
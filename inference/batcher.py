@@ -0,0 +1,182 @@
+import time
+import threading
+from collections import deque
+from concurrent.futures import Future
+import torch
+from .stats import ServingStats
+
+# Requests are queued and run by one worker thread. A batch is started as soon as max_batch
+# requests are waiting, or when the oldest waiting request has waited max_latency_ms. A stream
+# contributes at most one request per batch, its later chunks stay queued in order since each
+# one starts from the memory the one before left. A stream id is None, a str or an int; anything
+# else is refused by submit, and an error while a batch is put together fails the requests it
+# concerns, never the worker, which is the only thread running requests. Closing a stream goes
+# through the queue as well: the worker drops its memory after the requests of the stream queued
+# before the close, and its requests queued after the close start a new memory, so the engine and
+# its MemoryStore are only ever touched by the worker.
+
+def check_stream(stream):
+    '''
+    raise: ValueError unless stream is None, a str or an int
+    '''
+    if stream is not None and (not isinstance(stream, (str, int)) or isinstance(stream, bool)):
+        raise ValueError(f"a stream is a str or an int, got {type(stream).__name__}")
+
+class Request():
+    __slots__ = ("input", "stream", "close", "future", "arrival", "started")
+
+    def __init__(self, input, stream, close=False) -> None:
+        self.input = input
+        self.stream = stream
+        self.close = close# drop the memory of stream instead of running input
+        self.future = Future()
+        self.arrival = time.perf_counter()
+        self.started = None
+
+class DynamicBatcher():
+    '''
+    Args:
+    - engine (InferenceEngine): runs the batches.
+    - max_batch (int): the largest batch run at once, capped by engine.max_batch.
+    - max_latency_ms (float): how long the oldest request waits for others to join its batch.
+    '''
+    def __init__(self, engine, max_batch=8, max_latency_ms=10.0, stats=None) -> None:
+        self.engine = engine
+        self.max_batch = min(max_batch, engine.max_batch or max_batch)
+        self.max_latency = max_latency_ms / 1000
+        self.stats = stats or ServingStats()
+        self.queue = deque()
+        self.condition = threading.Condition()
+        self.closed = False
+        self.thread = threading.Thread(target=self._worker, daemon=True)
+        self.thread.start()
+
+    def submit(self, input, stream=None):
+        '''
+        input: [C, T, H, W], a whole volume or a chunk of frames of a stream
+        return: a Future of {"logits": [...], "class": int, "latency_ms": float}
+        raise: ValueError for a stream that is not None, a str or an int
+        '''
+        check_stream(stream)
+        request = Request(torch.as_tensor(input), stream)
+        with self.condition:
+            if self.closed:
+                raise RuntimeError("the batcher is closed")
+            self.queue.append(request)
+            self.condition.notify()
+        return request.future
+
+    def close_stream(self, stream):
+        '''
+        return: a Future of whether the stream had a memory, set once the requests queued before are run
+        '''
+        check_stream(stream)
+        request = Request(None, stream, close=True)
+        with self.condition:
+            if self.closed:
+                raise RuntimeError("the batcher is closed")
+            self.queue.append(request)
+            self.condition.notify()
+        return request.future
+
+    def _take(self):
+        '''
+        return: (the next batch, the closes run after it, the queue depth when it was taken),
+        (None, [], 0) once closed and drained
+        '''
+        with self.condition:
+            while not self.queue:
+                if self.closed:
+                    return None, [], 0
+                self.condition.wait()
+            deadline = self.queue[0].arrival + self.max_latency
+            while len(self.queue) < self.max_batch and not self.closed:
+                left = deadline - time.perf_counter()
+                if left <= 0:
+                    break
+                self.condition.wait(left)
+            depth = len(self.queue)
+            # blocked: the streams with a request left queued, their later requests and closes wait behind it
+            batch, closes, rest, streams, blocked = [], [], deque(), set(), set()
+            for request in self.queue:
+                try:
+                    waits = request.stream is not None and request.stream in blocked
+                    fresh = request.stream is None or request.stream not in streams
+                except TypeError as e:
+                    request.future.set_exception(e)# an unhashable stream, only this request fails
+                    continue
+                if waits:
+                    rest.append(request)
+                elif request.close:
+                    closes.append(request)# after the batch, which may hold the request before it
+                    blocked.add(request.stream)
+                elif len(batch) < self.max_batch and fresh:
+                    batch.append(request)
+                    streams.add(request.stream)
+                else:
+                    rest.append(request)
+                    if request.stream is not None:
+                        blocked.add(request.stream)
+            self.queue = rest
+            return batch, closes, depth
+
+    def _fail_queued(self, error):
+        with self.condition:
+            queued, self.queue = self.queue, deque()
+        for request in queued:
+            if not request.future.done():
+                request.future.set_exception(error)
+
+    def _worker(self):
+        while True:
+            try:
+                batch, closes, depth = self._take()
+            except Exception as e:
+                self._fail_queued(e)# the queue may be half sorted, fail what is in it and keep serving
+                continue
+            if batch is None:
+                break
+            if batch:
+                self._run(batch, depth)
+            for request in closes:
+                try:
+                    request.future.set_result(self.engine.close_stream(request.stream))
+                except Exception as e:
+                    request.future.set_exception(e)
+
+    def _run(self, batch, depth):
+        started = time.perf_counter()
+        try:
+            logits = self.engine.run(batch)
+            error = None
+        except Exception as e:
+            error = e
+        done = time.perf_counter()
+        latencies = [(done - request.arrival) * 1000 for request in batch]
+        waits = [(started - request.arrival) * 1000 for request in batch]
+        self.stats.record_batch(len(batch), depth, latencies, waits, failed=error is not None)
+        for i, request in enumerate(batch):
+            if error is not None:
+                request.future.set_exception(error)
+            else:
+                request.future.set_result({"logits": logits[i].tolist(), "class": int(torch.argmax(logits[i])),
+                                           "latency_ms": latencies[i]})
+
+    def report(self):
+        report = self.stats.report()
+        with self.condition:
+            report["queue_depth"]["now"] = len(self.queue)
+        report["streams"] = len(self.engine.streams)
+        report["memory_store"] = self.engine.streams.report()
+        report["max_batch"] = self.max_batch
+        report["max_latency_ms"] = self.max_latency * 1000
+        return report
+
+    def close(self):
+        '''
+        Runs the requests still queued, then stops the worker.
+        '''
+        with self.condition:
+            self.closed = True
+            self.condition.notify()
+        self.thread.join()
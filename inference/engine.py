@@ -0,0 +1,102 @@
+import os
+import sys
+import torch
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from config.spec import MemoryMode
+from utils.checkpoint import build_encoder, load_checkpoint
+from utils.micro_batch import batch_rows, memory_flags
+from utils.memory_store import MemoryStore
+from utils.early_exit import EarlyExit
+
+# One encoder with one checkpoint loaded, run on batches put together by the DynamicBatcher.
+# A request may name a stream: with train.load_memory_tokens the memory tokens returned for it
+# are kept and fed back with its next request, like the memory carried from batch to batch by
+# predict.py, so a volume can be sent in chunks of frames. A stream starts from the memory of the
+# checkpoint (its first row); the linked memory (lmttm) block pointer is kept per stream as well.
+# The memory of the streams is a MemoryStore (utils/memory_store.py): the recently used streams in
+# RAM up to store_mb, the others spilled to disk. Requests are grouped by input shape and block
+# pointer, one gather, forward and scatter per group. With the transformer block of the old layout
+# (model.transformer_batch_first off) the rows of a batch attend to each other, so the output of a
+# request depends on the requests it is batched with, as it does in predict.py.
+
+class InferenceEngine():
+    '''
+    Args:
+    - spec (RuntimeSpec): the configure the checkpoint was trained with.
+    - checkpoint (str): a checkpoint written by train.py.
+    - device (str): cuda when available by default.
+    - store_mb (float): the RAM of the memory of the streams, train.memory_store_mb by default.
+    - spill_path (str): where the memory beyond store_mb goes, a temporary file by default.
+    '''
+    def __init__(self, spec, checkpoint, device=None, store_mb=None, spill_path=None) -> None:
+        self.spec = spec
+        self.device = device or ("cuda" if torch.cuda.is_available() else "cpu")
+        self.model = build_encoder(spec, self.device)
+        self.model.eval()
+        # model.early_exit_threshold > 0 stops the steps of a batch once every row is confident
+        self.early_exit = None
+        if spec.model.early_exit_threshold > 0:
+            self.early_exit = EarlyExit(spec.model.early_exit_threshold, spec.model.early_exit_k, spec.model.early_exit_temperature)
+        memory_tokens = load_checkpoint(checkpoint, self.model, self.device)
+        self.initial_memory = memory_tokens[:1] if memory_tokens is not None else None
+        self.linked, flags = memory_flags(self.model)
+        self.initial_flags = tuple(0 for _ in flags)
+        self.load_memory_tokens = spec.train.load_memory_tokens
+        # the TokenLearnerMHA queries have one row per batch row
+        self.max_batch = spec.batch_size if spec.model.memory_mode == MemoryMode.TL_MHA else None
+        self.streams = MemoryStore(spec.train.memory_store_mb if store_mb is None else store_mb, spill_path, self.initial_memory,
+                                   spec.train.memory_codec)
+        self.stream_flags = {}# stream -> block pointers, only for lmttm
+
+    def flags(self, stream):
+        '''
+        return: the block pointers the next request of stream starts from
+        '''
+        if not self.load_memory_tokens:
+            return self.initial_flags
+        return self.stream_flags.get(stream, self.initial_flags)
+
+    def close_stream(self, stream):
+        '''
+        Drop the memory of stream, from the thread calling run only (the DynamicBatcher queues the closes).
+        return: whether the stream had a memory
+        '''
+        self.stream_flags.pop(stream, None)
+        return self.streams.pop(stream)
+
+    def forward(self, inputs, memory_tokens, flags):
+        '''
+        inputs: [B, C, T, H, W] on any device
+        return: (logits [B, out_class_num] on the cpu, the new memory_tokens, the new block pointers)
+        '''
+        for module, flag in zip(self.linked, flags):
+            module.current_flag = flag
+        with torch.no_grad(), batch_rows(self.model, 0, inputs.size(0)):
+            inputs = inputs.to(self.device, dtype=torch.float32)
+            if self.early_exit is None:
+                out, memory_tokens = self.model(inputs, memory_tokens)
+            else:
+                out, memory_tokens = self.model.forward_early_exit(inputs, memory_tokens, self.early_exit)
+        return out.cpu(), memory_tokens, tuple(module.current_flag for module in self.linked)
+
+    def run(self, requests):
+        '''
+        requests: objects with .input [C, T, H, W] and .stream, at most one request per stream
+        return: the logits of every request, in order
+        '''
+        groups = {}
+        for i, request in enumerate(requests):
+            groups.setdefault((tuple(request.input.shape), self.flags(request.stream)), []).append(i)
+        logits = [None] * len(requests)
+        for (_, flags), items in groups.items():
+            inputs = torch.stack([requests[i].input for i in items])
+            streams = [requests[i].stream for i in items]
+            memory = self.streams.gather(streams, self.device) if self.load_memory_tokens else None
+            out, memory, new_flags = self.forward(inputs, memory, flags)
+            for row, i in enumerate(items):
+                logits[i] = out[row]
+            if self.load_memory_tokens:
+                self.streams.scatter(streams, memory)
+                if self.linked:
+                    self.stream_flags.update((stream, new_flags) for stream in streams if stream is not None)
+        return logits
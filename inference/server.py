@@ -0,0 +1,177 @@
+import os
+import io
+import sys
+import json
+import base64
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import numpy as np
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from config import compile_config
+from config.configure import config_arg_parser, get_config
+from utils.checkpoint import checkpoint_path
+from inference.engine import InferenceEngine
+from inference.batcher import DynamicBatcher, check_stream
+
+# A local HTTP front of the DynamicBatcher:
+#   POST /predict        {"input": [C][T][H][W] nested lists, or "npy": base64 of np.save, "stream": optional id}
+#                        -> {"logits": [...], "class": int, "latency_ms": float}
+#   POST /streams/close  {"stream": id} drops the memory kept for the stream, after its requests already queued
+#   GET  /stats          queue depth, batch size histogram, p50 / p99 latency
+# The input is a volume scaled like the datasets (values in [0, 1]), [C, T, H, W] without the batch axis.
+# InProcessClient has the same methods without the HTTP round trip, for tests and scripts.
+
+def decode_input(payload):
+    if "npy" in payload:
+        return np.load(io.BytesIO(base64.b64decode(payload["npy"])), allow_pickle=False).astype(np.float32)
+    return np.asarray(payload["input"], dtype=np.float32)
+
+def encode_input(input):
+    buffer = io.BytesIO()
+    np.save(buffer, np.asarray(input, dtype=np.float32))
+    return base64.b64encode(buffer.getvalue()).decode("ascii")
+
+class InferenceHandler(BaseHTTPRequestHandler):
+    timeout_s = 60
+
+    def _reply(self, code, body):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path == "/stats":
+            self._reply(200, self.server.batcher.report())
+        elif self.path == "/health":
+            self._reply(200, {"ok": True})
+        else:
+            self._reply(404, {"error": f"unknown path {self.path}"})
+
+    def do_POST(self):
+        try:
+            payload = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        except json.JSONDecodeError as e:
+            self._reply(400, {"error": f"invalid json: {e}"})
+            return
+        if self.path == "/predict":
+            try:
+                input = decode_input(payload)
+            except (KeyError, ValueError) as e:
+                self._reply(400, {"error": f"invalid input: {e}"})
+                return
+            if input.ndim != 4:
+                self._reply(400, {"error": f"input must be [C, T, H, W], got shape {list(input.shape)}"})
+                return
+            try:
+                check_stream(payload.get("stream"))
+            except ValueError as e:
+                self._reply(400, {"error": f"invalid stream: {e}"})
+                return
+            try:
+                result = self.server.batcher.submit(input, payload.get("stream")).result(self.timeout_s)
+            except Exception as e:
+                self._reply(500, {"error": repr(e)})
+                return
+            self._reply(200, result)
+        elif self.path == "/streams/close":
+            try:
+                check_stream(payload.get("stream"))
+            except ValueError as e:
+                self._reply(400, {"error": f"invalid stream: {e}"})
+                return
+            try:
+                closed = self.server.batcher.close_stream(payload.get("stream")).result(self.timeout_s)
+            except Exception as e:
+                self._reply(500, {"error": repr(e)})
+                return
+            self._reply(200, {"closed": closed})
+        else:
+            self._reply(404, {"error": f"unknown path {self.path}"})
+
+    def log_message(self, format, *args):
+        pass# one line per request would drown the stats
+
+def make_server(batcher, host="127.0.0.1", port=8000):
+    '''
+    return: the ThreadingHTTPServer, call serve_forever() on it
+    '''
+    server = ThreadingHTTPServer((host, port), InferenceHandler)
+    server.daemon_threads = True
+    server.batcher = batcher
+    return server
+
+class InProcessClient():
+    '''
+    The requests of the HTTP server, sent straight to a DynamicBatcher. A stream that is not None, a
+    str or an int raises ValueError (the 400 of the server).
+    '''
+    def __init__(self, batcher) -> None:
+        self.batcher = batcher
+
+    def predict(self, input, stream=None, timeout=60):
+        return self.batcher.submit(np.asarray(input, dtype=np.float32), stream).result(timeout)
+
+    def predict_async(self, input, stream=None):
+        return self.batcher.submit(np.asarray(input, dtype=np.float32), stream)
+
+    def close_stream(self, stream, timeout=60):
+        return self.batcher.close_stream(stream).result(timeout)
+
+    def stats(self):
+        return self.batcher.report()
+
+class HTTPClient():
+    '''
+    Args:
+    - url (str): the server, like http://127.0.0.1:8000
+    '''
+    def __init__(self, url, timeout=60) -> None:
+        self.url = url.rstrip("/")
+        self.timeout = timeout
+
+    def _call(self, path, payload=None):
+        data = None if payload is None else json.dumps(payload).encode("utf-8")
+        request = urllib.request.Request(self.url + path, data=data, headers={"Content-Type": "application/json"})
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            return json.loads(response.read())
+
+    def predict(self, input, stream=None):
+        return self._call("/predict", {"npy": encode_input(input), "stream": stream})
+
+    def close_stream(self, stream):
+        return self._call("/streams/close", {"stream": stream})["closed"]
+
+    def stats(self):
+        return self._call("/stats")
+
+
+if __name__ == "__main__":
+    # python inference/server.py base.json --checkpoint check_point/exp0/exp0_epoch_10.pth --port 8000
+    parser = config_arg_parser("serve one checkpoint of the encoder over http with dynamic batching")
+    parser.add_argument("--checkpoint", default=None, help="the checkpoint to serve, the last one of train.name by default")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--max-batch", type=int, default=8)
+    parser.add_argument("--max-latency-ms", type=float, default=10.0, help="how long a request waits for others to batch with")
+    parser.add_argument("--store-mb", type=float, default=None, help="the RAM of the stream memory, train.memory_store_mb by default")
+    parser.add_argument("--spill-path", default=None, help="the file the stream memory beyond --store-mb is spilled to")
+    args = parser.parse_args()
+    config = get_config(args)
+    spec = compile_config(config)
+    engine = InferenceEngine(spec, args.checkpoint or checkpoint_path(spec.train.name, 10), store_mb=args.store_mb,
+                             spill_path=args.spill_path)
+    batcher = DynamicBatcher(engine, args.max_batch, args.max_latency_ms)
+    server = make_server(batcher, args.host, args.port)
+    print(f"serving {spec.model.model.value} on http://{args.host}:{args.port}, batches of up to {batcher.max_batch} "
+          f"within {args.max_latency_ms}ms, per stream memory {'on' if engine.load_memory_tokens else 'off'}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    server.server_close()
+    batcher.close()
+    print(json.dumps(batcher.report(), indent=4))
+    engine.streams.close()
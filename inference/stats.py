@@ -0,0 +1,51 @@
+import time
+import threading
+from collections import Counter, deque
+import numpy as np
+
+class ServingStats():
+    '''
+    Latency, batch size and queue depth of the served requests.
+    Args:
+    - window (int): the latest requests / batches the percentiles and means are taken over.
+    '''
+    def __init__(self, window=10000) -> None:
+        self.lock = threading.Lock()
+        self.latencies = deque(maxlen=window)# ms from submit to result
+        self.waits = deque(maxlen=window)# ms in the queue before the batch started
+        self.queue_depths = deque(maxlen=window)# requests queued when a batch is taken
+        self.batch_sizes = Counter()
+        self.requests = 0
+        self.errors = 0
+        self.start = time.time()
+
+    def record_batch(self, size, queue_depth, latencies, waits, failed=False):
+        with self.lock:
+            self.batch_sizes[size] += 1
+            self.queue_depths.append(queue_depth)
+            self.latencies.extend(latencies)
+            self.waits.extend(waits)
+            self.requests += size
+            if failed:
+                self.errors += size
+
+    def report(self):
+        '''
+        return: {"requests", "errors", "throughput", "latency_ms", "queue_wait_ms", "queue_depth", "batch_sizes", "mean_batch"}
+        '''
+        with self.lock:
+            latencies = np.array(self.latencies)
+            waits = np.array(self.waits)
+            depths = np.array(self.queue_depths)
+            batch_sizes = dict(sorted(self.batch_sizes.items()))
+            requests, errors = self.requests, self.errors
+        def percentiles(values):
+            if values.size == 0:
+                return {"p50": None, "p99": None, "mean": None, "max": None}
+            return {"p50": float(np.percentile(values, 50)), "p99": float(np.percentile(values, 99)),
+                    "mean": float(values.mean()), "max": float(values.max())}
+        batches = sum(batch_sizes.values())
+        return {"requests": requests, "errors": errors, "throughput": requests / max(time.time() - self.start, 1e-9),
+                "latency_ms": percentiles(latencies), "queue_wait_ms": percentiles(waits),
+                "queue_depth": {"mean": float(depths.mean()) if depths.size else 0.0, "max": int(depths.max()) if depths.size else 0},
+                "batch_sizes": batch_sizes, "mean_batch": requests / batches if batches else 0.0}
@@ -3,24 +3,33 @@ import torch.nn as nn
 from einops import rearrange, reduce, repeat
 from einops.layers.torch import Rearrange
 import torch.nn.init as init
-from .TokenLearner import TokenLearnerModule, TokenLearnerModuleV11
+from .TokenLearner import TokenLearnerModule, TokenLearnerModuleV11, TokenLearnerModuleV12
+from .TemporalSampler import TemporalSampler
 from config.configure import Config
+from config.spec import compile_config, PreprocessMode, ProcessUnit, MemoryMode, NoiseMode, PatchEmbed, TemporalSampling, RESNET18_CHANNELS
+from utils.profiling import stage
 import numpy as np
 import torchvision.models as models
 
 class PreProcess3D(nn.Module): 
     # Input：Batch, Channels, Step, H, W  
     # Output：Batch, Step, Tokens, Channels
-    def __init__(self,config) -> None:
+    def __init__(self,spec) -> None:
         super(PreProcess3D, self).__init__()
-        self.conv = nn.Conv3d(in_channels=config["model"]["in_channels"], 
-                             out_channels=config["model"]["dim"],
-                             kernel_size=config["model"]["patch_size"], 
-                             stride=config["model"]["patch_size"], 
+        self.conv = nn.Conv3d(in_channels=spec.model.in_channels, 
+                             out_channels=spec.model.dim,
+                             kernel_size=spec.model.patch_size, 
+                             stride=spec.model.patch_size, 
                              padding="valid")
         self.relu = nn.ReLU()
+        self.patch_size = spec.model.patch_size
+        self.embed = {PatchEmbed.MATMUL: self.forward_matmul,
+                      PatchEmbed.CONV3D: self.forward_conv}[spec.model.patch_embed]
 
     def forward(self, input):
+        return self.embed(input)
+
+    def forward_conv(self, input):
 
         # input = input.transpose(1, 2)
 
@@ -29,25 +38,38 @@ class PreProcess3D(nn.Module):
         x = x.flatten(3)
         x = x.permute(0, 2, 3, 1)
         return x
+
+    def forward_matmul(self, input):
+        # the kernel equals the stride, so the conv is one matmul of the non-overlapping patches with
+        # the conv weight: the patches are a view of the input, one copy lines them up for the matmul
+        # and the output comes out as [B, T, tokens, dim] without the flatten / permute of the conv path
+        p = self.patch_size
+        b, c, steps, h, w = input.shape
+        t, h, w = steps // p, h // p, w // p
+        x = input[:, :, :t * p, :h * p, :w * p].view(b, c, t, p, h, p, w, p)
+        x = x.permute(0, 2, 4, 6, 1, 3, 5, 7).reshape(b * t * h * w, c * p ** 3)
+        x = torch.addmm(self.conv.bias, x, self.conv.weight.view(self.conv.out_channels, -1).t())
+        x = torch.relu_(x)# the matmul output is a fresh 2-D tensor, relu needs no second output sized buffer
+        return x.view(b, t, h * w, -1)
     
 class PreProcess3DWithBN(nn.Module): 
     # Input：Batch, Channels, Step, H, W  
     # Output：Batch, Step, Tokens, Channels
-    def __init__(self,config) -> None:
+    def __init__(self,spec) -> None:
         super(PreProcess3DWithBN, self).__init__()
-        self.conv = nn.Conv3d(in_channels=config["model"]["in_channels"], 
+        self.conv = nn.Conv3d(in_channels=spec.model.in_channels, 
                              out_channels=64,
-                             kernel_size=config["model"]["patch_size"], 
-                             stride=config["model"]["patch_size"], 
+                             kernel_size=spec.model.patch_size, 
+                             stride=spec.model.patch_size, 
                              padding="valid")
         self.relu = nn.ReLU()
         self.bn1 = nn.BatchNorm3d(64)
         self.conv2 = nn.Conv3d(in_channels=64, 
-                             out_channels=config["model"]["dim"],
+                             out_channels=spec.model.dim,
                              kernel_size=3, 
                              stride=1, 
                              padding="same")
-        self.bn2 = nn.BatchNorm3d(config["model"]["dim"])
+        self.bn2 = nn.BatchNorm3d(spec.model.dim)
 
     def forward(self, input):
         # input = input.transpose(1, 2)
@@ -66,7 +88,7 @@ class PreProcessResnet18(nn.Module):
 
     def __init__(self):
         super(PreProcessResnet18, self).__init__()
-        self.resnet = models.resnet18(pretrained=False).cuda()
+        self.resnet = models.resnet18(pretrained=False)
         self.resnet.fc = nn.Identity()
         # for param in self.resnet.parameters():
         #     param.requires_grad = False
@@ -87,43 +109,43 @@ class PreProcessResnet18(nn.Module):
         return x
 
 class TokenLearnerMHA(nn.Module):
-    def __init__(self, output_tokens,config) -> None:
+    def __init__(self, output_tokens,spec) -> None:
         super(TokenLearnerMHA, self).__init__()
-        self.query = nn.Parameter(torch.randn(config["batch_size"], output_tokens, config["model"]["dim"]).cuda())
-        self.attn = nn.MultiheadAttention(embed_dim=config["model"]["dim"], num_heads=8, dropout=config["model"]["drop_r"], batch_first=True)
+        self.query = nn.Parameter(torch.randn(spec.batch_size, output_tokens, spec.model.dim))
+        self.batch_rows = slice(None)# the rows of the query used by the current (micro) batch
+        self.attn = nn.MultiheadAttention(embed_dim=spec.model.dim, num_heads=8, dropout=spec.model.drop_r, batch_first=True)
 
 
     def forward(self, input):
         # [0]is output,[1]is weight
-        return self.attn(self.query, input, input)[0]
+        return self.attn(self.query[self.batch_rows], input, input)[0]
 
 class TokenAddEraseWrite(nn.Module):
-    def __init__(self,config) -> None:
+    def __init__(self,spec) -> None:
         super(TokenAddEraseWrite, self).__init__()
 
-        self.mlp_block1 = nn.Sequential(nn.LayerNorm(config["model"]["dim"]), 
-                                           nn.Linear(config["model"]["dim"], 3*config["model"]["dim"]), 
-                                           nn.Linear(3*config["model"]["dim"], config["model"]["summerize_num_tokens"]), 
+        self.mlp_block1 = nn.Sequential(nn.LayerNorm(spec.model.dim), 
+                                           nn.Linear(spec.model.dim, 3*spec.model.dim), 
+                                           nn.Linear(3*spec.model.dim, spec.model.summerize_num_tokens), 
                                            nn.GELU())
-        self.laynorm = nn.LayerNorm(config["model"]["dim"])
-        self.mlp_block2 = nn.Sequential(nn.Linear(config["model"]["summerize_num_tokens"], 3*config["model"]["dim"]), 
-                                           nn.Linear(3*config["model"]["dim"], config["model"]["summerize_num_tokens"]), 
+        self.laynorm = nn.LayerNorm(spec.model.dim)
+        self.mlp_block2 = nn.Sequential(nn.Linear(spec.model.summerize_num_tokens, 3*spec.model.dim), 
+                                           nn.Linear(3*spec.model.dim, spec.model.summerize_num_tokens), 
                                            nn.GELU())
-        self.mlp_block3 = nn.Sequential(nn.Linear(config["model"]["dim"], 3*config["model"]["dim"]), 
-                                            nn.Linear(3*config["model"]["dim"], config["model"]["dim"]), 
+        self.mlp_block3 = nn.Sequential(nn.Linear(spec.model.dim, 3*spec.model.dim), 
+                                            nn.Linear(3*spec.model.dim, spec.model.dim), 
                                             nn.GELU())
-        self.mlp_block4 = nn.Sequential(nn.Linear(config["model"]["summerize_num_tokens"], 3*config["model"]["dim"]), 
-                                           nn.Linear(3*config["model"]["dim"], config["model"]["summerize_num_tokens"]), 
+        self.mlp_block4 = nn.Sequential(nn.Linear(spec.model.summerize_num_tokens, 3*spec.model.dim), 
+                                           nn.Linear(3*spec.model.dim, spec.model.summerize_num_tokens), 
                                            nn.GELU())
-        self.mlp_block5 = nn.Sequential(nn.Linear(config["model"]["dim"], 3*config["model"]["dim"]), 
-                                            nn.Linear(3*config["model"]["dim"], config["model"]["dim"]), 
+        self.mlp_block5 = nn.Sequential(nn.Linear(spec.model.dim, 3*spec.model.dim), 
+                                            nn.Linear(3*spec.model.dim, spec.model.dim), 
                                             nn.GELU())
         self.query = nn.Parameter(torch.randn(
-            config["batch_size"], config["model"]["memory_tokens_size"], config["model"]["dim"]).cuda())
+            spec.batch_size, spec.model.memory_tokens_size, spec.model.dim))
         self.trans_outdim = nn.MultiheadAttention(
-            embed_dim=config["model"]["dim"], num_heads=8, dropout=config["model"]["drop_r"], batch_first=True)
-        AddEraseWrite_input = config["model"]["memory_tokens_size"]+config["model"]["summerize_num_tokens"]+ int((config["train"]["input_H"]-config["model"]["patch_size"])/config["model"]["patch_size"]+1) * int((config["train"]["input_W"]-config["model"]["patch_size"])/config["model"]["patch_size"]+1)
-        self.fn = nn.Linear(AddEraseWrite_input, config["model"]["memory_tokens_size"])
+            embed_dim=spec.model.dim, num_heads=8, dropout=spec.model.drop_r, batch_first=True)
+        self.fn = nn.Linear(spec.model.add_erase_input, spec.model.memory_tokens_size)
         self.relu = nn.ReLU()
 
         self.softmax = nn.Softmax(dim = -1)
@@ -139,7 +161,7 @@ class TokenAddEraseWrite(nn.Module):
         et = et.transpose(1, 2)
         et = self.mlp_block3(et)
 
-        wet = selected.unsqueeze(-1).cuda() * et.unsqueeze(2).cuda()
+        wet = selected.unsqueeze(-1) * et.unsqueeze(2)
         wet = 1 - wet
         wet = torch.prod(wet, dim=1)
 
@@ -151,7 +173,7 @@ class TokenAddEraseWrite(nn.Module):
         at = at.transpose(1,2)
         at = self.mlp_block5(at)
 
-        wat = selected.unsqueeze(-1).cuda() * at.unsqueeze(2).cuda()
+        wat = selected.unsqueeze(-1) * at.unsqueeze(2)
         wat = 1 - wat
         wat = torch.mean(wat, dim=1)
 
@@ -169,115 +191,139 @@ class TokenAddEraseWrite(nn.Module):
 
 
 class TokenTuringMachineUnit(nn.Module):
-    def __init__(self,config) -> None:
+    def __init__(self,spec) -> None:
         super(TokenTuringMachineUnit, self).__init__()
 
-        self.tokenLearner1 = TokenLearnerModule(in_channels=config["model"]["dim"], summerize_num_tokens=config["model"]["summerize_num_tokens"], num_groups=1, dropout_rate=config["model"]["drop_r"])
-        self.tokenLearner2 = TokenLearnerModule(in_channels=config["model"]["dim"], summerize_num_tokens=config["model"]["memory_tokens_size"], num_groups=1, dropout_rate=config["model"]["drop_r"])
-        self.tokenLearnerV11_1 = TokenLearnerModuleV11(in_channels=config["model"]["dim"], summerize_num_tokens=config["model"]["summerize_num_tokens"], num_groups=1, dropout_rate=config["model"]["drop_r"])
-        self.tokenLearnerV11_2 = TokenLearnerModuleV11(in_channels=config["model"]["dim"], summerize_num_tokens=config["model"]["memory_tokens_size"], num_groups=1, dropout_rate=config["model"]["drop_r"])
-        self.transformerBlock = nn.TransformerEncoderLayer(d_model=config["model"]["dim"], nhead=8, dim_feedforward=config["model"]["dim"] * 3, dropout=config["model"]["drop_r"])
-        self.tokenLearnerMHA1 = TokenLearnerMHA(config["model"]["summerize_num_tokens"],config)
-        self.tokenLearnerMHA2 = TokenLearnerMHA(config["model"]["memory_tokens_size"],config)
-        self.tokenAddEraseWrite = TokenAddEraseWrite(config)
-        self.mlpBlock = nn.Sequential(nn.LayerNorm(config["model"]["dim"]),
-                                 nn.Linear(config["model"]["dim"], config["model"]["dim"]*3),
-                                 nn.Dropout(config["model"]["drop_r"]),
+        self.tokenLearner1 = TokenLearnerModule(in_channels=spec.model.dim, summerize_num_tokens=spec.model.summerize_num_tokens, num_groups=1, dropout_rate=spec.model.drop_r)
+        self.tokenLearner2 = TokenLearnerModule(in_channels=spec.model.dim, summerize_num_tokens=spec.model.memory_tokens_size, num_groups=1, dropout_rate=spec.model.drop_r)
+        self.tokenLearnerV11_1 = TokenLearnerModuleV11(in_channels=spec.model.dim, summerize_num_tokens=spec.model.summerize_num_tokens, num_groups=1, dropout_rate=spec.model.drop_r)
+        self.tokenLearnerV11_2 = TokenLearnerModuleV11(in_channels=spec.model.dim, summerize_num_tokens=spec.model.memory_tokens_size, num_groups=1, dropout_rate=spec.model.drop_r)
+        # batch_first=False is the original layout, which attends over the batch axis
+        self.transformerBlock = nn.TransformerEncoderLayer(d_model=spec.model.dim, nhead=8, dim_feedforward=spec.model.dim * 3, dropout=spec.model.drop_r, batch_first=spec.model.transformer_batch_first)
+        self.tokenLearnerMHA1 = TokenLearnerMHA(spec.model.summerize_num_tokens,spec)
+        self.tokenLearnerMHA2 = TokenLearnerMHA(spec.model.memory_tokens_size,spec)
+        self.tokenAddEraseWrite = TokenAddEraseWrite(spec)
+        self.mlpBlock = nn.Sequential(nn.LayerNorm(spec.model.dim),
+                                 nn.Linear(spec.model.dim, spec.model.dim*3),
+                                 nn.Dropout(spec.model.drop_r),
 
                                  nn.GELU(),
-                                 nn.Linear(config["model"]["dim"]*3, config["model"]["dim"]),
+                                 nn.Linear(spec.model.dim*3, spec.model.dim),
                                  nn.GELU(),
 
-                                 nn.Dropout(config["model"]["drop_r"]))
+                                 nn.Dropout(spec.model.drop_r))
 
         self.num_layers = 3
-        self.norm = nn.LayerNorm(config["model"]["dim"])
-        self.mixer_sequence_block = nn.Sequential(nn.Linear(config["model"]["summerize_num_tokens"], config["model"]["summerize_num_tokens"] * 6),
+        self.norm = nn.LayerNorm(spec.model.dim)
+        self.mixer_sequence_block = nn.Sequential(nn.Linear(spec.model.summerize_num_tokens, spec.model.summerize_num_tokens * 6),
                                                   nn.GELU(),
-                                                  nn.Dropout(config["model"]["drop_r"]),
-                                                  nn.Linear(config["model"]["summerize_num_tokens"] * 6, config["model"]["summerize_num_tokens"]),
+                                                  nn.Dropout(spec.model.drop_r),
+                                                  nn.Linear(spec.model.summerize_num_tokens * 6, spec.model.summerize_num_tokens),
                                                   nn.GELU())
-        self.mixer_channels__block = nn.Sequential(nn.Linear(config["model"]["dim"], config["model"]["dim"] * 3),
+        self.mixer_channels__block = nn.Sequential(nn.Linear(spec.model.dim, spec.model.dim * 3),
                                                    nn.GELU(),
-                                                   nn.Dropout(config["model"]["drop_r"]),
-                                                   nn.Linear(config["model"]["dim"] * 3, config["model"]["dim"]),
+                                                   nn.Dropout(spec.model.drop_r),
+                                                   nn.Linear(spec.model.dim * 3, spec.model.dim),
                                                    nn.GELU())
-        self.dropout = nn.Dropout(config["model"]["drop_r"])
-        self.config = config
-
-    def forward(self, memory_tokens, input_tokens):
-        all_tokens = torch.cat((memory_tokens, input_tokens), dim=1)
-        # Read add posiutional
-        if self.config["model"]["Read_use_positional_embedding"]:
-            all_tokens = all_tokens.cuda()
-            posemb_init = torch.nn.Parameter(torch.empty(
-                1, all_tokens.size(1), all_tokens.size(2))).cuda()
-            init.normal_(posemb_init, std=0.02)
-            all_tokens = all_tokens + posemb_init
-
-
-        if self.config["model"]["memory_mode"] == 'TL' or self.config["model"]["memory_mode"] == 'TL-AddErase':
-            all_tokens=self.tokenLearner1(all_tokens)
-        elif self.config["model"]["memory_mode"] == 'TL-MHA':
-            all_tokens=self.tokenLearnerMHA1(all_tokens)
-
-        if self.config["model"]["process_unit"] == 'transformer':
-
-            output_tokens = all_tokens
-            for _ in range(self.num_layers):
-                output_tokens = self.transformerBlock(output_tokens)
-
-
-        elif self.config["model"]["process_unit"] == 'mixer':
-            output_tokens = all_tokens # all_tokens shape is [batch,mem_size+special_num_token,config["model"]["dim"]]
+        self.dropout = nn.Dropout(spec.model.drop_r)
+        if spec.model.memory_mode == MemoryMode.TL_V12:
+            # built for this mode only, the other modes keep their parameters and initialisation
+            self.tokenLearnerV12 = TokenLearnerModuleV12(in_tokens=spec.model.memory_tokens_size, summerize_num_tokens=spec.model.summerize_num_tokens, num_groups=1, dropout_rate=spec.model.drop_r, dim=spec.model.dim)
+        self.spec = spec
+        # pick the code paths once, forward never looks at the configure
+        self.read_use_positional_embedding = spec.model.read_use_positional_embedding
+        self.write_use_positional_embedding = spec.model.write_use_positional_embedding
+        self.summerize = {MemoryMode.TL: self.tokenLearner1.forward,
+                          MemoryMode.TL_ADD_ERASE: self.tokenLearner1.forward,
+                          MemoryMode.TL_MHA: self.tokenLearnerMHA1.forward,
+                          MemoryMode.TL_V12: self.summerize_memory_driven}[spec.model.memory_mode]
+        self.process = {ProcessUnit.TRANSFORMER: self.process_transformer,
+                        ProcessUnit.MIXER: self.process_mixer,
+                        ProcessUnit.MLP: self.process_mlp}[spec.model.process_unit]
+        self.write = {MemoryMode.TL: self.write_tl,
+                      MemoryMode.TL_V12: self.write_tl,
+                      MemoryMode.TL_MHA: self.write_mha,
+                      MemoryMode.TL_ADD_ERASE: self.write_add_erase}[spec.model.memory_mode]
+
+    def positional_embedding(self, tokens):
+        # a fresh N(0, 0.02) embedding on every call, as before
+        return torch.empty(1, tokens.size(1), tokens.size(2), device=tokens.device).normal_(std=0.02)
+
+    def summerize_memory_driven(self, all_tokens):
+        # TL-V12: the queries are learned from the memory tokens along the token axis (TokenLearnerModuleV12)
+        # and only attend over the input tokens, so an input token costs 4*summerize_num_tokens*dim FLOPs
+        # instead of the ~4*dim*dim of the TokenLearner
+        memory_tokens = all_tokens[:, :self.tokenLearnerV12.in_tokens]
+        input_tokens = all_tokens[:, self.tokenLearnerV12.in_tokens:]
+        queries = self.tokenLearnerV12(memory_tokens)
+        weights = torch.softmax(torch.einsum("bsd,bnd->bsn", queries, input_tokens) / input_tokens.size(-1) ** 0.5, dim=-1)
+        return queries + torch.einsum("bsn,bnd->bsd", weights, input_tokens)
+
+    def process_transformer(self, all_tokens):
+        output_tokens = all_tokens
+        for _ in range(self.num_layers):
+            output_tokens = self.transformerBlock(output_tokens)
+        return output_tokens
+
+    def process_mixer(self, all_tokens):
+        output_tokens = all_tokens # all_tokens shape is [batch,mem_size+special_num_token,spec.model.dim]
+
+        for _ in range(self.num_layers):
+            # Token mixing,different token interoperability
+            x_output_tokens = output_tokens
+            x_output_tokens = self.norm(x_output_tokens)
+
+            x_output_tokens = x_output_tokens.permute(0, 2, 1) 
+            x_output_tokens = self.mixer_sequence_block(x_output_tokens)
+            x_output_tokens = x_output_tokens.permute(0, 2, 1)
+            x_output_tokens = x_output_tokens + output_tokens
+            x_output_tokens = self.dropout(x_output_tokens)
+
+            # Channel mixing,internal token interoperability
+
+            y_output_tokens = self.norm(x_output_tokens)
+            y_output_tokens = self.mixer_channels__block(y_output_tokens)
+            y_output_tokens = self.dropout(y_output_tokens)
+            output_tokens = output_tokens + y_output_tokens
+        return self.norm(output_tokens)
+
+    def process_mlp(self, all_tokens):
+        output_tokens = all_tokens
+        for _ in range(self.num_layers):
+            output_tokens = self.norm(output_tokens)
+            output_tokens = self.mlpBlock(output_tokens)
+        return self.norm(output_tokens)
 
-            for _ in range(self.num_layers):
-                # Token mixing,different token interoperability
-                x_output_tokens = output_tokens
-                x_output_tokens = self.norm(x_output_tokens)
+    def write_tl(self, memory_input_tokens, output_tokens):
+        return self.tokenLearner2(memory_input_tokens)
 
-                x_output_tokens = x_output_tokens.permute(0, 2, 1) 
-                x_output_tokens = self.mixer_sequence_block(x_output_tokens)
-                x_output_tokens = x_output_tokens.permute(0, 2, 1)
-                x_output_tokens = x_output_tokens + output_tokens
-                x_output_tokens = self.dropout(x_output_tokens)
+    def write_mha(self, memory_input_tokens, output_tokens):
+        return self.tokenLearnerMHA2(memory_input_tokens)
 
-                # Channel mixing,internal token interoperability
+    def write_add_erase(self, memory_input_tokens, output_tokens):
+        return self.tokenAddEraseWrite(memory_input_tokens,output_tokens)
 
-                y_output_tokens = self.norm(x_output_tokens)
-                y_output_tokens = self.mixer_channels__block(y_output_tokens)
-                y_output_tokens = self.dropout(y_output_tokens)
-                output_tokens = output_tokens + y_output_tokens
-            output_tokens = self.norm(output_tokens)
-        
-
-        elif self.config["model"]["process_unit"] == 'mlp':
-
-            output_tokens = all_tokens
-            for _ in range(self.num_layers):
-                output_tokens = self.norm(output_tokens)
-                output_tokens = self.mlpBlock(output_tokens)
-            output_tokens = self.norm(output_tokens)
+    def forward(self, memory_tokens, input_tokens):
+        with stage("read"):
+            all_tokens = torch.cat((memory_tokens, input_tokens), dim=1)
+            # Read add posiutional
+            if self.read_use_positional_embedding:
+                all_tokens = all_tokens + self.positional_embedding(all_tokens)
 
-        memory_input_tokens = torch.cat((memory_tokens, input_tokens, output_tokens), dim=1)
+            all_tokens = self.summerize(all_tokens)
 
-        # Write add posiutional
-        if self.config["model"]["Write_use_positional_embedding"]:
-            memory_input_tokens = memory_input_tokens.cuda()
-            posemb_init = torch.nn.Parameter(torch.empty(
-                1, memory_input_tokens.size(1), memory_input_tokens.size(2))).cuda()
-            init.normal_(posemb_init, std=0.02)
-            # mem_out_tokens shape is [batch,mem_size+special_num_token,config["model"]["dim"]]
-            memory_input_tokens = memory_input_tokens + posemb_init
+        with stage("process"):
+            output_tokens = self.process(all_tokens)
 
+        with stage("write"):
+            memory_input_tokens = torch.cat((memory_tokens, input_tokens, output_tokens), dim=1)
 
-        if self.config["model"]["memory_mode"] == 'TL':
-            memory_output_tokens = self.tokenLearner2(memory_input_tokens)
-        elif self.config["model"]["memory_mode"] == 'TL-MHA':
-            memory_output_tokens = self.tokenLearnerMHA2(memory_input_tokens)
-        elif self.config["model"]["memory_mode"] == 'TL-AddErase':
+            # Write add posiutional
+            if self.write_use_positional_embedding:
+                # mem_out_tokens shape is [batch,mem_size+special_num_token,spec.model.dim]
+                memory_input_tokens = memory_input_tokens + self.positional_embedding(memory_input_tokens)
 
-            memory_output_tokens = self.tokenAddEraseWrite(memory_input_tokens,output_tokens)
+            memory_output_tokens = self.write(memory_input_tokens, output_tokens)
         
         return (memory_output_tokens,output_tokens)
 
@@ -285,91 +331,142 @@ class TokenTuringMachineUnit(nn.Module):
 class TokenTuringMachineEncoder(nn.Module):
     def __init__(self,config) -> None:
         super(TokenTuringMachineEncoder, self).__init__()
-
-        self.memory_tokens = torch.zeros(config["batch_size"], config["model"]["memory_tokens_size"], config["model"]["dim"]).cuda()
-        self.tokenTuringMachineUnit = TokenTuringMachineUnit(config)
-        self.cls = nn.Linear(config["model"]["dim"], config["model"]["out_class_num"])
-        self.pre1 = PreProcess3D(config)
+        spec = compile_config(config)
+        self.tokenTuringMachineUnit = TokenTuringMachineUnit(spec)
+        self.cls = nn.Linear(spec.model.dim, spec.model.out_class_num)
+        self.pre1 = PreProcess3D(spec)
         self.pre2 = PreProcessResnet18()
         self.relu = nn.ReLU()
-        self.pre_dim =nn.Linear(128, config["model"]["dim"])
-        self.config = config
+        self.pre_dim =nn.Linear(RESNET18_CHANNELS, spec.model.dim)
+        self.spec = spec
+        self.memory_tokens_size = spec.model.memory_tokens_size
+        # 3dBN is rejected for ttm by compile_config, pre2 is the resnet18 front-end here
+        self.preprocess = {PreprocessMode.CONV3D: self.pre1.forward,
+                           PreprocessMode.RESNET18: self.preprocess_resnet18,
+                           PreprocessMode.RESNET18_CACHED: self.pre_dim.forward}[spec.model.preprocess_mode]
+        self.sample = None if spec.model.temporal_sampling == TemporalSampling.ALL else TemporalSampler(spec)
+        self.add_noise = {NoiseMode.NONE: None,
+                          NoiseMode.NORMAL: self.noise_normal,
+                          NoiseMode.LAPLACE: self.noise_laplace,
+                          NoiseMode.UNIFORM: self.noise_uniform,
+                          NoiseMode.EXP: self.noise_exp,
+                          NoiseMode.GAMMA: self.noise_gamma,
+                          NoiseMode.POISSON: self.noise_poisson}[spec.model.noise_mode]
+
+    def preprocess_resnet18(self, input):
+        return self.pre_dim(self.pre2(input))
+
+    def noise_normal(self, memory_tokens):
+        noise = torch.randn_like(memory_tokens)
+        noise_rate = 0.2
+        return memory_tokens + noise_rate * noise
+
+    def noise_laplace(self, memory_tokens):
+        noise = torch.distributions.laplace.Laplace(loc = 10, scale = 10).sample(memory_tokens.size())
+        noise = noise.to(memory_tokens.device)
+        noise_rate = 0.2
+        return memory_tokens + noise*noise_rate
+
+    def noise_uniform(self, memory_tokens):
+        noise = torch.FloatTensor(memory_tokens.size()).uniform_(-0.5, 0.5)
+        noise = noise.to(memory_tokens.device)
+        noise_rate = 0.2
+        return memory_tokens + noise*noise_rate
+
+    def noise_exp(self, memory_tokens):
+        noise = torch.empty(memory_tokens.size()).exponential_()
+        noise = noise.to(memory_tokens.device)
+        noise_rate = 0.2
+        return memory_tokens + noise*noise_rate
+
+    def noise_gamma(self, memory_tokens):
+        shape = torch.tensor([2.0])  # Shape parameters of the Gamma distribution
+        scale = torch.tensor([2.0])  # Scale parameters of the Gamma distribution
+        noise = torch.empty(memory_tokens.size(), device=memory_tokens.device)  # Create the same empty tensor as the noise tensor
+        noise.copy_(torch.from_numpy(np.random.gamma(shape.item(), scale.item(), size=noise.size())))  # 将正态分布随机数转化为Gamma分布随机数
+        noise_rate = 0.2
+        return memory_tokens + noise*noise_rate
+
+    def noise_poisson(self, memory_tokens):
+        rate = torch.tensor([2.0])  # Parameters of the Poisson distribution
+        noise = torch.poisson(rate.expand(memory_tokens.size()))  # Generating Poisson distributed noise
+        noise = noise.float()
+        noise = noise.to(memory_tokens.device)
+        noise_rate = 0.2
+        return memory_tokens + noise * noise_rate
 
     def forward(self, input, memory_tokens):
-        if self.config["model"]["preprocess_mode"] == "3d":
-            input = self.pre1(input)
-        elif self.config["model"]["preprocess_mode"] == "3dBN":
-            input = self.pre2(input)
-        elif self.config["model"]["preprocess_mode"] == "resnet18":
-            input = self.pre3(input)
-            input = self.pre_dim(input)
+        with stage("preprocess"):
+            input = self.preprocess(input)
+        if self.sample is not None:
+            with stage("sample"):
+                input = self.sample(input)
         b, t, _, c = input.shape
 
         outs=[]
-        if memory_tokens == None:
-            memory_tokens = torch.zeros(b,self.config["model"]["memory_tokens_size"],c).cuda() #  c, h, w
+        if memory_tokens is None:
+            memory_tokens = torch.zeros(b,self.memory_tokens_size,c, device=input.device) #  c, h, w
             # np.random.seed(3407)
-            # random_tokens = torch.rand(b, self.config["model"]["memory_tokens_size"], c).cuda()
+            # random_tokens = torch.rand(b, self.memory_tokens_size, c).cuda()
             # memory_tokens = torch.exp(random_tokens)
         else:
             memory_tokens = memory_tokens.detach()
         for i in range(t):
-            memory_tokens, out = self.tokenTuringMachineUnit(memory_tokens, input[:,i,:,:])
+            with stage("memory_unit"):
+                memory_tokens, out = self.tokenTuringMachineUnit(memory_tokens, input[:,i,:,:])
             outs.append(out)
     
-        outs = torch.stack(outs, dim=1)
-        out = outs.view(self.config["batch_size"], -1, self.config["model"]["dim"])
-        out = out.transpose(1, 2)
-        out = nn.AdaptiveAvgPool1d(1)(out) 
-        out = out.squeeze(2)
-
-
-        if self.config["model"]["load_memory_add_noise"]:
-            np.random.seed(3407)
-            if self.config["model"]["load_memory_add_noise_mode"] == "normal":
-                noise = torch.randn_like(memory_tokens)
-                noise = noise.cuda()
-                noise_rate = 0.2
-                memory_tokens = memory_tokens + noise_rate * noise
-            elif self.config["model"]["load_memory_add_noise_mode"] == "laplace":
-                noise = torch.distributions.laplace.Laplace(loc = 10, scale = 10).sample(memory_tokens.size())
-                noise = noise.cuda()
-                noise_rate = 0.2
-                memory_tokens = memory_tokens + noise*noise_rate
-            elif self.config["model"]["load_memory_add_noise_mode"] == "uniform":
-                noise = torch.FloatTensor(memory_tokens.size()).uniform_(-0.5, 0.5)
-                noise = noise.cuda()
-                noise_rate = 0.2
-                memory_tokens = memory_tokens + noise*noise_rate
-            elif self.config["model"]["load_memory_add_noise_mode"] == "exp":
-                noise = torch.empty(memory_tokens.size()).exponential_()
-                noise = noise.cuda()
-                noise_rate = 0.2
-                memory_tokens = memory_tokens + noise*noise_rate
-                # 在训练循环之外生成噪声张量
-
-            elif self.config["model"]["load_memory_add_noise_mode"] == "gamma":
-                shape = torch.tensor([2.0])  # Shape parameters of the Gamma distribution
-                scale = torch.tensor([2.0])  # Scale parameters of the Gamma distribution
-                noise = torch.empty(memory_tokens.size())  # Create the same empty tensor as the noise tensor
-                noise = noise.cuda()
-                noise.copy_(torch.from_numpy(np.random.gamma(shape.item(), scale.item(), size=noise.size())))  # 将正态分布随机数转化为Gamma分布随机数
-                noise_rate = 0.2
-                memory_tokens = memory_tokens + noise*noise_rate
-            elif self.config["model"]["load_memory_add_noise_mode"] == "poisson":
-                rate = torch.tensor([2.0])  # Parameters of the Poisson distribution
-                noise = torch.poisson(rate.expand(memory_tokens.size()))  # Generating Poisson distributed noise
-                noise = noise.float()
-                noise = noise.cuda()
-                noise_rate = 0.2
-                memory_tokens = memory_tokens + noise * noise_rate
-
-
-        return self.cls(out), memory_tokens
+        with stage("head"):
+            outs = torch.stack(outs, dim=1)
+            out = outs.view(b, -1, c)
+            out = out.transpose(1, 2)
+            out = nn.AdaptiveAvgPool1d(1)(out) 
+            out = out.squeeze(2)
+            out = self.cls(out)
+
+        if self.add_noise is not None:
+            with stage("noise"):
+                np.random.seed(3407)
+                memory_tokens = self.add_noise(memory_tokens)
+
+        return out, memory_tokens
+
+    def forward_early_exit(self, input, memory_tokens, exit):
+        '''
+        forward that stops the steps once every row of the batch is confident, see utils/early_exit.py
+        exit: an EarlyExit, exit.steps holds the steps used by each row afterwards
+        return: (the logits of each row at its exit step, the memory_tokens of the last step run)
+        '''
+        with stage("preprocess"):
+            input = self.preprocess(input)
+        if self.sample is not None:
+            with stage("sample"):
+                input = self.sample(input)
+        b, t, _, c = input.shape
+        if memory_tokens is None:
+            memory_tokens = torch.zeros(b,self.memory_tokens_size,c, device=input.device)
+        else:
+            memory_tokens = memory_tokens.detach()
+        exit.start(b, input.device)
+        pooled = 0
+        for i in range(t):
+            with stage("memory_unit"):
+                memory_tokens, out = self.tokenTuringMachineUnit(memory_tokens, input[:,i,:,:])
+            with stage("head"):
+                pooled = pooled + out.mean(dim=1)# the pool of the head over the first i + 1 steps
+                if exit.update(self.cls(pooled / (i + 1))):
+                    break
+
+        if self.add_noise is not None:
+            with stage("noise"):
+                np.random.seed(3407)
+                memory_tokens = self.add_noise(memory_tokens)
+
+        return exit.logits, memory_tokens
     
 
 # if __name__ == "__main__":
-#     inputs = torch.randn(config["batch_size"], config["model"]["step"], 1, 28, 28).cuda() # [bs, config["model"]["step"], c, h, w]
+#     inputs = torch.randn(spec.batch_size, spec.model.step, 1, 28, 28).cuda() # [bs, spec.model.step, c, h, w]
 #     model = TokenTuringMachineEncoder().cuda()
 #     out, mem = model(inputs)
-#     print(out.shape)
\ No newline at end of file
+#     print(out.shape)
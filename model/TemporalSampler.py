@@ -0,0 +1,47 @@
+import torch
+import torch.nn as nn
+from config.spec import TemporalSampling
+
+# The steps of the memory recurrence kept after preprocessing: the recurrence runs once per step,
+# so keeping sampled_steps of the time_steps steps cuts its cost in the same ratio (the
+# preprocessing still sees every frame / slice). The kept steps stay in time order.
+#   uniform:  a fixed stride over the steps, the first and the last one included
+#   random:   a random subset per sample while training, uniform in eval mode
+#   keyframe: per sample the steps whose tokens changed the most from the step before, by the
+#             mean L2 norm of the change over the tokens; the first step is always kept
+
+class TemporalSampler(nn.Module):
+    def __init__(self, spec) -> None:
+        super(TemporalSampler, self).__init__()
+        self.steps = spec.model.sampled_steps
+        self.select = {TemporalSampling.UNIFORM: self.uniform,
+                       TemporalSampling.RANDOM: self.random,
+                       TemporalSampling.KEYFRAME: self.keyframe}[spec.model.temporal_sampling]
+
+    def uniform(self, input):
+        t = input.size(1)
+        return torch.linspace(0, t - 1, self.steps, device=input.device).round().long()
+
+    def random(self, input):
+        if not self.training:
+            return self.uniform(input)
+        b, t = input.shape[:2]
+        return torch.rand(b, t, device=input.device).argsort(dim=1)[:, :self.steps].sort(dim=1).values
+
+    def keyframe(self, input):
+        with torch.no_grad():
+            change = (input[:, 1:] - input[:, :-1]).norm(dim=-1).mean(dim=-1)# [B, T - 1]
+            first = torch.full_like(change[:, :1], float("inf"))
+            return torch.cat([first, change], dim=1).topk(self.steps, dim=1).indices.sort(dim=1).values
+
+    def forward(self, input):
+        '''
+        input: [B, T, N, C] after preprocessing
+        return: [B, sampled_steps, N, C]
+        '''
+        if input.size(1) <= self.steps:
+            return input
+        index = self.select(input)
+        if index.dim() == 1:
+            return input[:, index]
+        return input[torch.arange(input.size(0), device=input.device).unsqueeze(1), index]
@@ -4,8 +4,14 @@ import numpy as np
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from utils.get_data_iter import get_dataloader
 import time
+from contextlib import ExitStack
 from utils.log import logger
-from config import Config
+from config import Config, compile_config
+from config.configure import config_arg_parser, get_config
+from utils.profiling import profiling, add_profiling_args
+from utils.checkpoint import checkpoint_path, load_checkpoint
+from utils.memory_store import memory_store
+from utils.early_exit import EarlyExit
 import torch
 import tqdm
 import torchvision.transforms as transforms 
@@ -13,9 +19,10 @@ import torch.nn as nn
 import os
 from torch.utils.data import Dataset,DataLoader
 import sys
-json_path = sys.argv[1]
-# json_path = "base.json"
-config = Config.getInstance(json_path)
+parser = add_profiling_args(config_arg_parser("test the last checkpoints of a run"))
+args = parser.parse_args()
+config = get_config(args)
+spec = compile_config(config)# validate the configure before any data is loaded
 os.environ["CUDA_VISIBLE_DEVICES"] = config["train"]["gpu"]
 
 if config["model"]["model"] == "ttm":
@@ -24,28 +31,46 @@ elif config["model"]["model"] == "lmttm":
     from model.LMTTM import TokenTuringMachineEncoder
 
 log_writer = logger(config["train"]["name"] + "_test")()
-test_loader = get_dataloader("test", config=config, download=False, transform=None)
-pth = f".\\check_point\\{config['train']['name']}\\"
-pth_files = [f"{pth}{config['train']['name']}_epoch_{i}.pth" for i in range(1, 11)] 
+test_loader = get_dataloader("test", config=config, download=False, transform=None, keyed=spec.train.memory_key == "sample")
+pth_files = [checkpoint_path(config['train']['name'], i) for i in range(1, 11)]
 
 def predict():
+    time_start = time.time()
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+    model = TokenTuringMachineEncoder(spec).to(device)# built once, every checkpoint is loaded into it
+    model.eval()
+    early_exit = None
+    if spec.model.early_exit_threshold > 0:
+        early_exit = EarlyExit(spec.model.early_exit_threshold, spec.model.early_exit_k, spec.model.early_exit_temperature)
+    load_time = 0
+    profile = ExitStack()
+    tracer, timer = profile.enter_context(profiling(args.trace, args.trace_steps, args.stage_times, args.stage_sync))
     for i in tqdm.tqdm(range(len(pth_files)),leave=True):
-        checkpoint = torch.load(pth_files[i])
-        load_state = checkpoint["model"]
-        load_memory_tokens = checkpoint["memory_tokens"]
-        memory_tokens = load_memory_tokens
-        model = TokenTuringMachineEncoder(config).cuda()
-        model.eval()
-        model.load_state_dict(load_state)
+        time1 = time.time()
+        memory_tokens = load_checkpoint(pth_files[i], model, device)
+        load_time += time.time() - time1
+        if i == 0:
+            print(f"startup took {time.time() - time_start:.2f}s")
+        # with train.memory_key sample every test sample starts from the memory of the checkpoint
+        store = memory_store(spec, "test", None if memory_tokens is None else memory_tokens[:1])
         all_y = 0
         all_real = 0
-        for x,y in tqdm.tqdm(test_loader,leave=False):
-            x = x.to("cuda", dtype = torch.float32)
-            y = y.to("cuda", dtype = torch.long)
-            if config["train"]["load_memory_tokens"]:
-                out, memory_tokens = model(x, memory_tokens)
+        all_steps = 0
+        for x,y,*keys in tqdm.tqdm(test_loader,leave=False):
+            x = x.to(device, dtype = torch.float32)
+            y = y.to(device, dtype = torch.long)
+            if store is not None:
+                memory_tokens = store.gather(keys[0], device)
+            if not config["train"]["load_memory_tokens"]:
+                memory_tokens = None
+            if early_exit is not None:
+                with torch.no_grad():
+                    out, memory_tokens = model.forward_early_exit(x, memory_tokens, early_exit)
+                all_steps += early_exit.steps.sum().item()
             else:
-                out, memory_tokens = model(x, memory_tokens = None)
+                out, memory_tokens = model(x, memory_tokens)
+            if store is not None:
+                store.scatter(keys[0], memory_tokens)
 
             out = torch.argmax(out, dim=1)
             # if config["dataset_name"] == "organmnist3d" or config["dataset_name"] == "nodulemnist3d" or config["dataset_name"] == "vesselmnist3d":
@@ -57,9 +82,15 @@ def predict():
             all_y += all
 
             all_real += result
+            if tracer is not None:
+                tracer.step()
             ###   B,C,STEP,H,W
+        if store is not None:
+            store.close()
         print("\n Total sample size:",all_y,"Predicting the right amount:",all_real)
         print("acc is {}%".format((all_real/all_y)*100))
+        if early_exit is not None:
+            print(f"early exit used {all_steps / all_y:.2f} of {spec.model.sampled_steps} steps on average")
 
         acc = (all_real/all_y)*100
         log_writer.add_scalar("acc per num weight ", acc, i)
@@ -79,6 +110,8 @@ def predict():
             # Redirecting data from print to file
             print(f"{config['train']['name']} pth{i} test_acc: {test_acc}%", file=file)
 
+    profile.close()
+    print(f"loading a checkpoint took {load_time/len(pth_files)*1000:.1f}ms on average")
     with open(experiment_path, "a") as file:
         print(" ", file=file)
     log_writer.close()
@@ -4,8 +4,19 @@ import numpy as np
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from utils.get_data_iter import get_dataloader
 import time
+from contextlib import ExitStack
 from utils.log import logger
-from config import Config
+from utils.metrics import MetricsLogger, TensorBoardSink
+from utils.validation import ValidationScheduler
+from utils.checkpoint import AsyncCheckpointWriter, checkpoint_path, resume_path, load_resume, rng_state, set_rng_state
+from utils.profiling import profiling, add_profiling_args
+from utils.flops import estimate, format_estimate
+from utils.micro_batch import micro_batch_step, auto_micro_batch, memory_flags
+from utils.memory_store import memory_store
+from utils.memory_codec import encode
+from datasets.shared_data import memory_usage
+from config import Config, compile_config
+from config.configure import config_arg_parser, get_config
 import torch
 import tqdm
 import torchvision.transforms as transforms
@@ -13,29 +24,12 @@ import torch.nn as nn
 import os
 from torch.utils.data import Dataset,DataLoader
 import sys
-json_path = sys.argv[1]
-# json_path = "base.json"
-config = Config.getInstance(json_path)
-if config["model"]["model"] == "ttm":
-    from model.TTM import TokenTuringMachineEncoder
-elif config["model"]["model"] == "lmttm":
-    from model.LMTTM import TokenTuringMachineEncoder
 
-log_writer = logger(config['train']["name"] + "_train")()
-if not os.path.exists("./check_point"):
-    os.mkdir("./check_point")
-checkpoint_path = f"./check_point/{config['train']['name']}"
-if os.path.exists(checkpoint_path):
-    pass
-else:
-    os.mkdir(checkpoint_path)
-
-data_loader = get_dataloader("train", config=config, download=True, transform=None)
-val_loader = get_dataloader("val", config=config, download=False, transform=None)
-
-torch.manual_seed(3407)
-os.environ['CUBLAS_WORKSPACE_CONFIG'] = ':4096:8'
-torch.use_deterministic_algorithms(True)
+def parse_args(argv=None):
+    parser = config_arg_parser("train the ttm / lmttm encoder")
+    parser.add_argument("--resume", action="store_true", help="continue from the resume checkpoint of the run if there is one")
+    add_profiling_args(parser)
+    return parser.parse_args(argv)
 
 def init_weights(m):
     if isinstance(m, nn.Linear) or isinstance(m, nn.Conv1d) or isinstance(m, nn.Conv2d) or isinstance(m, nn.Conv3d):
@@ -43,23 +37,43 @@ def init_weights(m):
         if m.bias is not None:
             nn.init.constant_(m.bias, 0)
 
-def train():
+def train(config, spec, data_loader, val_loader, log_writer, keep_last=10, experiment_path="./experiment/experiment.txt", resume=False,
+          trace_path=None, trace_steps=5, stage_times=False, stage_sync=False):
+    if config["model"]["model"] == "ttm":
+        from model.TTM import TokenTuringMachineEncoder
+    elif config["model"]["model"] == "lmttm":
+        from model.LMTTM import TokenTuringMachineEncoder
     memory_tokens = None
-    model = TokenTuringMachineEncoder(config).cuda() 
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+    model = TokenTuringMachineEncoder(spec).to(device)
     out_name = f'{config["model"]["model"]:^{10}}'  
     print("-"*35,out_name,"Model Info","-"*35)
-    parameters = filter(lambda p: p.requires_grad, model.parameters())
-    parameters = sum([np.prod(p.size()) for p in parameters]) / 1_000_000
-    print('Trainable Parameters: %.3fM' % parameters,"\n","-"*90)
+    print(format_estimate(estimate(spec)),"\n","-"*90)
     model.apply(init_weights)##init weight
+    distiller = None
+    if spec.train.distill_teacher:
+        from utils.distill import Distiller, teacher_config
+        teacher, student = estimate(compile_config(teacher_config(config))), estimate(spec)
+        used = lambda costs: costs["total_params"] - costs["params"]["unused"]
+        print(f"distilling from {spec.train.distill_teacher}: the student has {used(student) / used(teacher):.1%} "
+              f"of the parameters and {student['total_flops'] / teacher['total_flops']:.1%} of the FLOPs of the teacher")
+        distiller = Distiller(config, device, len(data_loader.dataset))
+    parameters = list(model.parameters()) + (distiller.parameters() if distiller is not None else [])
     if config['train']["optimizer"] == "RMSprop":
         optimizer = torch.optim.RMSprop(
-            model.parameters(), lr=config['train']["lr"], weight_decay=config['train']["weight_decay"])
+            parameters, lr=config['train']["lr"], weight_decay=config['train']["weight_decay"])
     elif config['train']["optimizer"] == "Adam":
         optimizer = torch.optim.Adam(
-            model.parameters(), lr=config['train']["lr"], weight_decay=config['train']["weight_decay"])
+            parameters, lr=config['train']["lr"], weight_decay=config['train']["weight_decay"])
     citizer = torch.nn.CrossEntropyLoss()
-    epoch_bar = tqdm.tqdm(range(config['train']["epoch"]))
+    metrics = MetricsLogger([TensorBoardSink(log_writer)], flush_every=config['train']["log_every"])
+    validation = ValidationScheduler(config['train']["val_mode"], model, val_loader, spec, config, device=device,
+                                     subset=config['train']["val_subset"])
+    # 0 runs the whole batch at once, unless memory_budget_mb is set, then the micro-batch is sized from it on the first batch
+    micro_batch = config['train']["micro_batch"] or (None if config['train']["memory_budget_mb"] else config["batch_size"])
+    checkpoints = AsyncCheckpointWriter()
+    store = memory_store(spec, "train")# the memory of each sample, with train.memory_key sample
+    start_epoch = 0
     train_nums = 0
     val_acc_nums = 0
     val_acc = 0
@@ -67,76 +81,138 @@ def train():
     convergence_batch = -1
     convergence_flag = -1
     avg_loss = 0
-    reals_out  =  0
-    reals_all = 0
     convergence_epoch = -1
     acc_lis=[]
+    resume_file = resume_path(config['train']['name'])
+    if resume and os.path.exists(resume_file):
+        state = load_resume(resume_file)
+        model.load_state_dict(state["model"])
+        if distiller is not None and distiller.align is not None and state.get("distill_align") is not None:
+            distiller.align.load_state_dict(state["distill_align"])
+        optimizer.load_state_dict(state["optimizer"])
+        memory_tokens = state["memory_tokens"].to(device) if state["memory_tokens"] is not None else None
+        for module, flag in zip(memory_flags(model)[0], state["memory_flags"]):
+            module.current_flag = flag
+        if store is not None:
+            if state.get("memory_store") is not None:
+                store.load_state(state["memory_store"])
+            else:
+                print(f"warning: {resume_file} has no per sample memory, every sample starts from the initial memory again")
+        start_epoch = state["epoch"]
+        train_nums = state["train_nums"]
+        val_acc_nums = state["val_acc_nums"]
+        val_acc = state["val_acc"]
+        save_loss = state["save_loss"]
+        convergence_batch = state["convergence_batch"]
+        convergence_flag = state["convergence_flag"]
+        avg_loss = state["avg_loss"]
+        convergence_epoch = state["convergence_epoch"]
+        acc_lis = state["acc_lis"]
+        micro_batch = state["micro_batch"]
+        set_rng_state(state["rng"])
+        print(f"resumed from {resume_file} at epoch {start_epoch}, step {train_nums}")
+    elif resume:
+        print(f"no {resume_file} yet, training from scratch")
+    profile = ExitStack()
+    tracer, timer = profile.enter_context(profiling(trace_path, trace_steps, stage_times, stage_sync))
+    epoch_bar = tqdm.tqdm(range(start_epoch, config['train']["epoch"]), initial=start_epoch, total=config['train']["epoch"])
     for _ in epoch_bar:
         epoch_bar.set_description(
             f"train epoch is {format(_+1)} of {config['train']['epoch']}")
         bar = tqdm.tqdm(data_loader, leave=False)
-        losses = []
+        losses = 0
+        loss_nums = 0
         time_ = 0 
-        for input, target in bar:
+        for input, target, *keys in bar:
             time1 = time.time()
-            input = input.to("cuda", dtype=torch.float32)  # B C T H W
+            if keys and store is not None:
+                memory_tokens = store.gather(keys[0], device)
+            input = input.to(device, dtype=torch.float32)  # B C T H W
             # input = input.transpose(1,2)# for medmnist ,if the input format is  B,T,C,H,W,please delete this lin
-            target = target.to("cuda", dtype=torch.long)  # B w
+            target = target.to(device, dtype=torch.long)  # B w
 
             # if config["dataset_name"] == "organmnist3d" or config["dataset_name"] == "nodulemnist3d" or config["dataset_name"] == "vesselmnist3d":
             target = target.squeeze(1)
 
             model.train()
-            if (config['train']["load_memory_tokens"]):
-                output, memory_tokens = model(input, memory_tokens)
+            if micro_batch is None:
+                micro_batch = auto_micro_batch(model, input, input.size(0), config['train']["memory_budget_mb"])
+                print(f"micro-batch of {micro_batch} rows for a memory budget of {config['train']['memory_budget_mb']}MB")
+            if micro_batch < input.size(0):
+                loss, memory_tokens = micro_batch_step(model, input, target, memory_tokens, citizer, micro_batch,
+                                                       load_memory_tokens=config['train']["load_memory_tokens"])
             else:
-                output, memory_tokens = model(input, memory_tokens = None)
+                if (config['train']["load_memory_tokens"]):
+                    output, memory_tokens = model(input, memory_tokens)
+                else:
+                    output, memory_tokens = model(input, memory_tokens = None)
+                if distiller is not None:
+                    loss = distiller.loss(output, target, memory_tokens, keys[0])
+                else:
+                    loss = citizer(output, target)
+                loss.backward()
+            if keys and store is not None:
+                store.scatter(keys[0], memory_tokens)
             train_nums += 1
-            loss = citizer(output, target)
-            loss.backward()
             optimizer.step()
             optimizer.zero_grad()
-            losses.append(loss.item())
-            bar.set_postfix(loss=loss.item(), val_acc=val_acc,batch_time=time_)
-            log_writer.add_scalar("loss per step", loss.item(), train_nums)
+            # keep the loss on the device, it is only read back every log_every / val_gap steps
+            metrics.add("loss per step", loss)
+            losses = losses + loss.detach()
+            loss_nums += 1
+            if train_nums % config['train']["log_every"] == 0:
+                bar.set_postfix(loss=metrics.latest.get("loss per step"), val_acc=val_acc,batch_time=time_)
+            metrics.step(train_nums)
+            if tracer is not None:
+                tracer.step()
             time2 = time.time()
             time_ = time2-time1
             if train_nums % config['train']["val_gap"] == 0:
-                avg_loss = sum(losses)/len(losses)          
+                avg_loss = (losses/loss_nums).item()          
                 if avg_loss <= 0.2 and convergence_flag == -1:
                     convergence_batch = (train_nums * config["batch_size"])
                     convergence_epoch = _ + 1
                     convergence_flag = 1
-                log_writer.add_scalar("loss per 100 step", avg_loss, train_nums)
-                losses = []
-                with torch.no_grad():
-                    for val_x, val_y in val_loader:
-                        model.eval()
-                        val_x = val_x.to("cuda", dtype=torch.float32)
-                        val_y = val_y.to("cuda", dtype=torch.long)
-
-                        # if config["dataset_name"] == "organmnist3d" or config["dataset_name"] == "nodulemnist3d" or config["dataset_name"] == "vesselmnist3d":
-                        val_y = val_y.squeeze(1)
-
-                        if (config['train']["load_memory_tokens"]):
-                            out, memory_tokens = model(val_x, memory_tokens)
-                        else:
-                            out, memory_tokens = model(val_x, memory_tokens = None)
-                        out = torch.argmax(out, dim=1)
-
-                        all = val_y.size(0)
-                        result = (out == val_y).sum().item()
-                        reals_out += result
-                        reals_all += all
-                    val_acc = (reals_out/reals_all)*100
-                    log_writer.add_scalar("val acc", val_acc, val_acc_nums)
-                    val_acc_nums += 1 
-        if _ >= (config['train']["epoch"]-10):
-            save_name = f"./check_point/{config['train']['name']}/{config['train']['name']}_epoch_{_ -config['train']['epoch'] + 11}.pth"
-            torch.save({"model": model.state_dict(), "memory_tokens": memory_tokens}, save_name)
-        if _ >= (config['train']["epoch"]-10):
+                metrics.put(train_nums, {"loss per 100 step": avg_loss})
+                losses = 0
+                loss_nums = 0
+                for _step, acc in validation.check(train_nums, memory_tokens):
+                    val_acc = acc
+                    metrics.put(val_acc_nums, {"val acc": val_acc})
+                    val_acc_nums += 1
+        for _step, acc in validation.epoch_end(train_nums, memory_tokens):
+            val_acc = acc
+            metrics.put(val_acc_nums, {"val acc": val_acc})
+            val_acc_nums += 1
+        if _ >= (config['train']["epoch"]-keep_last):
+            save_name = checkpoint_path(config['train']['name'], _ -config['train']['epoch'] + keep_last + 1)
+            checkpoints.save({"model": model.state_dict(), "memory_tokens": memory_tokens if spec.train.memory_codec == "fp32"
+                              else encode(memory_tokens, spec.train.memory_codec)}, save_name)
+        if _ >= (config['train']["epoch"]-keep_last):
             save_loss.append(avg_loss)
             acc_lis.append(val_acc)
+        if (_ + 1) % config['train']["resume_every"] == 0 or _ + 1 == config['train']["epoch"]:
+            checkpoints.save({"model": model.state_dict(), "optimizer": optimizer.state_dict(), "memory_tokens": memory_tokens,
+                              "memory_flags": memory_flags(model)[1], "epoch": _ + 1, "train_nums": train_nums,
+                              "val_acc_nums": val_acc_nums, "val_acc": val_acc, "save_loss": save_loss,
+                              "convergence_batch": convergence_batch, "convergence_flag": convergence_flag, "avg_loss": avg_loss,
+                              "convergence_epoch": convergence_epoch, "acc_lis": acc_lis, "micro_batch": micro_batch,
+                              "rng": rng_state(), "memory_store": store.state() if store is not None else None,
+                              "distill_align": distiller.align.state_dict() if distiller is not None and distiller.align is not None else None},
+                             resume_file)
+    profile.close()
+    for _step, acc in validation.close():
+        val_acc = acc
+        metrics.put(val_acc_nums, {"val acc": val_acc})
+        val_acc_nums += 1
+    print(validation.report())
+    checkpoints.close()
+    print(checkpoints.report())
+    if store is not None:
+        print(f"per sample memory: {store.report()}")
+        store.close()
+    metrics.close(train_nums)
+    print(f"metrics logging overhead is {metrics.report():.1f}us per step")
     final_save_loss = sum(save_loss)/(len(save_loss))
     final_save_loss = round(final_save_loss, 2)
     out_acc=sum(acc_lis)/len(acc_lis)
@@ -147,11 +223,40 @@ def train():
         pass
     else:
         os.mkdir("./experiment")
-    experiment_path = "./experiment/experiment.txt"
     with open(experiment_path, "a") as file:
-        print(f"{config['train']['name']} convergence_batch: {convergence_batch}, train_loss: {final_save_loss}, and convergence_batch={convergence_epoch}, val——acc is{out_accs}", file=file)
-if __name__ == "__main__":
+        print(f"{config['train']['name']} convergence_batch: {convergence_batch}, train_loss: {final_save_loss}, and convergence_batch={convergence_epoch}, val_acc is{out_accs}", file=file)
+
+def main(argv=None, keep_last=10, experiment_path="./experiment/experiment.txt"):
+    args = parse_args(argv)
+    config = get_config(args)
+    spec = compile_config(config)# validate the configure before any data is loaded
+    os.environ["CUDA_VISIBLE_DEVICES"] = config["train"]["gpu"]
+
+    log_writer = logger(config['train']["name"] + "_train")()
+    if not os.path.exists("./check_point"):
+        os.mkdir("./check_point")
+    checkpoint_dir = f"./check_point/{config['train']['name']}"
+    if os.path.exists(checkpoint_dir):
+        pass
+    else:
+        os.mkdir(checkpoint_dir)
+
+    data_loader = get_dataloader("train", config=config, download=True, transform=None,
+                                 keyed=spec.train.memory_key == "sample" or bool(spec.train.distill_teacher))
+    val_loader = get_dataloader("val", config=config, download=True, transform=None)
+    usage = memory_usage()
+    if usage:
+        print("RSS after loading the data: " + ", ".join(f"{key} {value:.0f}MB" for key, value in usage.items()))
+
+    torch.manual_seed(3407)
+    os.environ['CUBLAS_WORKSPACE_CONFIG'] = ':4096:8'
+    torch.use_deterministic_algorithms(True)
+
     time_1 = time.time()
-    train()
+    train(config, spec, data_loader, val_loader, log_writer, keep_last=keep_last, experiment_path=experiment_path, resume=args.resume,
+          trace_path=args.trace, trace_steps=args.trace_steps, stage_times=args.stage_times, stage_sync=args.stage_sync)
     time_2 = time.time()
     print("All Epoch Train Time Is ",time_2-time_1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+import os
+import sys
+import time
+import random
+import queue
+import threading
+import numpy as np
+import torch
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from utils.memory_codec import decode
+from utils.micro_batch import memory_flags
+
+# Checkpoints are written by a background thread: the training thread only pays for a cpu copy
+# of the state, the file is written to <path>.tmp and renamed, so a crash never leaves a partial
+# checkpoint behind. They are read back memory-mapped, straight into a model built once.
+# The resume checkpoint holds the full training state (optimizer, counters, generators, memory)
+# so train.py --resume continues from the end of the last saved epoch.
+# The memory_tokens of a checkpoint are a float32 tensor, or the dict of utils/memory_codec.encode
+# with train.memory_codec other than fp32; load_checkpoint decodes both.
+
+def build_encoder(spec, device="cpu"):
+    '''
+    return: the TokenTuringMachineEncoder of spec.model.model, its parameters created on device
+    '''
+    if spec.model.model.value == "ttm":
+        from model.TTM import TokenTuringMachineEncoder
+    else:
+        from model.LMTTM import TokenTuringMachineEncoder
+    with torch.device(device):
+        return TokenTuringMachineEncoder(spec)
+
+def checkpoint_path(name, index, root="./check_point"):
+    return os.path.join(root, name, f"{name}_epoch_{index}.pth")
+
+def snapshot(state):
+    '''
+    return: state with every tensor copied to the cpu, safe to write while training goes on
+    '''
+    if isinstance(state, torch.Tensor):
+        return state.detach().to("cpu", copy=True)
+    if isinstance(state, dict):
+        return {key: snapshot(value) for key, value in state.items()}
+    if isinstance(state, (list, tuple)):
+        return type(state)(snapshot(value) for value in state)
+    return state
+
+class AsyncCheckpointWriter():
+    '''
+    Writes checkpoints with torch.save on a background thread.
+    Args:
+    - max_pending (int): snapshots waiting to be written before save() blocks, bounds the extra host memory.
+    '''
+    def __init__(self, max_pending=2) -> None:
+        self.queue = queue.Queue(maxsize=max_pending)
+        self.blocked = 0.0# seconds the training thread spent in save()
+        self.written = 0
+        self.error = None
+        self.thread = threading.Thread(target=self._worker, daemon=True)
+        self.thread.start()
+
+    def save(self, state, path):
+        if self.error is not None:
+            raise self.error
+        time1 = time.time()
+        self.queue.put((snapshot(state), path))
+        self.blocked += time.time() - time1
+
+    def _worker(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            state, path = item
+            try:
+                torch.save(state, path + ".tmp")
+                os.replace(path + ".tmp", path)
+                self.written += 1
+            except Exception as e:
+                self.error = e
+
+    def close(self):
+        self.queue.put(None)
+        self.thread.join()
+        if self.error is not None:
+            raise self.error
+
+    def report(self):
+        return f"checkpointing blocked training for {self.blocked:.2f}s over {self.written} checkpoints"
+
+def load_checkpoint(path, model, device="cuda"):
+    '''
+    Load a checkpoint written by train.py into model, the file is memory-mapped and the weights are
+    copied straight into the parameters of model, so one model serves all the checkpoints of a run.
+    The block pointer of the linked memory (lmttm) goes back to the first block, as in a model built
+    for the checkpoint alone.
+    return: the memory_tokens of the checkpoint on device, or None
+    '''
+    checkpoint = torch.load(path, map_location="cpu", mmap=True, weights_only=True)
+    model.load_state_dict(checkpoint["model"])
+    for module in memory_flags(model)[0]:
+        module.current_flag = 0
+    return decode(checkpoint["memory_tokens"], device)
+
+def resume_path(name, root="./check_point"):
+    return os.path.join(root, name, f"{name}_resume.pth")
+
+def rng_state():
+    '''
+    return: the states of every random generator the training draws from
+    '''
+    state = {"torch": torch.get_rng_state(), "numpy": np.random.get_state(), "random": random.getstate()}
+    if torch.cuda.is_available():
+        state["cuda"] = torch.cuda.get_rng_state_all()
+    return state
+
+def set_rng_state(state):
+    torch.set_rng_state(state["torch"])
+    np.random.set_state(state["numpy"])
+    random.setstate(state["random"])
+    if "cuda" in state and torch.cuda.is_available():
+        torch.cuda.set_rng_state_all(state["cuda"])
+
+def load_resume(path):
+    '''
+    return: the full training state written by train.py, on the cpu
+    '''
+    # not weights_only: the state holds the numpy / python generator states
+    return torch.load(path, map_location="cpu", weights_only=False)
@@ -0,0 +1,153 @@
+import os
+import sys
+import hashlib
+import numpy as np
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+import torch.utils.data as data
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from config import compile_config
+from config.configure import DictToObject, dict_to_object_recursive, update_config
+from utils.checkpoint import build_encoder, load_checkpoint
+from utils.micro_batch import batch_rows
+
+# Knowledge distillation of a small student from a large teacher checkpoint (train.distill_teacher).
+# The teacher is the configure of the run with train.distill_teacher_model merged over it, e.g.
+# {"model": {"dim": 448, "memory_tokens_size": 448}}. It runs once over the train split in a fixed
+# order, carrying its memory from batch to batch like predict.py, and its logits (and, with
+# train.distill_memory_weight, its memory pooled to the memory_tokens_size of the student) are
+# stored in .npy files under train.distill_cache_dir, so the teacher never runs again while the
+# student trains; the train loader yields the sample index to look them up. The files are named by
+# the checkpoint and by a fingerprint of the train split (its size, labels and a few of its
+# samples), so a re-split (a new manifest, utils/spilt.py) never reads the rows of another split.
+#   loss = (1 - alpha) * CE(student, label) + alpha * T^2 * KL(softmax(teacher / T) || softmax(student / T))
+#          + memory_weight * MSE(W student memory, teacher memory)
+# W is a linear map from the student dim to the teacher dim, trained with the student.
+
+def to_dict(config):
+    if isinstance(config, DictToObject):
+        return {key: to_dict(value) for key, value in vars(config).items()}
+    return config
+
+def teacher_config(config):
+    '''
+    return: the configure of the teacher, the one of the run with train.distill_teacher_model merged over it
+    '''
+    teacher = to_dict(config)
+    update_config(teacher, to_dict(config["train"]["distill_teacher_model"]))
+    return dict_to_object_recursive(teacher)
+
+def checkpoint_key(path):
+    stat = os.stat(path)
+    return hashlib.sha1(f"{os.path.abspath(path)}:{stat.st_size}:{stat.st_mtime_ns}".encode("utf-8")).hexdigest()[:12]
+
+def split_fingerprint(dataset, samples=8):
+    '''
+    return: a key of the items of dataset and their order, from its size, its labels and samples items spread over it
+    '''
+    sha = hashlib.sha1(str(len(dataset)).encode("utf-8"))
+    labels = getattr(dataset, "labels", getattr(getattr(dataset, "dataset", None), "labels", None))
+    if labels is not None:
+        sha.update(np.ascontiguousarray(labels).tobytes())
+    indices = np.linspace(0, len(dataset) - 1, samples).round().astype(int) if len(dataset) else []
+    for index in sorted(set(int(i) for i in indices)):
+        input, target = dataset[index][:2]
+        for value in [input, target]:
+            sha.update(np.ascontiguousarray(np.asarray(value)).tobytes())
+    return sha.hexdigest()[:12]
+
+def build_teacher_cache(config, device="cpu", dataset=None):
+    '''
+    Run the teacher once over the train split, unless its outputs are stored already.
+    dataset: the train split as the teacher reads it, get_dataset of the teacher configure by default
+    return: (logits path, memory path or None)
+    '''
+    spec = compile_config(config)
+    t = spec.train
+    teacher_spec = compile_config(teacher_config(config))
+    if dataset is None:
+        from datasets import get_dataset
+        # the inputs the teacher was trained on: its preprocess_mode, input size and step may differ from the student's
+        dataset = get_dataset("train", download=True, config=teacher_config(config))
+    key = f"{checkpoint_key(t.distill_teacher)}_{split_fingerprint(dataset)}"
+    logits_path = os.path.join(t.distill_cache_dir, f"{spec.dataset_name}_train_{key}_logits.npy")
+    memory_path = None
+    if t.distill_memory_weight > 0:
+        memory_path = os.path.join(t.distill_cache_dir, f"{spec.dataset_name}_train_{key}_memory{spec.model.memory_tokens_size}.npy")
+    if os.path.exists(logits_path) and (memory_path is None or os.path.exists(memory_path)):
+        return logits_path, memory_path
+    os.makedirs(t.distill_cache_dir, exist_ok=True)
+    teacher = build_encoder(teacher_spec, device).eval()
+    memory_tokens = load_checkpoint(t.distill_teacher, teacher, device)
+    if not teacher_spec.train.load_memory_tokens:
+        memory_tokens = None
+    loader = data.DataLoader(dataset, batch_size=teacher_spec.batch_size, shuffle=False, num_workers=0)
+    logits = np.lib.format.open_memmap(logits_path + ".tmp", mode="w+", dtype=np.float32,
+                                       shape=(len(dataset), teacher_spec.model.out_class_num))
+    memory = None
+    if memory_path is not None:
+        memory = np.lib.format.open_memmap(memory_path + ".tmp", mode="w+", dtype=np.float16,
+                                           shape=(len(dataset), spec.model.memory_tokens_size, teacher_spec.model.dim))
+    start = 0
+    torch.manual_seed(3407)
+    with torch.no_grad():
+        for x, _ in loader:
+            b = x.size(0)
+            if memory_tokens is not None and memory_tokens.size(0) != b:
+                memory_tokens = memory_tokens[:b]# the last, smaller batch
+            with batch_rows(teacher, 0, b):
+                out, memory_tokens = teacher(x.to(device, dtype=torch.float32), memory_tokens)
+            logits[start:start + b] = out.cpu().numpy()
+            if memory is not None:
+                pooled = F.adaptive_avg_pool1d(memory_tokens.transpose(1, 2), spec.model.memory_tokens_size).transpose(1, 2)
+                memory[start:start + b] = pooled.cpu().numpy().astype(np.float16)
+            start += b
+    for array, path in [(logits, logits_path), (memory, memory_path)]:
+        if array is not None:
+            array.flush()
+            del array
+            os.replace(path + ".tmp", path)
+    return logits_path, memory_path
+
+class Distiller():
+    '''
+    The distillation loss of a student, from the teacher outputs stored by build_teacher_cache.
+    Args:
+    - config (Config): the configure of the student run.
+    - device (str): where the student is trained.
+    - train_size (int): the items of the train split of the student, checked against the teacher outputs.
+    '''
+    def __init__(self, config, device="cpu", train_size=None) -> None:
+        spec = compile_config(config)
+        self.alpha = spec.train.distill_alpha
+        self.temperature = spec.train.distill_temperature
+        self.memory_weight = spec.train.distill_memory_weight
+        logits_path, memory_path = build_teacher_cache(config, device)
+        self.logits = np.load(logits_path, mmap_mode="r")
+        self.memory = None if memory_path is None else np.load(memory_path, mmap_mode="r")
+        if train_size is not None and self.logits.shape[0] != train_size:
+            raise ValueError(f"{logits_path} holds the teacher outputs of {self.logits.shape[0]} samples, "
+                             f"the train split of the student has {train_size}")
+        self.memory_tokens_size = spec.model.memory_tokens_size
+        self.align = None
+        if self.memory is not None:
+            self.align = nn.Linear(spec.model.dim, self.memory.shape[2], bias=False).to(device)
+
+    def parameters(self):
+        return [] if self.align is None else list(self.align.parameters())
+
+    def loss(self, output, target, memory_tokens, keys):
+        '''
+        output: the student logits, memory_tokens: its new memory, keys: the train split index of the rows
+        '''
+        index = keys.cpu().numpy()
+        teacher = torch.from_numpy(self.logits[index]).to(output.device)
+        t = self.temperature
+        soft = F.kl_div(F.log_softmax(output / t, dim=1), F.softmax(teacher / t, dim=1), reduction="batchmean") * t * t
+        loss = (1 - self.alpha) * F.cross_entropy(output, target) + self.alpha * soft
+        if self.align is not None:
+            teacher_memory = torch.from_numpy(self.memory[index].astype(np.float32)).to(output.device)
+            student = F.adaptive_avg_pool1d(memory_tokens.transpose(1, 2), self.memory_tokens_size).transpose(1, 2)
+            loss = loss + self.memory_weight * F.mse_loss(self.align(student), teacher_memory)
+        return loss
@@ -0,0 +1,83 @@
+import os
+import sys
+import torch
+import torch.nn.functional as F
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from utils.micro_batch import batch_rows, memory_flags
+
+# Early exit over the time steps of the encoder (forward_early_exit of model/TTM.py and
+# model/LMTTM.py). The head of the encoder pools the outputs of every step, so after step i the
+# cls of the mean of the first i outputs is the prediction the encoder would make with i steps;
+# at the last step it is the usual prediction. A row of the batch exits once the max of
+# softmax(logits / temperature) is at least threshold for k steps in a row, its logits and steps
+# are those of that step. The recurrence stops when every row has exited. The temperature is
+# fitted on the val set (calibrate) so the threshold reads as a probability of being right.
+
+class EarlyExit():
+    '''
+    Args:
+    - threshold (float): the calibrated confidence a row must reach, above 1 never exits.
+    - k (int): the consecutive confident steps before a row exits.
+    - temperature (float): the logits are divided by it before the softmax.
+    - record (bool): keep the logits of every step in self.history, for calibrate.
+    '''
+    def __init__(self, threshold, k=2, temperature=1.0, record=False) -> None:
+        self.threshold = threshold
+        self.k = k
+        self.temperature = temperature
+        self.record = record
+
+    def start(self, b, device):
+        self.logits = None
+        self.step = 0
+        self.steps = torch.zeros(b, dtype=torch.long, device=device)
+        self.streak = torch.zeros(b, dtype=torch.long, device=device)
+        self.done = torch.zeros(b, dtype=torch.bool, device=device)
+        self.history = []
+
+    def update(self, logits):
+        '''
+        logits: [B, out_class_num] of the running head after one more step
+        return: whether every row has exited
+        '''
+        self.step += 1
+        live = ~self.done
+        self.logits = logits if self.logits is None else torch.where(live.unsqueeze(1), logits, self.logits)
+        self.steps = torch.where(live, self.step, self.steps)
+        if self.record:
+            self.history.append(logits.detach())
+        confident = F.softmax(logits / self.temperature, dim=1).amax(dim=1) >= self.threshold
+        self.streak = torch.where(confident, self.streak + 1, 0)
+        self.done = self.done | (self.streak >= self.k)
+        return bool(self.done.all())
+
+def fit_temperature(logits, targets, steps=100):
+    '''
+    return: the temperature minimising the cross entropy of logits / temperature
+    '''
+    log_t = torch.zeros(1, requires_grad=True)
+    optimizer = torch.optim.LBFGS([log_t], lr=0.1, max_iter=steps)
+    def closure():
+        optimizer.zero_grad()
+        loss = F.cross_entropy(logits / log_t.exp(), targets)
+        loss.backward()
+        return loss
+    optimizer.step(closure)
+    return log_t.detach().exp().item()
+
+def calibrate(model, loader, memory_tokens=None, device="cpu"):
+    '''
+    Fit the temperature on the logits of the running head at every step of every batch of loader.
+    return: the temperature
+    '''
+    record = EarlyExit(threshold=2.0, record=True)
+    logits, targets = [], []
+    for module in memory_flags(model)[0]:
+        module.current_flag = 0
+    with torch.no_grad():
+        for x, y in loader:
+            with batch_rows(model, 0, x.size(0)):
+                _, memory_tokens = model.forward_early_exit(x.to(device, dtype=torch.float32), memory_tokens, record)
+            logits.extend(step.cpu() for step in record.history)
+            targets.extend(y.reshape(-1).long() for _ in record.history)
+    return fit_temperature(torch.cat(logits), torch.cat(targets))
@@ -0,0 +1,262 @@
+import os
+import sys
+import torch
+from torch.utils.flop_counter import FlopCounterMode
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from config import compile_config
+from config.spec import ModelName, PreprocessMode, ProcessUnit, MemoryMode, RESNET18_CHANNELS
+from config.configure import config_arg_parser, get_config
+from utils.profiling import StageTimer
+from utils.micro_batch import batch_rows
+from utils.checkpoint import build_encoder
+
+# The parameters and forward FLOPs of the encoder, worked out from the configure alone before
+# any data is loaded, per stage (preprocess, read, process, write, head) and per sample.
+# A FLOP is a multiply or an add of a matmul or a convolution (2 per multiply-accumulate, the
+# convention of torch.utils.flop_counter), norms, activations and softmax are left out.
+# The parameters are counted on a model built on the meta device (no memory, no init), the
+# modules built but not used by the configure (the other TokenLearners, front-ends) are "unused".
+# check() runs the real encoder under FlopCounterMode and splits the count by utils/profiling stages.
+
+STAGES = ["preprocess", "read", "process", "write", "head"]
+PROCESS_LAYERS = 3# TokenTuringMachineUnit.num_layers
+
+def _linear(rows, in_features, out_features):
+    return 2 * rows * in_features * out_features
+
+def _conv_out(size, kernel, stride, padding):
+    return (size + 2 * padding - kernel) // stride + 1
+
+def _token_learner(tokens, out_tokens, dim):
+    # attention_maps (dim->dim, dim->out_tokens), feat_conv (dim->dim), then out_tokens x tokens x dim einsum
+    return _linear(tokens, dim, dim) * 2 + _linear(tokens, dim, out_tokens) + _linear(out_tokens, tokens, dim)
+
+def _attention(queries, tokens, dim):
+    # q, k, v and out projections, scores and weighted sum over the heads
+    return _linear(queries, dim, dim) * 2 + _linear(tokens, dim, 2 * dim) + 2 * _linear(queries, tokens, dim)
+
+def _memory_driven(memory, inputs, summ, dim):
+    # TokenLearnerModuleV12 over the memory (token axis convs memory->memory, memory->summ, memory->dim,
+    # then summ x dim x dim einsum), then the queries attend over the input tokens
+    queries = _linear(dim, memory, memory) + _linear(dim, memory, summ) + _linear(dim, memory, dim) + _linear(summ, dim, dim)
+    return queries + 2 * _linear(summ, inputs, dim)
+
+def _add_erase(tokens, summ, memory, dim):
+    selected = _linear(tokens, dim, 3 * dim) + _linear(tokens, 3 * dim, summ)
+    control = 2 * (_linear(dim, summ, 3 * dim) + _linear(dim, 3 * dim, summ) + _linear(summ, dim, 3 * dim) + _linear(summ, 3 * dim, dim))
+    return selected + control + _linear(dim, tokens, memory)
+
+def _resnet18(height, width):
+    '''
+    return: (FLOPs of one frame through conv1 .. layer2, tokens of the 128 channel output)
+    '''
+    h1, w1 = _conv_out(height, 7, 2, 3), _conv_out(width, 7, 2, 3)
+    h2, w2 = _conv_out(h1, 3, 2, 1), _conv_out(w1, 3, 2, 1)
+    h3, w3 = _conv_out(h2, 3, 2, 1), _conv_out(w2, 3, 2, 1)
+    flops = _linear(h1 * w1, 3 * 49, 64)
+    flops += 4 * _linear(h2 * w2, 64 * 9, 64)# layer1
+    flops += _linear(h3 * w3, 64 * 9, 128) + _linear(h3 * w3, 64, 128) + 3 * _linear(h3 * w3, 128 * 9, 128)# layer2 with its downsample
+    return flops, h3 * w3
+
+def preprocess_flops(spec):
+    m = spec.model
+    voxels = m.time_steps * m.input_tokens
+    if m.preprocess_mode == PreprocessMode.CONV3D:
+        return _linear(voxels, m.in_channels * m.patch_size ** 3, m.dim)
+    if m.preprocess_mode == PreprocessMode.CONV3D_BN:
+        return _linear(voxels, m.in_channels * m.patch_size ** 3, 64) + _linear(voxels, 64 * 27, m.dim)
+    frame, tokens = _resnet18(spec.train.input_H, spec.train.input_W)
+    if m.preprocess_mode == PreprocessMode.RESNET18_CACHED:
+        return m.step * _linear(tokens, RESNET18_CHANNELS, m.dim)# the backbone ran once, when the features were cached
+    return m.step * (frame + _linear(tokens, RESNET18_CHANNELS, m.dim))
+
+def process_flops(spec, tokens):
+    m = spec.model
+    if m.process_unit == ProcessUnit.TRANSFORMER:
+        layer = _attention(tokens, tokens, m.dim) + _linear(tokens, m.dim, 3 * m.dim) + _linear(tokens, 3 * m.dim, m.dim)
+    elif m.process_unit == ProcessUnit.MIXER:
+        layer = _linear(m.dim, tokens, 6 * tokens) * 2 + _linear(tokens, m.dim, 3 * m.dim) * 2
+    else:
+        layer = _linear(tokens, m.dim, 3 * m.dim) * 2
+    return PROCESS_LAYERS * layer
+
+def read_flops(spec, memory, inputs):
+    m = spec.model
+    if m.memory_mode == MemoryMode.TL_MHA:
+        return _attention(m.summerize_num_tokens, memory + inputs, m.dim)
+    if m.memory_mode == MemoryMode.TL_V12:
+        return _memory_driven(memory, inputs, m.summerize_num_tokens, m.dim)
+    return _token_learner(memory + inputs, m.summerize_num_tokens, m.dim)
+
+def write_flops(spec, tokens, out_tokens):
+    m = spec.model
+    if m.memory_mode == MemoryMode.TL_MHA:
+        return _attention(out_tokens, tokens, m.dim)
+    if m.memory_mode == MemoryMode.TL_ADD_ERASE:
+        return _add_erase(tokens, m.summerize_num_tokens, out_tokens, m.dim)
+    return _token_learner(tokens, out_tokens, m.dim)
+
+def step_flops(spec):
+    '''
+    return: [{"read", "process", "write"} for every step of the memory recurrence], per sample
+    '''
+    m = spec.model
+    summ, inputs = m.summerize_num_tokens, m.input_tokens
+    memory = m.memory_tokens_size
+    steps = []
+    for _ in range(m.sampled_steps):
+        if m.model == ModelName.TTM:
+            out_tokens = m.memory_tokens_size
+            steps.append({"read": read_flops(spec, memory, inputs),
+                          "process": process_flops(spec, summ),
+                          "write": write_flops(spec, memory + inputs + summ, out_tokens)})
+        else:
+            # three blocks (current, prev, next) are read and written back as one block; the MHA write
+            # emits memory_tokens_size tokens, so with it the memory grows at every step
+            block = memory // m.num_blocks
+            out_tokens = m.memory_tokens_size if m.memory_mode == MemoryMode.TL_MHA else m.memory_block_size
+            steps.append({"read": 3 * read_flops(spec, block, inputs),
+                          "process": process_flops(spec, 3 * summ),
+                          "write": write_flops(spec, 3 * block + inputs + 3 * summ, out_tokens)})
+            out_tokens += (m.num_blocks - 1) * block
+        memory = out_tokens
+    return steps
+
+def stage_modules(spec):
+    '''
+    return: {stage: [names of the encoder modules the stage runs]}
+    '''
+    m = spec.model
+    unit = "tokenTuringMachineUnit."
+    if m.preprocess_mode == PreprocessMode.CONV3D:
+        preprocess = ["pre1"]
+    elif m.preprocess_mode == PreprocessMode.CONV3D_BN:
+        preprocess = ["pre2"]
+    elif m.preprocess_mode == PreprocessMode.RESNET18_CACHED:
+        preprocess = ["pre_dim"]
+    else:
+        preprocess = ["pre2" if m.model == ModelName.TTM else "pre3", "pre_dim"]
+    read = {MemoryMode.TL: ["tokenLearner1"], MemoryMode.TL_ADD_ERASE: ["tokenLearner1"],
+            MemoryMode.TL_MHA: ["tokenLearnerMHA1"], MemoryMode.TL_V12: ["tokenLearnerV12"]}[m.memory_mode]
+    process = {ProcessUnit.TRANSFORMER: ["transformerBlock"],
+               ProcessUnit.MIXER: ["mixer_sequence_block", "mixer_channels__block", "norm"],
+               ProcessUnit.MLP: ["mlpBlock", "norm"]}[m.process_unit]
+    write = {MemoryMode.TL: ["tokenLearner2"], MemoryMode.TL_V12: ["tokenLearner2"], MemoryMode.TL_ADD_ERASE: ["tokenAddEraseWrite"],
+             MemoryMode.TL_MHA: ["tokenLearnerMHA2"]}[m.memory_mode]
+    return {"preprocess": preprocess, "read": [unit + name for name in read], "process": [unit + name for name in process],
+            "write": [unit + name for name in write], "head": ["cls"]}
+
+def count_params(spec):
+    '''
+    return: {stage: parameters, "unused": parameters of the modules the configure does not run}
+    '''
+    model = build_encoder(spec, "meta")
+    modules = dict(model.named_modules())
+    params = {}
+    for name, names in stage_modules(spec).items():
+        params[name] = sum(p.numel() for module in names for p in modules[module].parameters())
+    params["unused"] = sum(p.numel() for p in model.parameters()) - sum(params.values())
+    return params
+
+def estimate(config):
+    '''
+    config: the Config or RuntimeSpec
+    return: {"params": {stage: n}, "flops": {stage: forward FLOPs per sample}, "total_params", "total_flops"}
+    '''
+    spec = compile_config(config)
+    steps = step_flops(spec)
+    flops = {"preprocess": preprocess_flops(spec)}
+    for name in ["read", "process", "write"]:
+        flops[name] = sum(step[name] for step in steps)
+    flops["head"] = _linear(1, spec.model.dim, spec.model.out_class_num)
+    params = count_params(spec)
+    return {"params": params, "flops": flops, "total_params": sum(params.values()), "total_flops": sum(flops.values())}
+
+class StageFlops(StageTimer):
+    '''
+    Splits the count of a FlopCounterMode by the utils/profiling stages, nested stages count in the innermost.
+    '''
+    def __init__(self, counter) -> None:
+        super().__init__(sync=False)
+        self.counter = counter
+        self.flops = {}
+
+    def _move(self):
+        total = self.counter.get_total_flops()
+        if self.stack:
+            self.flops[self.stack[-1]] = self.flops.get(self.stack[-1], 0) + total - self.last
+        self.last = total
+
+    def begin(self, name):
+        self._move()
+        self.stack.append(self.stack[-1] + "/" + name if self.stack else name)
+
+    def end(self):
+        self._move()
+        self.stack.pop()
+
+def check(config, batch=1):
+    '''
+    Counts the FLOPs of one forward of the real encoder with FlopCounterMode.
+    return: {stage: measured FLOPs per sample}
+    '''
+    spec = compile_config(config)
+    model = build_encoder(spec)
+    if spec.model.preprocess_mode == PreprocessMode.RESNET18_CACHED:
+        input = torch.rand(batch, spec.model.step, spec.model.input_tokens, RESNET18_CHANNELS)
+    else:
+        input = torch.rand(batch, spec.model.in_channels, spec.model.step, spec.train.input_H, spec.train.input_W)
+    counter = FlopCounterMode(display=False)
+    recorder = StageFlops(counter)
+    # autograd on: keeps the TransformerEncoderLayer off its fused inference path, which the counter does not see
+    with counter, recorder, batch_rows(model, 0, batch):
+        recorder.last = 0
+        model(input, None)
+    measured = dict.fromkeys(STAGES, 0)
+    for path, flops in recorder.flops.items():
+        name = path.split("/")[-1]
+        measured[name] = measured.get(name, 0) + flops // batch
+    measured["total"] = counter.get_total_flops() // batch
+    return measured
+
+def format_count(value, unit=""):
+    for scale, prefix in [(1e12, "T"), (1e9, "G"), (1e6, "M"), (1e3, "K")]:
+        if value >= scale:
+            return f"{value / scale:.2f}{prefix}{unit}"
+    return f"{value:.0f}{unit}"
+
+def format_estimate(result, measured=None):
+    '''
+    return: the table printed at the start of training
+    '''
+    head = f"{'stage':<12}{'params':>10}{'FLOPs/sample':>15}{'share':>8}"
+    if measured is not None:
+        head += f"{'measured':>12}"
+    lines = [head]
+    total = max(result["total_flops"], 1)
+    for name in STAGES + ["unused"]:
+        flops = result["flops"].get(name)
+        line = f"{name:<12}{format_count(result['params'][name]):>10}"
+        line += f"{format_count(flops):>15}{flops / total:>8.1%}" if flops is not None else f"{'-':>15}{'-':>8}"
+        if measured is not None:
+            line += f"{format_count(measured[name]):>12}" if name in measured else f"{'-':>12}"
+        lines.append(line)
+    line = f"{'total':<12}{format_count(result['total_params']):>10}{format_count(result['total_flops']):>15}{'':>8}"
+    if measured is not None:
+        line += f"{format_count(measured['total']):>12}"
+    lines.append(line)
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    # python utils/flops.py base.json --overlay '{"model": {"model": "ttm", "dim": 256}}' --check
+    parser = config_arg_parser("parameters and forward FLOPs per sample of a configure")
+    parser.add_argument("--check", action="store_true", help="also count the FLOPs of one real forward with FlopCounterMode")
+    args = parser.parse_args()
+    spec = compile_config(get_config(args))
+    result = estimate(spec)
+    measured = check(spec) if args.check else None
+    print(format_estimate(result, measured))
+    if measured is not None:
+        error = abs(measured["total"] - result["total_flops"]) / max(measured["total"], 1)
+        print(f"estimate off by {error:.2%} from the measured count")
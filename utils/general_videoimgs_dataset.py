@@ -10,6 +10,22 @@ from PIL import Image
 import os
 import torch
 import random
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from utils.spilt import load_manifest
+
+def read_clip(clip_path:str, transforme2):
+    '''
+    Read every frame of a clip dir into a single [T, 3, 224, 224] tensor.
+    '''
+    imgs_file = os.listdir(clip_path)
+    tensor = torch.empty((len(imgs_file),3,224,224))
+    for i, image_file in enumerate(imgs_file):
+        image_path = os.path.join(clip_path, image_file)
+        image = Image.open(image_path)
+        image = transforme2(image)#for cat the tensor
+        tensor[i] = image
+    return tensor
 
 class GeneralImgsDataset(Dataset):
     '''
@@ -40,13 +56,7 @@ class GeneralImgsDataset(Dataset):
 
         get_img_path = self.imgs_path[index]
         label = self.labels.index(get_img_path.split("\\")[-2])
-        imgs_file = os.listdir(get_img_path)
-        tensor = torch.empty((len(imgs_file),3,224,224))
-        for i, image_file in enumerate(imgs_file):
-            image_path = os.path.join(get_img_path, image_file)
-            image = Image.open(image_path)
-            image = self.transforme2(image)#for cat the tensor
-            tensor[i] = image
+        tensor = read_clip(get_img_path, self.transforme2)
         if self.transforme is not None:
             tensor = self.transforme(tensor)
         tensor = tensor.transpose(0, 1)
@@ -59,7 +69,36 @@ class GeneralImgsDataset(Dataset):
 
 
 
-__all__ = ['GeneralImgsDataset']
+class ManifestImgsDataset(Dataset):
+    '''
+    A PyTorch dataset for loading image data listed in a split manifest (see utils/spilt.spilt_manifest).
+    Args:
+    - manifest_path (str): The manifest file.
+    - split (str): train, val or test.
+    - transforme (transformer) : The transformer to apply to the image data.
+    - root (str): Overrides the data root stored in the manifest.
+
+    '''
+    def __init__(self,manifest_path:str,split:str,transforme=None,root=None) -> None:
+
+        super().__init__()
+        self.imgs_path, self.targets, self.labels = load_manifest(manifest_path, split=split, root=root)
+        self.transforme = transforme
+        self.transforme2 = transforms.Compose([transforms.ToTensor(),transforms.Resize((224, 224))])
+
+    def __getitem__(self, index):
+
+        tensor = read_clip(self.imgs_path[index], self.transforme2)
+        if self.transforme is not None:
+            tensor = self.transforme(tensor)
+        tensor = tensor.transpose(0, 1)
+        return tensor,int(self.targets[index])
+
+    def __len__(self):
+        return len(self.imgs_path)
+
+
+__all__ = ['GeneralImgsDataset', 'ManifestImgsDataset', 'read_clip']
 
 if __name__ == "__main__":
     data = GeneralImgsDataset(r"F:\imgs",None)
@@ -3,8 +3,12 @@ import datasets
 from config import Config
 import torch
 
-def get_dataloader(split,config, download=False, transform=None):
+def get_dataloader(split,config, download=False, transform=None, keyed=False):
     basic_data = datasets.get_dataset(split=split, download=download, transform=transform,config=config)
+    if keyed:
+        # (input, target, key) for the per sample memory of utils/memory_store.py
+        from utils.memory_store import IndexedDataset
+        basic_data = IndexedDataset(basic_data)
     dataloader = data.DataLoader(
         basic_data, batch_size=config["batch_size"], num_workers=0, drop_last=True, shuffle=True)
     return dataloader
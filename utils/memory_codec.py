@@ -0,0 +1,133 @@
+import os
+import sys
+import json
+import struct
+import numpy as np
+import torch
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Compact memory tokens for the checkpoints and the memory stores. A [B, M, dim] float32 memory is
+# encoded row by row (one row per stream) in one vectorised pass:
+#   fp32  as is, 4 bytes per value
+#   fp16  2 bytes per value, values beyond +-65504 saturate
+#   bf16  2 bytes per value, the fp32 exponent with 8 bits of mantissa
+#   int8  1 byte per value plus one float32 scale per block of `block` values of the flattened
+#         row: q = round(x / scale), scale = max|x| / 127 of the block
+# The encoded data always has a numpy dtype (bf16 is kept as its int16 bits), so it can go to a
+# np.memmap or to bytes as is. encode / decode wrap it in a dict for torch.save, pack / unpack in
+# bytes for an external key-value store.
+
+CODECS = ["fp32", "fp16", "bf16", "int8"]
+INT8_BLOCK = 64
+
+def encode_rows(memory_tokens, codec="fp16", block=INT8_BLOCK):
+    '''
+    memory_tokens: [B, M, dim]
+    return: (data [B, ...] int8 / int16 / float16 / float32, scales [B, blocks] float32 or None)
+    '''
+    x = memory_tokens.detach().to(torch.float32)
+    if codec == "fp32":
+        return x, None
+    if codec == "fp16":
+        return x.clamp(-65504, 65504).to(torch.float16), None
+    if codec == "bf16":
+        return x.to(torch.bfloat16).view(torch.int16), None
+    if codec == "int8":
+        b = x.size(0)
+        x = x.reshape(b, -1)
+        pad = -x.size(1) % block
+        if pad:
+            x = torch.nn.functional.pad(x, (0, pad))
+        x = x.view(b, -1, block)
+        scales = x.abs().amax(dim=2) / 127
+        q = torch.round(x / scales.clamp_min(torch.finfo(torch.float32).tiny).unsqueeze(2)).clamp_(-127, 127)
+        return q.to(torch.int8).view(b, -1), scales
+    raise ValueError(f"memory codec {codec!r} is not one of {CODECS}")
+
+def decode_rows(data, scales, codec, shape):
+    '''
+    shape: the [M, dim] of a row
+    return: float32 [B, M, dim] on the device of data
+    '''
+    if codec in ["fp32", "fp16"]:
+        return data.to(torch.float32).reshape(-1, *shape)
+    if codec == "bf16":
+        return data.contiguous().view(torch.bfloat16).to(torch.float32).reshape(-1, *shape)
+    if codec == "int8":
+        b = data.size(0)
+        x = data.reshape(b, scales.size(1), -1).to(torch.float32) * scales.unsqueeze(2)
+        return x.view(b, -1)[:, :int(np.prod(shape))].reshape(b, *shape)
+    raise ValueError(f"memory codec {codec!r} is not one of {CODECS}")
+
+def row_bytes(shape, codec, block=INT8_BLOCK):
+    '''
+    return: the encoded bytes of one [M, dim] row, the bytes per stream
+    '''
+    values = int(np.prod(shape))
+    if codec == "int8":
+        blocks = -(-values // block)
+        return blocks * block + blocks * 4
+    return values * {"fp32": 4, "fp16": 2, "bf16": 2}[codec]
+
+def encode(memory_tokens, codec="fp16", block=INT8_BLOCK):
+    '''
+    return: a dict torch.save / torch.load(weights_only=True) can hold, None for None
+    '''
+    if memory_tokens is None:
+        return None
+    data, scales = encode_rows(memory_tokens, codec, block)
+    return {"codec": codec, "shape": list(memory_tokens.shape), "data": data.cpu(), "scales": None if scales is None else scales.cpu()}
+
+def decode(state, device="cpu"):
+    '''
+    state: the dict of encode, or a float32 tensor as written before the codecs
+    return: float32 [B, M, dim] on device, or None
+    '''
+    if state is None:
+        return None
+    if isinstance(state, torch.Tensor):
+        return state.to(device)
+    shape = state["shape"]
+    return decode_rows(state["data"].to(device), None if state["scales"] is None else state["scales"].to(device),
+                       state["codec"], shape[1:]).reshape(shape)
+
+def pack(memory_tokens, codec="fp16", block=INT8_BLOCK):
+    '''
+    return: bytes, a length prefixed json header then the data then the scales
+    '''
+    state = encode(memory_tokens, codec, block)
+    data = state["data"].contiguous().numpy()
+    scales = b"" if state["scales"] is None else state["scales"].contiguous().numpy().tobytes()
+    header = json.dumps({"codec": codec, "shape": state["shape"], "dtype": data.dtype.str, "data": list(data.shape),
+                         "scales": None if state["scales"] is None else list(state["scales"].shape)}).encode("utf-8")
+    return struct.pack("<I", len(header)) + header + data.tobytes() + scales
+
+def unpack(buffer, device="cpu"):
+    '''
+    return: the float32 memory_tokens of the bytes of pack
+    '''
+    length = struct.unpack_from("<I", buffer)[0]
+    header = json.loads(bytes(buffer[4:4 + length]).decode("utf-8"))
+    dtype = np.dtype(header["dtype"])
+    offset = 4 + length
+    count = int(np.prod(header["data"]))
+    data = torch.from_numpy(np.frombuffer(buffer, dtype=dtype, count=count, offset=offset).reshape(header["data"]).copy())
+    scales = None
+    if header["scales"] is not None:
+        scales = torch.from_numpy(np.frombuffer(buffer, dtype=np.float32, count=int(np.prod(header["scales"])),
+                                                offset=offset + count * dtype.itemsize).reshape(header["scales"]).copy())
+    return decode({"codec": header["codec"], "shape": header["shape"], "data": data, "scales": scales}, device)
+
+def codec_errors(memory_tokens, codecs=CODECS, block=INT8_BLOCK):
+    '''
+    return: {codec: {"bytes_per_stream", "ratio", "max_abs_error", "rel_error"}}, the ratio is to fp32
+    '''
+    x = memory_tokens.detach().to(torch.float32)
+    errors = {}
+    for codec in codecs:
+        y = decode_rows(*encode_rows(x, codec, block), codec, x.shape[1:])
+        size = row_bytes(x.shape[1:], codec, block)
+        errors[codec] = {"bytes_per_stream": size, "ratio": round(row_bytes(x.shape[1:], "fp32") / size, 2),
+                         "max_abs_error": float((y - x).abs().max()),
+                         "rel_error": float((y - x).norm() / x.norm().clamp_min(1e-12))}
+    return errors
@@ -0,0 +1,231 @@
+import os
+import sys
+import tempfile
+from collections import OrderedDict
+import numpy as np
+import torch
+import torch.utils.data as data
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from utils.memory_codec import encode_rows, decode_rows, row_bytes
+
+# The memory tokens of every stream (a patient, a video, a sample of the dataset) under its own
+# key, instead of one [B, M, dim] tensor carried from batch to batch whatever samples are in it.
+# gather(keys) puts the rows of the keys of a batch together, scatter(keys, memory) puts the new
+# rows back. The most recently used rows stay in RAM up to budget_mb, the least recently used
+# ones are written to a memory-mapped file and read back (into RAM again) when their key comes
+# back, so the number of streams is bounded by the disk, not the RAM. A key never seen starts
+# from initial (zeros, like the encoder, when None). Every row has the shape of the first one
+# scattered. The rows are kept encoded with a codec of utils/memory_codec.py, in RAM and on disk,
+# and the budget counts the encoded bytes. The linked memory (lmttm) block pointer stays one per model.
+# state() / load_state() carry every row, RAM and disk, through the resume checkpoint of train.py.
+
+class MemoryStore():
+    '''
+    Args:
+    - budget_mb (float): the RAM of the rows kept in memory, 0 keeps every row on disk.
+    - spill_path (str): the file the evicted rows are mapped from, removed by close(), a temporary file by default.
+    - initial (Tensor): [M, dim] or [1, M, dim], the memory of a key never seen.
+    - codec (str): fp32, fp16, bf16 or int8, how the rows are kept.
+    '''
+    def __init__(self, budget_mb=256, spill_path=None, initial=None, codec="fp32") -> None:
+        self.budget_mb = budget_mb
+        self.codec = codec
+        self.initial = None if initial is None else initial.detach().reshape(initial.shape[-2:]).to("cpu", torch.float32)
+        self.shape = None if initial is None else tuple(self.initial.shape)
+        self.capacity = None
+        self.ram = OrderedDict()# key -> (data, scales) of encode_rows, least recently used first
+        self.slots = {}# key -> row of self.disk, the bytes of data then scales
+        self.free = []
+        self.disk = None
+        if spill_path is None:
+            fd, spill_path = tempfile.mkstemp(prefix="memory_store_", suffix=".bin")
+            os.close(fd)
+        self.spill_path = spill_path
+        self.counts = {"ram": 0, "disk": 0, "new": 0, "spilled": 0}
+
+    def _init_rows(self, shape):
+        self.shape = tuple(shape)
+        data, scales = encode_rows(torch.zeros((1,) + self.shape), self.codec)
+        self.layout = (data.numpy().dtype, tuple(data.shape[1:]), None if scales is None else tuple(scales.shape[1:]))
+        self.row_bytes = row_bytes(self.shape, self.codec)
+        self.capacity = int(self.budget_mb * 2**20) // self.row_bytes
+
+    def _grow(self):
+        rows = 0 if self.disk is None else self.disk.shape[0]
+        size = max(1024, rows * 2)
+        if self.disk is not None:
+            self.disk.flush()
+        with open(self.spill_path, "ab") as f:
+            f.truncate(size * self.row_bytes)
+        self.disk = np.memmap(self.spill_path, dtype=np.uint8, mode="r+", shape=(size, self.row_bytes))
+        self.free.extend(range(size - 1, rows - 1, -1))
+
+    def _spill(self, key, row):
+        if not self.free:
+            self._grow()
+        slot = self.free.pop()
+        data, scales = row
+        self.disk[slot] = np.concatenate([data.numpy().reshape(-1).view(np.uint8)] +
+                                         ([] if scales is None else [scales.numpy().view(np.uint8)]))
+        self.slots[key] = slot
+        self.counts["spilled"] += 1
+
+    def _put(self, key, row):
+        slot = self.slots.pop(key, None)
+        if slot is not None:
+            self.free.append(slot)
+        if self.capacity == 0:
+            self._spill(key, row)
+            return
+        self.ram[key] = row
+        self.ram.move_to_end(key)
+        while len(self.ram) > self.capacity:
+            self._spill(*self.ram.popitem(last=False))
+
+    def _read(self, slot):
+        dtype, data_shape, scales_shape = self.layout
+        raw = np.array(self.disk[slot])
+        split = int(np.prod(data_shape)) * dtype.itemsize
+        return (torch.from_numpy(raw[:split].view(dtype).reshape(data_shape)),
+                None if scales_shape is None else torch.from_numpy(raw[split:].view(np.float32).reshape(scales_shape)))
+
+    def _get(self, key):
+        if key in self.ram:
+            self.counts["ram"] += 1
+            self.ram.move_to_end(key)
+            return self.ram[key]
+        if key in self.slots:
+            self.counts["disk"] += 1
+            row = self._read(self.slots[key])
+            if self.capacity:
+                self._put(key, row)
+            return row
+        self.counts["new"] += 1
+        return None
+
+    def gather(self, keys, device="cpu"):
+        '''
+        keys: a list or a 1-d tensor of the keys of the batch rows, None for a stream without a key
+        return: [B, M, dim] float32 on device, None while no row shape is known (the encoder then starts from zeros)
+        '''
+        keys = keys.tolist() if torch.is_tensor(keys) else list(keys)
+        if self.shape is None:
+            self.counts["new"] += len(keys)
+            return None
+        rows = [self._get(key) for key in keys]
+        memory_tokens = (self.initial if self.initial is not None else torch.zeros(self.shape)).expand(len(keys), *self.shape).clone()
+        known = [i for i, row in enumerate(rows) if row is not None]
+        if known:
+            data = torch.stack([rows[i][0] for i in known])
+            scales = None if rows[known[0]][1] is None else torch.stack([rows[i][1] for i in known])
+            memory_tokens[known] = decode_rows(data, scales, self.codec, self.shape)
+        return memory_tokens.to(device)
+
+    def scatter(self, keys, memory_tokens):
+        '''
+        Keep row i of memory_tokens [B, M, dim] as the memory of keys[i], keys of None are not kept.
+        '''
+        keys = keys.tolist() if torch.is_tensor(keys) else list(keys)
+        rows = memory_tokens.detach().to("cpu", torch.float32)
+        if self.capacity is None:
+            if self.shape is not None and tuple(rows.shape[1:]) != self.shape:
+                raise ValueError(f"memory rows of {list(rows.shape[1:])} do not match the initial memory of {list(self.shape)}")
+            self._init_rows(rows.shape[1:])
+        if tuple(rows.shape[1:]) != self.shape:
+            raise ValueError(f"memory rows of {list(rows.shape[1:])} in a store of {list(self.shape)} rows")
+        data, scales = encode_rows(rows, self.codec)
+        for i, key in enumerate(keys):
+            if key is not None:
+                self._put(key, (data[i].clone(), None if scales is None else scales[i].clone()))
+
+    def pop(self, key):
+        '''
+        return: whether key had a memory
+        '''
+        if self.ram.pop(key, None) is not None:
+            return True
+        slot = self.slots.pop(key, None)
+        if slot is None:
+            return False
+        self.free.append(slot)
+        return True
+
+    def state(self):
+        '''
+        return: every row of the store, still encoded, the rows on disk first then those in RAM from the least recently used
+        '''
+        keys = list(self.slots) + list(self.ram)
+        if not keys:
+            return {"codec": self.codec, "shape": self.shape, "keys": [], "data": None, "scales": None}
+        rows = [self._read(self.slots[key]) for key in self.slots] + list(self.ram.values())
+        return {"codec": self.codec, "shape": self.shape, "keys": keys, "data": torch.stack([row[0] for row in rows]),
+                "scales": None if rows[0][1] is None else torch.stack([row[1] for row in rows])}
+
+    def load_state(self, state):
+        '''
+        Put back the rows of state(), the most recently used ones end up in RAM.
+        '''
+        if state["codec"] != self.codec:
+            raise ValueError(f"the stored memory is {state['codec']}, not train.memory_codec={self.codec}")
+        if not state["keys"]:
+            return
+        if self.capacity is None:
+            if self.shape is not None and tuple(state["shape"]) != self.shape:
+                raise ValueError(f"memory rows of {list(state['shape'])} do not match the initial memory of {list(self.shape)}")
+            self._init_rows(state["shape"])
+        if tuple(state["shape"]) != self.shape:
+            raise ValueError(f"memory rows of {list(state['shape'])} in a store of {list(self.shape)} rows")
+        for i, key in enumerate(state["keys"]):
+            self._put(key, (state["data"][i], None if state["scales"] is None else state["scales"][i]))
+
+    def __contains__(self, key):
+        return key in self.ram or key in self.slots
+
+    def __len__(self):
+        return len(self.ram) + len(self.slots)
+
+    def report(self):
+        row_mb = self.row_bytes / 2**20 if self.capacity is not None else 0
+        reads = max(1, self.counts["ram"] + self.counts["disk"] + self.counts["new"])
+        return (f"{len(self)} {self.codec} streams, {len(self.ram)} in RAM ({len(self.ram) * row_mb:.1f}MB), "
+                f"{len(self.slots)} on disk ({len(self.slots) * row_mb:.1f}MB), reads from RAM {self.counts['ram'] / reads:.1%} "
+                f"disk {self.counts['disk'] / reads:.1%} new {self.counts['new'] / reads:.1%}, {self.counts['spilled']} rows spilled")
+
+    def close(self):
+        self.disk = None
+        self.ram.clear()
+        self.slots.clear()
+        self.free = []
+        if os.path.exists(self.spill_path):
+            os.remove(self.spill_path)
+
+def memory_store(spec, split, initial=None):
+    '''
+    return: the MemoryStore of the split of a run, None unless the memory is carried with train.memory_key sample
+    '''
+    if spec.train.memory_key != "sample" or not spec.train.load_memory_tokens:
+        return None
+    os.makedirs(spec.train.memory_spill_dir, exist_ok=True)
+    return MemoryStore(spec.train.memory_store_mb, os.path.join(spec.train.memory_spill_dir, f"{spec.train.name}_{split}.bin"), initial,
+                       spec.train.memory_codec)
+
+class IndexedDataset(data.Dataset):
+    '''
+    The items of dataset with the key of their memory: (input, target, key).
+    Args:
+    - dataset (Dataset): any dataset of (input, target).
+    - keys (Sequence): the key of every item, like a patient ID, its index by default.
+    '''
+    def __init__(self, dataset, keys=None) -> None:
+        super().__init__()
+        if keys is not None and len(keys) != len(dataset):
+            raise ValueError(f"{len(keys)} keys for a dataset of {len(dataset)} items")
+        self.dataset = dataset
+        self.keys = keys
+
+    def __getitem__(self, index):
+        input, target = self.dataset[index]
+        return input, target, index if self.keys is None else self.keys[index]
+
+    def __len__(self):
+        return len(self.dataset)
@@ -0,0 +1,106 @@
+import queue
+import threading
+import time
+import torch
+
+
+class TensorBoardSink():
+    def __init__(self, writer) -> None:
+        self.writer = writer
+
+    def write(self, step, values):
+        for tag, value in values.items():
+            self.writer.add_scalar(tag, value, step)
+
+    def close(self):
+        self.writer.flush()
+
+
+class MetricsLogger():
+    '''
+    Buffered scalar logging for the training loop.
+    Scalars are summed as tensors on their own device, so add() never syncs with the GPU. Every
+    flush_every steps the means are copied to the host without blocking and a background thread
+    waits for the copy and hands the values to the sinks (TensorBoardSink, ...).
+    Args:
+    - sinks (list): objects with write(step, {tag: value}) and close().
+    - flush_every (int): steps between two flushes.
+    '''
+    def __init__(self, sinks, flush_every=10) -> None:
+        self.sinks = sinks
+        self.flush_every = flush_every
+        self.sums = {}
+        self.counts = {}
+        self.steps = 0
+        self.latest = {}# the last flushed means, e.g. for a progress bar
+        self.overhead = 0.0# seconds the training thread spent in add/step/put
+        self.queue = queue.Queue()
+        self.thread = threading.Thread(target=self._worker, daemon=True)
+        self.thread.start()
+
+    def add(self, tag, value):
+        time1 = time.perf_counter()
+        value = value.detach()
+        if tag in self.sums:
+            self.sums[tag] += value
+            self.counts[tag] += 1
+        else:
+            self.sums[tag] = value.float().clone()
+            self.counts[tag] = 1
+        self.overhead += time.perf_counter() - time1
+
+    def step(self, global_step):
+        time1 = time.perf_counter()
+        self.steps += 1
+        if self.steps % self.flush_every == 0:
+            self.flush(global_step)
+        self.overhead += time.perf_counter() - time1
+
+    def flush(self, global_step):
+        if not self.sums:
+            return
+        tags = list(self.sums.keys())
+        means = torch.stack([self.sums[tag] / self.counts[tag] for tag in tags])
+        event = None
+        if means.is_cuda:
+            means = means.to("cpu", non_blocking=True)
+            event = torch.cuda.Event()
+            event.record()
+        self.queue.put((global_step, tags, means, event))
+        self.sums = {}
+        self.counts = {}
+
+    def put(self, global_step, values):
+        # values that are already python numbers skip the accumulation
+        time1 = time.perf_counter()
+        self.queue.put((global_step, list(values.keys()), list(values.values()), None))
+        self.overhead += time.perf_counter() - time1
+
+    def _worker(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            global_step, tags, means, event = item
+            if event is not None:
+                event.synchronize()
+            if isinstance(means, torch.Tensor):
+                means = means.tolist()
+            values = dict(zip(tags, means))
+            self.latest.update(values)
+            for sink in self.sinks:
+                sink.write(global_step, values)
+
+    def report(self):
+        '''
+        return: the mean time per step the training thread spent logging, in microseconds
+        '''
+        return self.overhead / max(self.steps, 1) * 1e6
+
+    def close(self, global_step=None):
+        if global_step is not None:
+            self.flush(global_step)
+        self.queue.put(None)
+        self.thread.join()
+        for sink in self.sinks:
+            sink.close()
@@ -0,0 +1,166 @@
+import os
+import sys
+import time
+from contextlib import contextmanager
+import torch
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Gradient accumulation over micro-batches of one logical batch. Row i of memory_tokens is the
+# memory of row i of the batch, so a micro-batch reads the rows of the memory of its samples and
+# the new memory is put back together in the same order; the learned TokenLearnerMHA queries,
+# one per batch row, are sliced the same way. The losses are weighted by the micro-batch share of
+# the batch, so the accumulated gradient is the gradient of the whole batch (up to dropout, the
+# random positional embeddings and, for preprocess_mode 3dBN, the BatchNorm statistics which are
+# then per micro-batch). This needs model.transformer_batch_first: the transformer block of the
+# old layout attends over the batch axis, so there a micro-batch would see only its own rows.
+
+@contextmanager
+def batch_rows(model, start, end):
+    '''
+    Make the per row parameters of model use the rows start:end of the batch.
+    '''
+    modules = [module for module in model.modules() if hasattr(module, "batch_rows")]
+    for module in modules:
+        module.batch_rows = slice(start, end)
+    try:
+        yield
+    finally:
+        for module in modules:
+            module.batch_rows = slice(None)
+
+def memory_flags(model):
+    '''
+    return: the modules with a memory block pointer (the linked memory of lmttm) and their pointers
+    '''
+    linked = [module for module in model.modules() if hasattr(module, "current_flag")]
+    return linked, [module.current_flag for module in linked]
+
+def micro_batch_step(model, input, target, memory_tokens, criterion, micro_batch, load_memory_tokens=True):
+    '''
+    Forward and backward of one batch in micro-batches of micro_batch rows, optimizer.step() afterwards
+    sees the gradient of the whole batch.
+    memory_tokens: [B, memory_tokens_size, dim] or None
+    return: (the loss of the whole batch, detached, the new memory_tokens)
+    '''
+    b = input.size(0)
+    losses = 0
+    new_memory = []
+    # the linked memory (lmttm) moves its block pointer on every forward, each micro-batch starts from the same block
+    linked, flags = memory_flags(model)
+    for start in range(0, b, micro_batch):
+        end = min(start + micro_batch, b)
+        for module, flag in zip(linked, flags):
+            module.current_flag = flag
+        memory = memory_tokens[start:end] if (load_memory_tokens and memory_tokens is not None) else None
+        with batch_rows(model, start, end):
+            output, memory = model(input[start:end], memory)
+        loss = criterion(output, target[start:end]) * ((end - start) / b)
+        loss.backward()
+        losses = losses + loss.detach()
+        new_memory.append(memory.detach())
+    return losses, torch.cat(new_memory)
+
+class SavedBytes:
+    '''
+    The bytes of the tensors saved for backward, use pack as the pack hook of saved_tensors_hooks.
+    A tensor saved by several ops is counted once and the parameters of model are not counted,
+    the same accounting for activation_bytes and the stage profiler of benchmarks/memory.py.
+    '''
+    def __init__(self, model) -> None:
+        self.params = set(p.data_ptr() for p in model.parameters())
+        self.seen = set()
+        self.total = 0
+
+    def count(self, tensor):
+        '''
+        return: the bytes tensor adds, 0 if it is a parameter or was already counted
+        '''
+        key = (tensor.data_ptr(), tensor.numel(), tensor.dtype)
+        if tensor.data_ptr() in self.params or key in self.seen:
+            return 0
+        self.seen.add(key)
+        nums = tensor.numel() * tensor.element_size()
+        self.total += nums
+        return nums
+
+    def pack(self, tensor):
+        self.count(tensor)
+        return tensor
+
+def activation_bytes(model, input, memory_tokens=None):
+    '''
+    return: the bytes of the tensors saved for backward by one forward of input, parameters excluded
+    '''
+    saved = SavedBytes(model)
+    # the probe must not move the BatchNorm statistics nor the memory block pointer
+    buffers = {key: value.clone() for key, value in model.named_buffers()}
+    linked, flags = memory_flags(model)
+    with torch.autograd.graph.saved_tensors_hooks(saved.pack, lambda tensor: tensor):
+        with batch_rows(model, 0, input.size(0)):
+            model(input, memory_tokens)
+    with torch.no_grad():
+        for key, value in model.named_buffers():
+            value.copy_(buffers[key])
+    for module, flag in zip(linked, flags):
+        module.current_flag = flag
+    return saved.total
+
+def auto_micro_batch(model, sample, batch_size, budget_mb):
+    '''
+    The largest micro-batch whose activations fit in budget_mb, from a linear fit of the
+    activation bytes of micro-batches of 1 and 2 rows.
+    sample: an input batch of at least 2 rows
+    '''
+    one = activation_bytes(model, sample[:1])
+    two = activation_bytes(model, sample[:2])
+    per_row = max(two - one, 1)
+    fixed = one - per_row
+    micro = int((budget_mb * 2**20 - fixed) // per_row)
+    return max(1, min(batch_size, micro))
+
+def measure(model, input, target, criterion, micro_batch, steps=3):
+    '''
+    return: (samples per second, memory in MB) of training steps with micro-batches of micro_batch rows, the
+    memory is the measured peak of the allocator on cuda; on cpu nothing is measured, it is the estimate of
+    activation_bytes for one micro-batch, parameters, gradients and optimizer state excluded
+    '''
+    memory_tokens = None
+    micro_batch_step(model, input, target, memory_tokens, criterion, micro_batch)# warm up
+    model.zero_grad()
+    if input.is_cuda:
+        torch.cuda.synchronize()
+        torch.cuda.reset_peak_memory_stats()
+    time1 = time.time()
+    for _ in range(steps):
+        _, memory_tokens = micro_batch_step(model, input, target, memory_tokens, criterion, micro_batch)
+        model.zero_grad()
+    if input.is_cuda:
+        torch.cuda.synchronize()
+        peak = torch.cuda.max_memory_allocated() / 2**20
+    else:
+        peak = activation_bytes(model, input[:micro_batch], memory_tokens[:micro_batch]) / 2**20
+    return steps * input.size(0) / (time.time() - time1), peak
+
+
+if __name__ == "__main__":
+    from config.configure import config_arg_parser, get_config
+    from config import compile_config
+    parser = config_arg_parser("peak memory and throughput of training steps at several micro-batch sizes")
+    parser.add_argument("--steps", type=int, default=3)
+    args = parser.parse_args()
+    config = get_config(args)
+    spec = compile_config(config)
+    from utils.checkpoint import build_encoder
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+    model = build_encoder(spec, device)
+    b = spec.batch_size
+    input = torch.rand(b, spec.model.in_channels, spec.model.step, spec.train.input_H, spec.train.input_W, device=device)
+    target = torch.randint(0, spec.model.out_class_num, (b,), device=device)
+    criterion = torch.nn.CrossEntropyLoss()
+    # cuda: the measured peak of the allocator, cpu: the estimated activations of one micro-batch
+    print(f"{'micro-batch':>12}{'samples/s':>12}{'peak MB' if device == 'cuda' else 'est. act MB':>14}")
+    micro = b
+    while micro >= 1:
+        speed, peak = measure(model, input, target, criterion, micro, steps=args.steps)
+        print(f"{micro:>12}{speed:>12.1f}{peak:>14.1f}")
+        micro //= 2
@@ -0,0 +1,171 @@
+import time
+from contextlib import contextmanager, nullcontext
+import torch
+
+# Named stages of the forward pass (preprocess, memory read, token learner read, process unit,
+# write, ...). A stage costs one global lookup when profiling is off. Inside StageTimer its wall
+# time and cuda allocations are aggregated per stage, inside Tracer it is a named range of the
+# torch profiler and shows up in the chrome trace.
+
+_timer = None# the active StageTimer
+_ranges = False# True while Tracer records
+_NULL = nullcontext()
+
+class _Stage():
+    __slots__ = ("name", "range")
+
+    def __init__(self, name) -> None:
+        self.name = name
+        self.range = None
+
+    def __enter__(self):
+        if _ranges:
+            self.range = torch.profiler.record_function(self.name)
+            self.range.__enter__()
+        if _timer is not None:
+            _timer.begin(self.name)
+        return self
+
+    def __exit__(self, *args):
+        if _timer is not None:
+            _timer.end()
+        if self.range is not None:
+            self.range.__exit__(*args)
+        return False
+
+def stage(name):
+    '''
+    with stage("process"): ... names the code inside for StageTimer and Tracer.
+    '''
+    if _timer is None and not _ranges:
+        return _NULL
+    return _Stage(name)
+
+
+class StageTimer():
+    '''
+    Aggregates the wall time, the calls and the cuda memory allocated by every stage, nested stages
+    are named by their path, like memory_unit/process. The peak of a stage is exact at every level:
+    the allocator peak is folded into every open stage before it is reset for a nested one.
+    Args:
+    - sync (bool): synchronize cuda around every stage, the times are then those of the kernels. Off,
+      the times on cuda are mostly those of the kernel launches; on, the launch queue drains at every
+      stage boundary, which slows the profiled steps down, more so the smaller the stages.
+    '''
+    def __init__(self, sync=False) -> None:
+        self.sync = sync and torch.cuda.is_available()
+        self.cuda = torch.cuda.is_available()
+        self.stack = []
+        self.times = {}
+        self.calls = {}
+        self.allocated = {}# bytes allocated by the stage and not freed when it ends
+        self.peak = {}# the highest allocation above the start of the stage
+
+    def __enter__(self):
+        global _timer
+        _timer = self
+        return self
+
+    def __exit__(self, *args):
+        global _timer
+        _timer = None
+        return False
+
+    def begin(self, name):
+        if self.sync:
+            torch.cuda.synchronize()
+        path = self.stack[-1][0] + "/" + name if self.stack else name
+        memory = 0
+        if self.cuda:
+            self.fold_peak()
+            memory = torch.cuda.memory_allocated()
+        self.stack.append([path, time.perf_counter(), memory, memory])
+
+    def fold_peak(self):
+        # the allocator has one peak counter: fold it into every open stage, then restart it
+        peak = torch.cuda.max_memory_allocated()
+        for frame in self.stack:
+            frame[3] = max(frame[3], peak)
+        torch.cuda.reset_peak_memory_stats()
+
+    def end(self):
+        if self.sync:
+            torch.cuda.synchronize()
+        if self.cuda:
+            self.fold_peak()
+        path, time1, memory, peak = self.stack.pop()
+        self.times[path] = self.times.get(path, 0.0) + time.perf_counter() - time1
+        self.calls[path] = self.calls.get(path, 0) + 1
+        if self.cuda:
+            self.allocated[path] = self.allocated.get(path, 0) + torch.cuda.memory_allocated() - memory
+            self.peak[path] = max(self.peak.get(path, 0), peak - memory)
+
+    def report(self):
+        '''
+        return: a table of the stages, slowest first
+        '''
+        lines = [f"{'stage':<40}{'calls':>8}{'total ms':>12}{'ms/call':>10}{'alloc MB':>10}{'peak MB':>10}"]
+        for path in sorted(self.times, key=self.times.get, reverse=True):
+            alloc = f"{self.allocated[path] / 2**20:>10.1f}" if self.cuda else f"{'-':>10}"
+            peak = f"{self.peak[path] / 2**20:>10.1f}" if self.cuda else f"{'-':>10}"
+            lines.append(f"{path:<40}{self.calls[path]:>8}{self.times[path] * 1000:>12.1f}"
+                         f"{self.times[path] * 1000 / self.calls[path]:>10.2f}{alloc}{peak}")
+        return "\n".join(lines)
+
+
+class Tracer():
+    '''
+    Records steps with the torch profiler and exports them as a chrome trace (chrome://tracing, perfetto).
+    Args:
+    - path (str): the .json file of the trace.
+    - steps (int): the steps recorded, after one step of warm up.
+    '''
+    def __init__(self, path, steps=5) -> None:
+        activities = [torch.profiler.ProfilerActivity.CPU]
+        if torch.cuda.is_available():
+            activities.append(torch.profiler.ProfilerActivity.CUDA)
+        self.path = path
+        self.profiler = torch.profiler.profile(activities=activities,
+                                               schedule=torch.profiler.schedule(wait=0, warmup=1, active=steps, repeat=1),
+                                               on_trace_ready=self.export, profile_memory=True)
+
+    def export(self, profiler):
+        global _ranges
+        _ranges = False# the recorded steps are over
+        profiler.export_chrome_trace(self.path)
+        print(f"chrome trace written to {self.path}")
+
+    def __enter__(self):
+        global _ranges
+        _ranges = True
+        self.profiler.__enter__()
+        return self
+
+    def step(self):
+        self.profiler.step()
+
+    def __exit__(self, *args):
+        global _ranges
+        _ranges = False
+        return self.profiler.__exit__(*args)
+
+def add_profiling_args(parser):
+    parser.add_argument("--trace", default=None, help="write a chrome trace of the first steps to this .json file")
+    parser.add_argument("--trace-steps", type=int, default=5, help="steps recorded in the trace")
+    parser.add_argument("--stage-times", action="store_true", help="print the time and cuda memory of every stage at the end")
+    parser.add_argument("--stage-sync", action="store_true",
+                        help="synchronize cuda around every stage of --stage-times, kernel times instead of launch times but slower steps")
+    return parser
+
+@contextmanager
+def profiling(trace_path=None, trace_steps=5, stage_times=False, stage_sync=False):
+    '''
+    The options of the train / predict scripts in one context: yields (tracer or None, timer or None),
+    call tracer.step() after every step, the timer report is printed at the end.
+    '''
+    tracer = Tracer(trace_path, trace_steps) if trace_path else None
+    timer = StageTimer(sync=stage_sync) if stage_times else None
+    with (tracer or nullcontext()), (timer or nullcontext()):
+        yield tracer, timer
+    if timer is not None:
+        print(timer.report())
@@ -1,6 +1,10 @@
 import os
 import random
 import shutil
+import numpy as np
+
+SPLIT_NAMES = ["train", "val", "test"]
+
 def spilt(source_dir:str, target_dir1:str, percentage1, target_dir2:str, percentage2,traget_dir3:str,percentage3):
     '''
     source_dir: the source dir, like f:/imgs
@@ -34,7 +38,64 @@ def spilt(source_dir:str, target_dir1:str, percentage1, target_dir2:str, percent
         for img in test_imgs:
             shutil.move(os.path.join(source_dir, subdir, img), os.path.join(traget_dir3, subdir, img)) 
 
+def spilt_manifest(source_dir:str, manifest_path:str, percentage1, percentage2, percentage3, seed=3407):
+    '''
+    Same split as spilt(), but nothing is moved: the clip dirs stay in source_dir and the
+    split is written to a manifest, so re-splitting with another seed or ratio is cheap and
+    several manifests can share one copy of the data.
+    source_dir: the source dir, like f:/imgs
+    manifest_path: the manifest file, like f:/imgs_seed3407.npz
+    percentage1: the percentage of train, like 0.7
+    percentage2: the percentage of val, like 0.2
+    percentage3: the percentage of test, like 0.1
+    seed: the shuffle seed
+    '''
+    rng = random.Random(seed)
+    labels = sorted(os.listdir(source_dir))#imgs/classes
+    paths, targets, splits = [], [], []
+    for label, subdir in enumerate(labels):
+        imgs = sorted(os.listdir(os.path.join(source_dir, subdir)))
+        rng.shuffle(imgs)
+        n_train = int(len(imgs) * percentage1)
+        n_val = int(len(imgs) * (percentage1 + percentage2))
+        for i, img in enumerate(imgs):
+            paths.append(subdir + "/" + img)# relative to root, so the manifest survives moving the data
+            targets.append(label)
+            splits.append(0 if i < n_train else 1 if i < n_val else 2)
+    if os.path.dirname(manifest_path) and not os.path.exists(os.path.dirname(manifest_path)):
+        os.makedirs(os.path.dirname(manifest_path))
+    with open(manifest_path, "wb") as f:# np.savez appends .npz to a bare path
+        np.savez_compressed(f,
+                            root=np.array(os.path.abspath(source_dir)),
+                            classes=np.array(labels),
+                            paths=np.array(paths),
+                            labels=np.array(targets, dtype=np.int16),
+                            splits=np.array(splits, dtype=np.int8),
+                            percentages=np.array([percentage1, percentage2, percentage3]),
+                            seed=np.array(seed))
+    return manifest_path
+
+def load_manifest(manifest_path:str, split=None, root=None):
+    '''
+    manifest_path: the manifest written by spilt_manifest
+    split: train, val, test or None for all clips
+    root: overrides the data root stored in the manifest
+    return: (absolute clip paths, labels, class names)
+    '''
+    with np.load(manifest_path, allow_pickle=False) as manifest:
+        root = str(manifest["root"]) if root is None else root
+        paths = manifest["paths"]
+        labels = manifest["labels"].astype(np.int64)
+        classes = [str(c) for c in manifest["classes"]]
+        if split is not None:
+            keep = manifest["splits"] == SPLIT_NAMES.index(split)
+            paths = paths[keep]
+            labels = labels[keep]
+    paths = [os.path.join(root, str(p)) for p in paths]
+    return paths, labels, classes
+
 
 if __name__ == "__main__":
     pass
-    # spilt(r"F:\imgs",r"F:\imgs1\train",0.6,r"F:\imgs1\val",0.2,r"F:\imgs1\test",0.2)
\ No newline at end of file
+    # spilt(r"F:\imgs",r"F:\imgs1\train",0.6,r"F:\imgs1\val",0.2,r"F:\imgs1\test",0.2)
+    # spilt_manifest(r"F:\imgs",r"F:\imgs_manifest\seed3407.npz",0.6,0.2,0.2,seed=3407)
\ No newline at end of file
@@ -0,0 +1,145 @@
+import os
+import glob
+import json
+import shutil
+import struct
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import pandas as pd
+from tensorboard.compat.proto import event_pb2
+from tensorboard.util import tensor_util
+
+# Export the scalars of many tensorboard runs into one columnar table keyed by (run, tag, step).
+# Event files are read as raw TFRecords from the byte offset reached by the previous export
+# (kept in <out>.state.json), so re-running only parses the events written since. A .csv output
+# is appended to; a .parquet output is a directory getting one part file per export, so nothing
+# written before is read back (pd.read_parquet(out) loads all the parts). A run is named by the
+# path of its dir relative to the part of the pattern before the first wildcard, so
+# ./logs/*/train names logs/exp0/train "exp0/train".
+
+COLUMNS = ["run", "tag", "step", "wall_time", "value"]
+
+def read_events(path:str, offset=0):
+    '''
+    path: an events.out.tfevents.* file
+    offset: the byte offset to start from
+    return: (rows of [tag, step, wall_time, value], the offset after the last complete record)
+    '''
+    rows = []
+    with open(path, "rb") as f:
+        f.seek(offset)
+        while True:
+            header = f.read(12)# uint64 length, uint32 masked crc of the length
+            if len(header) < 12:
+                break
+            length = struct.unpack("<Q", header[:8])[0]
+            data = f.read(length)
+            crc = f.read(4)
+            if len(data) < length or len(crc) < 4:
+                break# the writer is still appending this record, pick it up next time
+            offset = f.tell()
+            event = event_pb2.Event.FromString(data)
+            for value in event.summary.value:
+                if value.HasField("simple_value"):
+                    rows.append([value.tag, event.step, event.wall_time, value.simple_value])
+                elif value.HasField("tensor") and value.metadata.plugin_data.plugin_name == "scalars":
+                    rows.append([value.tag, event.step, event.wall_time, float(tensor_util.make_ndarray(value.tensor))])
+    return rows, offset
+
+def _read_file(args):
+    run, path, offset = args
+    rows, offset = read_events(path, offset)
+    return run, path, rows, offset
+
+def pattern_root(pattern:str):
+    '''
+    return: the dirs of pattern before the first one with a wildcard
+    '''
+    parts = os.path.normpath(pattern).split(os.sep)
+    fixed = []
+    for part in parts[:-1]:
+        if glob.has_magic(part):
+            break
+        fixed.append(part)
+    return os.sep.join(fixed) or "."
+
+def find_event_files(pattern:str):
+    '''
+    pattern: a glob of run dirs, like ./logs/exp*_train
+    return: [(run name, event file path)], the run name is the run dir relative to pattern_root(pattern)
+    '''
+    root_dir = pattern_root(pattern)
+    files = []
+    for run_dir in sorted(glob.glob(pattern)):
+        if not os.path.isdir(run_dir):
+            continue
+        run = os.path.relpath(run_dir, root_dir).replace(os.sep, "/")
+        for root, dirs, names in os.walk(run_dir):
+            for name in sorted(names):
+                if "tfevents" in name:
+                    files.append((run, os.path.join(root, name)))
+    return files
+
+def write_part(frame, out_dir:str, fresh:bool):
+    '''
+    Write frame as the next part file of the parquet dir out_dir, the old parts are removed when fresh.
+    '''
+    if fresh and os.path.isdir(out_dir):
+        shutil.rmtree(out_dir)
+    os.makedirs(out_dir, exist_ok=True)
+    if len(frame) == 0:
+        return
+    part = len([name for name in os.listdir(out_dir) if name.startswith("part-") and name.endswith(".parquet")])
+    path = os.path.join(out_dir, f"part-{part:05d}.parquet")
+    frame.to_parquet(path + ".tmp", index=False)
+    os.replace(path + ".tmp", path)
+
+def export_runs(pattern:str, out_path:str, workers=4):
+    '''
+    pattern: a glob of run dirs, like ./logs/exp*_train
+    out_path: the output, a .csv file or a .parquet dir of part files
+    workers: the number of processes reading event files
+    return: the number of new rows
+    '''
+    state_path = out_path + ".state.json"
+    state = {}
+    if os.path.exists(state_path) and os.path.exists(out_path):
+        with open(state_path, "r") as f:
+            state = json.load(f)
+
+    jobs = []
+    for run, path in find_event_files(pattern):
+        offset = state.get(path, 0)
+        if os.path.getsize(path) > offset:
+            jobs.append((run, path, offset))
+
+    frames = []
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for run, path, rows, offset in pool.map(_read_file, jobs):
+            state[path] = offset
+            if rows:
+                frame = pd.DataFrame(rows, columns=COLUMNS[1:])
+                frame.insert(0, "run", run)
+                frames.append(frame)
+    new = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=COLUMNS)
+    new = new.sort_values(["run", "tag", "step"], kind="stable")
+
+    fresh = not os.path.exists(state_path) or not os.path.exists(out_path)# no state, rewrite from scratch
+    if out_path.endswith(".csv"):
+        new.to_csv(out_path, mode="w" if fresh else "a", header=fresh, index=False)
+    else:
+        write_part(new, out_path, fresh)
+
+    with open(state_path + ".tmp", "w") as f:
+        json.dump(state, f)
+    os.replace(state_path + ".tmp", state_path)
+    return sum(len(frame) for frame in frames)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="export tensorboard scalars of many runs into one parquet/csv file")
+    parser.add_argument("pattern", help="glob of run dirs, like ./logs/exp*_train")
+    parser.add_argument("out", help="output, a .csv file or a .parquet dir of part files")
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    args = parser.parse_args()
+    nums = export_runs(args.pattern, args.out, workers=args.workers)
+    print(f"exported {nums} new rows to {args.out}")
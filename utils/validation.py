@@ -0,0 +1,184 @@
+import os
+import sys
+import time
+import queue
+import multiprocessing as mp
+import numpy as np
+import torch
+import torch.utils.data as data
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from utils.micro_batch import memory_flags
+from utils.checkpoint import build_encoder
+
+# Validation during training without stopping it for a whole pass of the val set.
+#   full:   the whole val_loader at every check, like before
+#   subset: a fixed random subset of the val set at every check, the whole set at the end of each epoch
+#   async:  a cpu snapshot of the weights and the memory is evaluated on the whole val set by a
+#           background process while training goes on, a check is skipped while the last one still runs
+# Every pass starts from a copy of the training memory and evaluates with its own counters, so the
+# training memory is never overwritten and the accuracy is that of the pass, not cumulative. The
+# block pointer of the linked memory (lmttm) is put back after the pass too, and the async worker
+# starts each pass from the pointer of the snapshot, not from where its own last pass stopped.
+
+def evaluate(model, loader, memory_tokens=None, load_memory_tokens=True, device="cuda"):
+    '''
+    model: the encoder, its train / eval mode and memory block pointers are restored afterwards
+    memory_tokens: the memory the pass starts from, it is not modified
+    return: the accuracy of the pass in percent
+    '''
+    was_training = model.training
+    linked, flags = memory_flags(model)
+    model.eval()
+    if memory_tokens is not None:
+        memory_tokens = memory_tokens.detach().clone()
+    correct = 0
+    total = 0
+    with torch.no_grad():
+        for val_x, val_y in loader:
+            val_x = val_x.to(device, dtype=torch.float32)
+            val_y = val_y.to(device, dtype=torch.long).squeeze(1)
+            if load_memory_tokens:
+                out, memory_tokens = model(val_x, memory_tokens)
+            else:
+                out, _ = model(val_x, memory_tokens=None)
+            correct += (torch.argmax(out, dim=1) == val_y).sum()# stays on the device until the end of the pass
+            total += val_y.size(0)
+    model.train(was_training)
+    for module, flag in zip(linked, flags):
+        module.current_flag = flag
+    if total == 0:
+        return 0.0
+    return (int(correct) / total) * 100
+
+def subset_loader(loader, fraction, seed=3407):
+    '''
+    A loader over a fixed random fraction of the dataset of loader, at least one batch.
+    '''
+    dataset = loader.dataset
+    batch_size = loader.batch_size
+    nums = max(batch_size, int(len(dataset) * fraction) // batch_size * batch_size)
+    nums = min(nums, len(dataset))
+    indices = np.random.RandomState(seed).choice(len(dataset), nums, replace=False)
+    return data.DataLoader(data.Subset(dataset, sorted(indices.tolist())), batch_size=batch_size, num_workers=0,
+                           drop_last=True, shuffle=False)
+
+def _async_worker(spec, config, jobs, results):
+    from utils.get_data_iter import get_dataloader
+    model = build_encoder(spec)
+    val_loader = get_dataloader("val", config=config, download=False, transform=None)
+    while True:
+        job = jobs.get()
+        if job is None:
+            break
+        step, state_dict, memory_tokens, flags = job
+        time1 = time.time()
+        model.load_state_dict(state_dict)
+        for module, flag in zip(memory_flags(model)[0], flags):
+            module.current_flag = flag
+        acc = evaluate(model, val_loader, memory_tokens, spec.train.load_memory_tokens, device="cpu")
+        results.put((step, acc, time.time() - time1))
+
+
+class ValidationScheduler():
+    '''
+    Runs the validation of the training loop, see the modes above.
+    Args:
+    - mode (str): full, subset or async.
+    - model: the encoder being trained.
+    - val_loader: the loader of the whole val set.
+    - spec: the RuntimeSpec, async mode builds its own model from it.
+    - config: the configure, async mode builds its own val loader from it.
+    - device (str): the device of the model.
+    - subset (float): the fraction of the val set evaluated by a check in subset mode.
+    '''
+    def __init__(self, mode, model, val_loader, spec, config, device="cuda", subset=0.25) -> None:
+        self.mode = mode
+        self.model = model
+        self.val_loader = val_loader
+        self.device = device
+        self.load_memory_tokens = spec.train.load_memory_tokens
+        self.checks = 0
+        self.skipped = 0
+        self.blocked = 0.0# seconds the training thread spent validating
+        self.full_passes = []# seconds of each pass over the whole val set
+        if mode == "subset":
+            self.subset_loader = subset_loader(val_loader, subset)
+        if mode == "async":
+            ctx = mp.get_context("spawn")
+            self.jobs = ctx.Queue()
+            self.results = ctx.Queue()
+            self.pending = 0
+            self.process = ctx.Process(target=_async_worker, args=(spec, config, self.jobs, self.results), daemon=True)
+            self.process.start()
+
+    def check(self, step, memory_tokens):
+        '''
+        Called every val_gap steps.
+        return: [(step, acc)] of the passes finished since the last call
+        '''
+        time1 = time.time()
+        self.checks += 1
+        finished = []
+        if self.mode == "full":
+            acc = evaluate(self.model, self.val_loader, memory_tokens, self.load_memory_tokens, self.device)
+            self.full_passes.append(time.time() - time1)
+            finished.append((step, acc))
+        elif self.mode == "subset":
+            acc = evaluate(self.model, self.subset_loader, memory_tokens, self.load_memory_tokens, self.device)
+            finished.append((step, acc))
+        elif self.mode == "async":
+            finished = self.poll()
+            if self.pending > 0:
+                self.skipped += 1# the worker is still on the last snapshot
+            else:
+                state_dict = {key: value.detach().to("cpu", copy=True) for key, value in self.model.state_dict().items()}
+                memory = memory_tokens.detach().to("cpu", copy=True) if memory_tokens is not None else None
+                self.jobs.put((step, state_dict, memory, memory_flags(self.model)[1]))
+                self.pending += 1
+        self.blocked += time.time() - time1
+        return finished
+
+    def epoch_end(self, step, memory_tokens):
+        '''
+        Called at the end of every epoch.
+        return: [(step, acc)] of the passes finished since the last call
+        '''
+        if self.mode != "subset":
+            return self.poll()
+        time1 = time.time()
+        acc = evaluate(self.model, self.val_loader, memory_tokens, self.load_memory_tokens, self.device)
+        self.full_passes.append(time.time() - time1)
+        self.blocked += time.time() - time1
+        return [(step, acc)]
+
+    def poll(self, block=False):
+        finished = []
+        if self.mode != "async":
+            return finished
+        while self.pending > 0:
+            try:
+                step, acc, seconds = self.results.get(block=block)
+            except queue.Empty:
+                break
+            self.pending -= 1
+            self.full_passes.append(seconds)
+            finished.append((step, acc))
+        return finished
+
+    def close(self):
+        '''
+        Waits for the running pass of async mode.
+        return: [(step, acc)] of the passes finished since the last call
+        '''
+        finished = self.poll(block=True)
+        if self.mode == "async":
+            self.jobs.put(None)
+            self.process.join()
+        return finished
+
+    def report(self):
+        full_pass = sum(self.full_passes) / len(self.full_passes) if self.full_passes else 0.0
+        saved = self.checks * full_pass - self.blocked
+        return (f"validation ({self.mode}) blocked training for {self.blocked:.1f}s over {self.checks} checks"
+                f"{f' ({self.skipped} skipped while busy)' if self.skipped else ''}, a full pass takes {full_pass:.1f}s,"
+                f" about {saved:.1f}s saved against validating the whole val set at every check")